@@ -1,11 +1,17 @@
+import asyncio
 import json
 from io import BytesIO
+import httpx
 import requests
 from PIL import Image
 
-from core.models.product import Product
+from api.lykdat_cache import lykdat_cache
+from core.models.product import Product, fetch_product_images
+from core.product_results import ProductResults
 from utils.constants import LykdatAPI as Constants
 from utils.env_manager import get_api_key, LYKDAT_API_KEY_ENV
+from utils.http_client import http_client, get_async_http_client
+from utils.rate_limiter import lykdat_rate_limiter, RateLimitExceededError
 
 
 # Get API key from environment variables
@@ -36,21 +42,55 @@ def build_lykdat_params(image):
 
 def call_lykdat_global_search(image):
     """
-    Sends an image to the Lykdat global search API and returns the JSON response.
+    Sends an image to the Lykdat global search API and returns the JSON response,
+    or None if the request failed.
     """
+    try:
+        # Shared quota of all chats, see utils.rate_limiter
+        lykdat_rate_limiter.acquire_blocking()
+    except RateLimitExceededError as e:
+        print(f"{Constants.API_REQUEST_ERROR_MESSAGE} {str(e)}")
+        return None
+
     payload, files = build_lykdat_params(image=image)
-    response = None
 
     try:
-        response = requests.post(Constants.LYKDAT_GLOBAL_SEARCH_URL, data=payload, files=files)
+        response = http_client.post(Constants.LYKDAT_GLOBAL_SEARCH_URL, data=payload, files=files)
         response.raise_for_status()  # Raise exception for bad status codes
+        return response.json()
 
     except requests.exceptions.RequestException as e:
         print(f"{Constants.API_REQUEST_ERROR_MESSAGE} {str(e)}")
     except Exception as e:
         print(f"Unexpected error: {str(e)}")
 
-    return response.json()
+    return None
+
+
+async def call_lykdat_global_search_async(image):
+    """
+    Sends an image to the Lykdat global search API on the event loop and returns the JSON response,
+    or None if the request failed.
+    """
+    try:
+        await lykdat_rate_limiter.acquire()
+    except RateLimitExceededError as e:
+        print(f"{Constants.API_REQUEST_ERROR_MESSAGE} {str(e)}")
+        return None
+
+    payload, files = build_lykdat_params(image=image)
+
+    try:
+        response = await get_async_http_client().post(Constants.LYKDAT_GLOBAL_SEARCH_URL, data=payload, files=files)
+        response.raise_for_status()
+        return response.json()
+
+    except httpx.HTTPError as e:
+        print(f"{Constants.API_REQUEST_ERROR_MESSAGE} {str(e)}")
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}")
+
+    return None
 
 
 def call_lykdat_global_search_mock(image):
@@ -62,10 +102,24 @@ def parse_lykdat_response(response_json, limit=5) -> list[Product]:
     """
     Parses the response from Lykdat API and extracts product information.
     """
-    lykdat_result_products = response_json["data"]["result_groups"][0]["similar_products"][:limit]
+    return fetch_product_images(build_lykdat_products(response_json, limit=limit))
+
+
+def build_lykdat_products(response_json, limit=5) -> list[Product]:
+    """
+    Builds Product objects from the response of the Lykdat API, without downloading their images.
+    """
+    lykdat_result_products = get_similar_products(response_json)[:limit]
     return convert_to_product_objects_list(products=lykdat_result_products)
 
 
+def get_similar_products(response_json) -> list[dict]:
+    """
+    Returns all the raw similar products of a Lykdat API response, best match first.
+    """
+    return response_json["data"]["result_groups"][0]["similar_products"]
+
+
 def convert_to_product_objects_list(products: dict) -> list[Product]:
     """
     Converts raw product data from the Lykdat API response into a list of Product objects.
@@ -73,24 +127,78 @@ def convert_to_product_objects_list(products: dict) -> list[Product]:
     parsed_results = []
 
     for product in products:
-        parsed_result = Product(response=product, source="lykdat")
+        parsed_result = Product.from_lykdat(product)
         parsed_results.append(parsed_result)
 
     return parsed_results
 
 
+def is_cacheable_response(response_json) -> bool:
+    """
+    Only successful search responses are cached.
+    """
+    return isinstance(response_json, dict) and bool(response_json.get("data"))
+
+
+def get_lykdat_response(image: Image):
+    """
+    Returns the Lykdat global search response for an image, from the cache when a near-identical
+    crop was searched before.
+    """
+    if lykdat_cache is None:
+        return call_lykdat_global_search(image=convert_pil_to_bytes(image))
+
+    signature, lykdat_response = lykdat_cache.get(image)
+    if lykdat_response is None:
+        lykdat_response = call_lykdat_global_search(image=convert_pil_to_bytes(image))
+        if is_cacheable_response(lykdat_response):
+            lykdat_cache.put(signature, lykdat_response)
+
+    return lykdat_response
+
+
+async def get_lykdat_response_async(image: Image):
+    """
+    The asyncio counterpart of get_lykdat_response. Returns None if the search failed.
+    Cache lookups run in a thread, since they hash the crop and may read from disk.
+    """
+    if lykdat_cache is None:
+        return await call_lykdat_global_search_async(image=convert_pil_to_bytes(image))
+
+    signature, lykdat_response = await asyncio.to_thread(lykdat_cache.get, image)
+    if lykdat_response is None:
+        lykdat_response = await call_lykdat_global_search_async(image=convert_pil_to_bytes(image))
+        if is_cacheable_response(lykdat_response):
+            await asyncio.to_thread(lykdat_cache.put, signature, lykdat_response)
+
+    return lykdat_response
+
+
 def search_lykdat(image: Image, limit=5):
     """
     Conducts a Lykdat API search using a given image and returns parsed product results.
     """
-    img_byte_arr = convert_pil_to_bytes(image)
+    lykdat_response = get_lykdat_response(image)
+    if lykdat_response is None:
+        return []
 
-    lykdat_response = call_lykdat_global_search(image=img_byte_arr)
     parsed_response = parse_lykdat_response(lykdat_response, limit=limit)
 
     return parsed_response
 
 
+async def search_lykdat_results_async(image: Image) -> ProductResults:
+    """
+    Searches Lykdat with an image and returns all the results, to be turned into products on demand.
+    Returns empty results if the search failed.
+    """
+    lykdat_response = await get_lykdat_response_async(image)
+    if lykdat_response is None:
+        return ProductResults(raw_results=[])
+
+    return ProductResults(raw_results=get_similar_products(lykdat_response), source="lykdat")
+
+
 def search_images_list(images_list):
     """
     Searches multiple images using the Lykdat API and returns results for each.
@@ -0,0 +1,211 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+from utils.cache import LRUCache
+from utils.constants import LykdatCache as Constants
+from utils.image_hashing import PhotoSignature, hamming_distance
+from utils.metrics import metrics
+
+
+class LykdatCache:
+    """
+    A cache of Lykdat global search responses, keyed by a perceptual fingerprint of the searched crop.
+
+    Responses are kept in an in-memory LRU and in a SQLite database, so they survive restarts.
+    A crop reuses a cached response when its fingerprint is within `max_distance` bits of the cached
+    crop's, and the two crops also have the same size and grayscale thumbnails within
+    `max_pixel_difference` levels on average. This covers both returning to an item already searched
+    and the same item cut from a re-sent photo, while different items cropped onto the same plain
+    background, whose fingerprints often collide, are searched on their own.
+    Entries expire after `ttl_seconds` and both tiers are bounded in size.
+
+    Hits are counted in utils.metrics as "lykdat_cache.hits" (memory) and "lykdat_cache.disk_hits",
+    misses as "lykdat_cache.misses" and candidates whose signature did not match as
+    "lykdat_cache.near_hits_rejected". The overall hit rate is published as "lykdat_cache.hit_rate".
+    """
+    def __init__(self,
+                 database_path: str = Constants.DATABASE_PATH,
+                 max_entries: int = Constants.MAX_ENTRIES,
+                 max_megabytes: int = Constants.MAX_MEGABYTES,
+                 disk_max_entries: int = Constants.DISK_MAX_ENTRIES,
+                 ttl_seconds: float = Constants.TTL_SECONDS,
+                 max_distance: int = Constants.MAX_HASH_DISTANCE,
+                 max_pixel_difference: float = Constants.MAX_PIXEL_DIFFERENCE):
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.max_pixel_difference = max_pixel_difference
+        self.disk_max_entries = disk_max_entries
+
+        self._memory = LRUCache(name="lykdat_cache.memory",
+                                max_entries=max_entries,
+                                max_bytes=max_megabytes * 2 ** 20,
+                                ttl_seconds=ttl_seconds,
+                                size_of=lambda entry: len(entry[1]))
+        self._lock = threading.Lock()
+        self._connection = self._open_database(database_path) if database_path else None
+
+    @staticmethod
+    def _open_database(database_path: str):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+            connection = sqlite3.connect(database_path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(responses)")]
+            if columns and "thumbnail" not in columns:
+                # Written before entries carried a signature, those cannot be confirmed
+                connection.execute("DROP TABLE responses")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "fingerprint TEXT PRIMARY KEY, response TEXT NOT NULL, stored_at REAL NOT NULL, "
+                "width INTEGER NOT NULL, height INTEGER NOT NULL, thumbnail BLOB NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)")
+            connection.commit()
+            return connection
+        except (sqlite3.Error, OSError) as e:
+            print(f"{Constants.DATABASE_ERROR_MESSAGE} {e}")
+            return None
+
+    @staticmethod
+    def signature(image: Image.Image) -> PhotoSignature:
+        """
+        Returns the signature of a crop, whose perceptual hash is the crop's fingerprint.
+        """
+        return PhotoSignature(image, hash_size=Constants.HASH_SIZE, thumbnail_size=Constants.THUMBNAIL_SIZE)
+
+    def _matches(self, signature: PhotoSignature, candidate: PhotoSignature) -> bool:
+        return signature.matches(candidate, self.max_distance, self.max_pixel_difference)
+
+    def _publish_hit_rate(self):
+        hits = metrics.get_counter("lykdat_cache.hits") + metrics.get_counter("lykdat_cache.disk_hits")
+        lookups = hits + metrics.get_counter("lykdat_cache.misses")
+        metrics.set_gauge("lykdat_cache.hit_rate", hits / lookups if lookups else 0.0)
+
+    def _find_in_memory(self, signature: PhotoSignature):
+        entry = self._memory.peek(signature.perceptual_hash)
+        if entry is not None and self._matches(signature, entry[2]):
+            return entry
+
+        for candidate_fingerprint, candidate in reversed(self._memory.items()):
+            if hamming_distance(candidate_fingerprint, signature.perceptual_hash) > self.max_distance:
+                continue
+            if self._matches(signature, candidate[2]):
+                return candidate
+            metrics.increment("lykdat_cache.near_hits_rejected")
+        return None
+
+    def _find_on_disk(self, signature: PhotoSignature):
+        oldest_valid = time.time() - self.ttl_seconds
+        with self._lock:
+            # Only the fingerprints are scanned, signatures are loaded for the candidates alone
+            rows = self._connection.execute(
+                "SELECT fingerprint FROM responses WHERE stored_at > ?", (oldest_valid,)
+            ).fetchall()
+
+            candidates = []
+            for (candidate_fingerprint,) in rows:
+                distance = hamming_distance(int(candidate_fingerprint, 16), signature.perceptual_hash)
+                if distance <= self.max_distance:
+                    candidates.append((distance, candidate_fingerprint))
+
+            # Closest first, the response body is loaded for the first confirmed candidate only
+            for _, candidate_fingerprint in sorted(candidates):
+                width, height, thumbnail = self._connection.execute(
+                    "SELECT width, height, thumbnail FROM responses WHERE fingerprint = ?", (candidate_fingerprint,)
+                ).fetchone()
+                candidate = PhotoSignature.from_record(int(candidate_fingerprint, 16), (width, height), thumbnail)
+                if not self._matches(signature, candidate):
+                    metrics.increment("lykdat_cache.near_hits_rejected")
+                    continue
+
+                row = self._connection.execute(
+                    "SELECT response FROM responses WHERE fingerprint = ?", (candidate_fingerprint,)
+                ).fetchone()
+                return row[0]
+        return None
+
+    def get(self, image: Image.Image) -> tuple:
+        """
+        Looks up the response for a crop, first in memory and then on disk.
+
+        Args:
+            image (Image): The crop about to be searched.
+
+        Returns:
+            tuple: (PhotoSignature of the crop, response JSON or None)
+        """
+        signature = self.signature(image)
+
+        entry = self._find_in_memory(signature)
+        if entry is not None:
+            metrics.increment("lykdat_cache.hits")
+            self._publish_hit_rate()
+            return signature, entry[0]
+
+        response = None
+        if self._connection is not None:
+            try:
+                response = self._find_on_disk(signature)
+            except sqlite3.Error as e:
+                print(f"{Constants.DATABASE_ERROR_MESSAGE} {e}")
+
+        if response is not None:
+            metrics.increment("lykdat_cache.disk_hits")
+            response_json = json.loads(response)
+            self._memory.put(signature.perceptual_hash, (response_json, response, signature))
+        else:
+            metrics.increment("lykdat_cache.misses")
+            response_json = None
+
+        self._publish_hit_rate()
+        return signature, response_json
+
+    def put(self, signature: PhotoSignature, response_json: dict):
+        """
+        Stores the response of a successful search in memory and on disk.
+
+        Args:
+            signature (PhotoSignature): The signature of the searched crop, as returned by get.
+            response_json (dict): The search response.
+        """
+        response = json.dumps(response_json)
+        self._memory.put(signature.perceptual_hash, (response_json, response, signature))
+
+        if self._connection is None:
+            return
+
+        try:
+            with self._lock:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses (fingerprint, response, stored_at, width, height, thumbnail) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (format(signature.perceptual_hash, "x"), response, time.time(),
+                     signature.size[0], signature.size[1], signature.thumbnail_bytes())
+                )
+                # Drop expired entries, then the oldest ones beyond the size limit
+                self._connection.execute("DELETE FROM responses WHERE stored_at <= ?",
+                                         (time.time() - self.ttl_seconds,))
+                self._connection.execute(
+                    "DELETE FROM responses WHERE fingerprint IN ("
+                    "SELECT fingerprint FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_max_entries,)
+                )
+                self._connection.commit()
+        except sqlite3.Error as e:
+            print(f"{Constants.DATABASE_ERROR_MESSAGE} {e}")
+
+    def clear(self):
+        self._memory.clear()
+        if self._connection is not None:
+            with self._lock:
+                self._connection.execute("DELETE FROM responses")
+                self._connection.commit()
+
+
+# Process-wide cache of Lykdat responses
+lykdat_cache = LykdatCache() if Constants.ENABLED else None
@@ -1,12 +1,14 @@
 import json
 
-import requests
 from PIL import Image
 import pytesseract
 
 from utils.constants import SerpAPI as Constants
-from core.models.product import Product
+from api.serp_cache import serp_cache
+from core.models.product import Product, fetch_product_images, fetch_product_images_async
 from utils.env_manager import get_api_key, SERPAPI_KEY_ENV
+from utils.http_client import http_client, get_async_http_client
+from utils.rate_limiter import serpapi_rate_limiter, RateLimitExceededError
 
 # Get API key from environment variables
 def get_serpapi_key():
@@ -32,7 +34,7 @@ def parse_shopping_results(data):
         shopping_results = data.get("shopping_results", [])
         parsed_results = []
         for result in shopping_results:
-            parsed_results.append(Product(response=result, source="serpapi"))
+            parsed_results.append(Product.from_serpapi(result))
         return parsed_results
     except Exception as e:
         print(f"{Constants.SHOPPING_RESULTS_PARSING_ERROR_MESSAGE} {e}")
@@ -50,26 +52,71 @@ def build_serpapi_params(query, limit):
         "api_key": get_serpapi_key()
     }
 
+def fetch_serpapi_response(query, limit):
+    """
+    Sends a search to SerpApi and returns the JSON response, or None if the request failed.
+    Raises RateLimitExceededError rather than returning None when over quota, so that is not cached as a failure.
+    """
+    # Shared quota of all chats, see utils.rate_limiter
+    serpapi_rate_limiter.acquire_blocking()
+
+    params = build_serpapi_params(query=query, limit=limit)
+    try:
+        response = http_client.get(Constants.SERPAPI_SEARCH_ENDPOINT, params=params)
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"{Constants.SEARCH_ERROR_MESSAGE} {e}")
+        return None
+
+
+async def fetch_serpapi_response_async(query, limit):
+    """
+    The asyncio counterpart of fetch_serpapi_response.
+    """
+    await serpapi_rate_limiter.acquire()
+
+    params = build_serpapi_params(query=query, limit=limit)
+    try:
+        response = await get_async_http_client().get(Constants.SERPAPI_SEARCH_ENDPOINT, params=params)
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"{Constants.SEARCH_ERROR_MESSAGE} {e}")
+        return None
+
+
 def search_product(query, limit=3):
     """
     Search for a product using SerpApi and return product details.
+    Responses are cached by normalized query, see api.serp_cache.
     """
     # with open(Constants.SEARCH_MOCK_RESPONSE_PATH, 'r', encoding="utf-8") as f:
     #     mock_results = json.load(f)
     #     mock_all_parsed = parse_shopping_results(data=mock_results)
-    #     return mock_all_parsed[:limit]
+    #     return fetch_product_images(mock_all_parsed[:limit])
 
-    params = build_serpapi_params(query=query, limit=limit)
     try:
-        response = requests.get(Constants.SERPAPI_SEARCH_ENDPOINT, params=params)
-        response.raise_for_status()
-        results = response.json()
+        results = serp_cache.get_or_fetch(query, limit, fetch_serpapi_response)
+    except RateLimitExceededError as e:
+        print(f"{Constants.SEARCH_ERROR_MESSAGE} {e}")
+        return []
 
-        # Parse the shopping results
-        all_parsed = parse_shopping_results(results)
+    # Parse the shopping results, then download only the images of the kept ones
+    all_parsed = parse_shopping_results(results)
 
-        return all_parsed[:limit]
+    return fetch_product_images(all_parsed[:limit])
 
-    except Exception as e:
+
+async def search_product_async(query, limit=3):
+    """
+    The asyncio counterpart of search_product.
+    """
+    try:
+        results = await serp_cache.get_or_fetch_async(query, limit, fetch_serpapi_response_async)
+    except RateLimitExceededError as e:
         print(f"{Constants.SEARCH_ERROR_MESSAGE} {e}")
         return []
+    all_parsed = parse_shopping_results(results)
+
+    return await fetch_product_images_async(all_parsed[:limit])
@@ -0,0 +1,150 @@
+import asyncio
+import re
+import threading
+import unicodedata
+from concurrent.futures import Future
+
+from utils.cache import LRUCache
+from utils.constants import SerpCache as Constants
+from utils.metrics import metrics
+
+# Stored for searches that failed or found nothing, since the cache cannot hold None
+EMPTY_RESPONSE = {"shopping_results": []}
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a product name so that trivially different spellings share a cache entry:
+    Unicode compatibility forms, case, surrounding punctuation and repeated whitespace are folded.
+    """
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = re.sub(r"\s+", " ", query)
+    return query.strip(" \t\n\"'.,;:!?-_()[]")
+
+
+class SerpCache:
+    """
+    A cache of SerpAPI responses keyed by normalized query and result limit.
+
+    Searches that failed or found no products are cached too, for the shorter `negative_ttl_seconds`,
+    so they are not retried on every lookup. Concurrent lookups of the same key share a single
+    in-flight request, separately for threads and for the event loop.
+
+    Hits and misses are counted in utils.metrics under "serp_cache", as are searches that joined
+    an in-flight request ("serp_cache.coalesced") and hits on a cached empty result ("serp_cache.negative_hits").
+    """
+    def __init__(self,
+                 max_entries: int = Constants.MAX_ENTRIES,
+                 ttl_seconds: float = Constants.TTL_SECONDS,
+                 negative_ttl_seconds: float = Constants.NEGATIVE_TTL_SECONDS):
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._responses = LRUCache(name="serp_cache", max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+        self._lock = threading.Lock()
+        self._in_flight = {}  # key -> concurrent.futures.Future
+        self._in_flight_async = {}  # key -> asyncio.Future
+
+    @staticmethod
+    def cache_key(query: str, limit: int) -> str:
+        return f"{normalize_query(query)}|{limit}"
+
+    def _lookup(self, key: str):
+        response = self._responses.get(key)
+        if response is EMPTY_RESPONSE:
+            metrics.increment("serp_cache.negative_hits")
+        return response
+
+    def _store(self, key: str, response) -> dict:
+        """
+        Caches a fetched response, or EMPTY_RESPONSE for a failed or empty one, and returns what was cached.
+        """
+        if not response or not response.get("shopping_results"):
+            self._responses.put(key, EMPTY_RESPONSE, ttl_seconds=self.negative_ttl_seconds)
+            return EMPTY_RESPONSE
+
+        self._responses.put(key, response)
+        return response
+
+    def get_or_fetch(self, query: str, limit: int, fetch) -> dict:
+        """
+        Returns the cached response for a query, or calls fetch(query, limit) once for all concurrent callers.
+
+        Args:
+            query (str): The product name to search for.
+            limit (int): The number of results requested.
+            fetch (callable): Sends the search and returns the response JSON, or None if it failed.
+
+        Returns:
+            dict: The response JSON, EMPTY_RESPONSE if the search failed or found nothing.
+        """
+        key = self.cache_key(query, limit)
+        response = self._lookup(key)
+        if response is not None:
+            return response
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._in_flight[key] = Future()
+
+        if not is_owner:
+            metrics.increment("serp_cache.coalesced")
+            return future.result()
+
+        try:
+            response = self._store(key, fetch(normalize_query(query), limit))
+            future.set_result(response)
+            return response
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    async def get_or_fetch_async(self, query: str, limit: int, fetch) -> dict:
+        """
+        The asyncio counterpart of get_or_fetch, where fetch is a coroutine function.
+        """
+        key = self.cache_key(query, limit)
+        while True:
+            response = self._lookup(key)
+            if response is not None:
+                return response
+
+            future = self._in_flight_async.get(key)
+            if future is None:
+                break
+
+            metrics.increment("serp_cache.coalesced")
+            try:
+                # Shielded, so a waiter giving up does not cancel the request for everyone else
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The request was cancelled by its owner rather than by us, look again
+
+        future = self._in_flight_async[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = self._store(key, await fetch(normalize_query(query), limit))
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Marks the exception as retrieved in case no other caller was waiting
+            future.exception()
+            raise
+        finally:
+            self._in_flight_async.pop(key, None)
+
+    def clear(self):
+        self._responses.clear()
+
+
+# Process-wide cache of SerpAPI responses
+serp_cache = SerpCache()
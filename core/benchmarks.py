@@ -0,0 +1,287 @@
+"""
+Benchmarks for the clothes segmentation pipeline, run against the demo photos in media/.
+
+Usage:
+    python -m core.benchmarks segmentation-modes [image ...]
+    python -m core.benchmarks clothes-extraction [image ...]
+    python -m core.benchmarks backend-parity [--backends NAME ...] [--min-agreement 0.99] [image ...]
+    python -m core.benchmarks worker-layouts [--layouts 1x4 2x2 4x1] [--requests 16] [image ...]
+"""
+import argparse
+import asyncio
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from core.inference_backends import BACKEND_NAMES, create_backend
+from core.inference_executor import InferenceExecutor
+from core.segmentation import ClothesSegformer, segment_clothes, initialize_inference_worker
+from utils.metrics import Metrics
+from utils.constants import ClothesSegformer as SegformerConstants
+
+DEMO_PHOTOS_PATTERN = "media/demo_photo_*"
+SEGMENTATION_MAP_MODES = ("full", "capped", "model")
+
+
+def get_image_paths(image_paths=None) -> list[str]:
+    """
+    Returns the given image paths, or the demo photos when none are given.
+    """
+    return list(image_paths) if image_paths else sorted(glob.glob(DEMO_PHOTOS_PATTERN))
+
+
+def mask_agreement(reference: np.ndarray, candidate: np.ndarray, labels) -> tuple:
+    """
+    Compares two label maps of the same size.
+
+    Args:
+        reference (np.ndarray): The reference label map.
+        candidate (np.ndarray): The label map to compare.
+        labels (Iterable[int]): The labels to compute the IoU over.
+
+    Returns:
+        tuple: (pixel_agreement, mean_iou), both between 0 and 1.
+    """
+    pixel_agreement = float((reference == candidate).mean())
+
+    ious = []
+    for label in labels:
+        reference_mask = reference == label
+        candidate_mask = candidate == label
+        union = np.logical_or(reference_mask, candidate_mask).sum()
+        if union:
+            ious.append(np.logical_and(reference_mask, candidate_mask).sum() / union)
+
+    return pixel_agreement, float(np.mean(ious)) if ious else 1.0
+
+
+def benchmark_segmentation_map_modes(image_paths=None, repeats: int = 3):
+    """
+    Compares the label map modes of ClothesSegformer.logits_to_segmentation_map on the same logits.
+    Reports latency, the size of the float logits tensor the argmax runs on, and agreement with "full".
+    """
+    segformer = ClothesSegformer()
+    results = {mode: {"seconds": [], "logits_mb": [], "agreement": [], "iou": []} for mode in SEGMENTATION_MAP_MODES}
+
+    for path in get_image_paths(image_paths):
+        with Image.open(path) as image:
+            logits = ClothesSegformer.compute_logits(segformer.processor, segformer.model, [image])
+            reference = None
+
+            for mode in SEGMENTATION_MAP_MODES:
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    seg_map = ClothesSegformer.logits_to_segmentation_map(logits, image.size, mode=mode)
+                elapsed = (time.perf_counter() - start) / repeats
+
+                working_height, working_width = ClothesSegformer.get_working_size(mode, logits.shape[-2:], image.size)
+                seg_map = seg_map.cpu().numpy()
+                if reference is None:
+                    reference = seg_map
+
+                agreement, iou = mask_agreement(reference, seg_map, segformer.label_to_name)
+                results[mode]["seconds"].append(elapsed)
+                results[mode]["logits_mb"].append(logits.shape[1] * working_height * working_width * 4 / 2 ** 20)
+                results[mode]["agreement"].append(agreement)
+                results[mode]["iou"].append(iou)
+
+    print(f"{'mode':<8} {'latency (ms)':>13} {'logits (MB)':>12} {'pixel agree':>12} {'mean IoU':>9}")
+    for mode, result in results.items():
+        print(f"{mode:<8} {np.mean(result['seconds']) * 1000:>13.1f} {np.max(result['logits_mb']):>12.1f} "
+              f"{np.mean(result['agreement']) * 100:>11.2f}% {np.mean(result['iou']):>9.3f}")
+    return results
+
+
+def extract_clothes_per_label(label_map: np.ndarray, label_to_name: dict) -> dict:
+    """
+    Reference implementation of the previous extraction scan: one full-map mask and
+    np.where per detected label. Returns each label's tight bounding box and pixel count.
+    """
+    items = {}
+    for label in np.unique(label_map):
+        if label not in label_to_name:
+            continue
+        mask = label_map == label
+        y_indices, x_indices = np.where(mask)
+        items[int(label)] = ((y_indices.min(), y_indices.max(), x_indices.min(), x_indices.max()), len(y_indices))
+    return items
+
+
+def benchmark_clothes_extraction(image_paths=None, repeats: int = 5):
+    """
+    Compares the single-pass label summary used by ClothesSegformer.extract_clothes
+    with the previous per-label scan, on the segmentation maps of the given images.
+    """
+    segformer = ClothesSegformer()
+    per_label_seconds, single_pass_seconds = [], []
+
+    for path in get_image_paths(image_paths):
+        with Image.open(path) as image:
+            label_map = ClothesSegformer.to_label_array(segformer.get_segmentation_map(image))
+            rgb_image = image.convert("RGB")
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            reference = extract_clothes_per_label(label_map, segformer.label_to_name)
+        per_label_seconds.append((time.perf_counter() - start) / repeats)
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            counts, boxes = ClothesSegformer.summarize_labels(label_map)
+        single_pass_seconds.append((time.perf_counter() - start) / repeats)
+
+        for label, (box, count) in reference.items():
+            assert tuple(boxes[label]) == tuple(box) and counts[label] == count, f"Mismatch for label {label} in {path}"
+
+        start = time.perf_counter()
+        segformer.extract_clothes(rgb_image, label_map)
+        print(f"{path}: {label_map.shape[1]}x{label_map.shape[0]}, {len(reference)} items, "
+              f"per-label {per_label_seconds[-1] * 1000:.1f}ms, single-pass {single_pass_seconds[-1] * 1000:.1f}ms, "
+              f"full extraction {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    speedup = np.sum(per_label_seconds) / max(np.sum(single_pass_seconds), 1e-9)
+    print(f"Single-pass label summary is {speedup:.1f}x faster than the per-label scan")
+    return per_label_seconds, single_pass_seconds
+
+
+def benchmark_backend_parity(backend_names=None, image_paths=None, min_agreement: float = 0.99) -> bool:
+    """
+    Checks that each inference backend produces the same label maps as eager PyTorch on the given images,
+    and reports its forward-pass latency so the fastest safe backend can be adopted.
+
+    Returns:
+        bool: True if every backend reaches min_agreement pixel agreement on every image.
+    """
+    backend_names = backend_names or [name for name in BACKEND_NAMES
+                                      if name != "onnx" or os.path.exists(SegformerConstants.ONNX_MODEL_PATH)]
+    segformer = ClothesSegformer()
+    images = []
+    for path in get_image_paths(image_paths):
+        with Image.open(path) as image:
+            images.append((path, image.convert("RGB")))
+
+    reference_backend = create_backend("eager", SegformerConstants.B2_CLOTHES_MODEL_NAME)
+    references = [
+        ClothesSegformer.to_label_array(ClothesSegformer.logits_to_segmentation_map(
+            ClothesSegformer.compute_logits(segformer.processor, reference_backend, [image]), image.size))
+        for _, image in images
+    ]
+
+    passed = True
+    print(f"{'backend':<12} {'latency (ms)':>13} {'min agree':>10} {'mean IoU':>9}")
+    for backend_name in backend_names:
+        backend = create_backend(backend_name, SegformerConstants.B2_CLOTHES_MODEL_NAME)
+        # Warm up, so one-off tracing or compilation is not counted as latency
+        ClothesSegformer.compute_logits(segformer.processor, backend, [images[0][1]])
+
+        seconds, agreements, ious = [], [], []
+        for (path, image), reference in zip(images, references):
+            start = time.perf_counter()
+            logits = ClothesSegformer.compute_logits(segformer.processor, backend, [image])
+            seconds.append(time.perf_counter() - start)
+
+            seg_map = ClothesSegformer.to_label_array(ClothesSegformer.logits_to_segmentation_map(logits, image.size))
+            agreement, iou = mask_agreement(reference, seg_map, segformer.label_to_name)
+            agreements.append(agreement)
+            ious.append(iou)
+
+        backend_passed = min(agreements) >= min_agreement
+        passed = passed and backend_passed
+        print(f"{backend_name:<12} {np.mean(seconds) * 1000:>13.1f} {min(agreements) * 100:>9.2f}% "
+              f"{np.mean(ious):>9.3f} {'' if backend_passed else 'FAILED'}")
+
+    return passed
+
+
+async def run_inference_burst(executor: InferenceExecutor, images: list[bytes], num_requests: int) -> tuple:
+    """
+    Submits num_requests segmentation requests at once and waits for all of them.
+
+    Returns:
+        tuple: (per-request latencies in seconds, total wall time in seconds)
+    """
+    async def timed_request(image):
+        start = time.perf_counter()
+        # Uncached, so repeated photos are segmented every time rather than timed as cache hits
+        await executor.run(segment_clothes, image, False)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(timed_request(images[index % len(images)]) for index in range(num_requests)))
+    return latencies, time.perf_counter() - start
+
+
+def benchmark_worker_layouts(layouts, image_paths=None, num_requests: int = 16, executor_type: str = "thread"):
+    """
+    Sweeps "<workers>x<threads per worker>" layouts under a burst of concurrent requests
+    and reports throughput and latency percentiles for each.
+    Set SNAPPO_SEGMENTATION_BATCH_SIZE=1 to measure the layouts without micro-batching.
+    """
+    images = []
+    for path in get_image_paths(image_paths):
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    results = {}
+    print(f"{'layout':<8} {'images/s':>9} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+    for layout in layouts:
+        executor = InferenceExecutor(executor_type=executor_type,
+                                     worker_layout=layout,
+                                     max_queue_size=num_requests,
+                                     timeout_seconds=600,
+                                     initializer=initialize_inference_worker)
+        try:
+            # Warm up every worker, so model loading is not counted
+            asyncio.run(run_inference_burst(executor, images, executor.max_workers))
+            latencies, elapsed = asyncio.run(run_inference_burst(executor, images, num_requests))
+        finally:
+            executor.shutdown(wait=True)
+
+        summary = Metrics.summarize_samples(latencies)
+        results[layout] = {"throughput": num_requests / elapsed, **summary}
+        print(f"{layout:<8} {num_requests / elapsed:>9.2f} {summary['p50'] * 1000:>9.0f} {summary['p95'] * 1000:>9.0f}")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snappo segmentation benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    modes_parser = subparsers.add_parser("segmentation-modes", help="Compare label map modes")
+    modes_parser.add_argument("images", nargs="*")
+    modes_parser.add_argument("--repeats", type=int, default=3)
+
+    extraction_parser = subparsers.add_parser("clothes-extraction", help="Compare clothes extraction scans")
+    extraction_parser.add_argument("images", nargs="*")
+    extraction_parser.add_argument("--repeats", type=int, default=5)
+
+    parity_parser = subparsers.add_parser("backend-parity", help="Check inference backends against eager PyTorch")
+    parity_parser.add_argument("images", nargs="*")
+    parity_parser.add_argument("--backends", nargs="+", choices=BACKEND_NAMES)
+    parity_parser.add_argument("--min-agreement", type=float, default=0.99)
+
+    layouts_parser = subparsers.add_parser("worker-layouts", help="Sweep inference worker and thread layouts")
+    layouts_parser.add_argument("images", nargs="*")
+    layouts_parser.add_argument("--layouts", nargs="+", default=["1x4", "2x2", "4x1"])
+    layouts_parser.add_argument("--requests", type=int, default=16)
+    layouts_parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+
+    args = parser.parse_args()
+    if args.command == "segmentation-modes":
+        benchmark_segmentation_map_modes(args.images, repeats=args.repeats)
+    elif args.command == "clothes-extraction":
+        benchmark_clothes_extraction(args.images, repeats=args.repeats)
+    elif args.command == "backend-parity":
+        passed = benchmark_backend_parity(args.backends, args.images, min_agreement=args.min_agreement)
+        sys.exit(0 if passed else 1)
+    elif args.command == "worker-layouts":
+        benchmark_worker_layouts(args.layouts, args.images, num_requests=args.requests, executor_type=args.executor)
+
+
+if __name__ == "__main__":
+    main()
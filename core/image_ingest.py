@@ -0,0 +1,92 @@
+import io
+import math
+
+from PIL import Image, ImageOps
+
+from utils.constants import ImageIngest as Constants
+from utils.metrics import metrics
+
+# EXIF orientations that rotate the image by 90 or 270 degrees
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+class IngestedImage:
+    """
+    A decoded, upright RGB photo capped to a working resolution, with a way back to its original pixels.
+
+    Attributes:
+        image (Image): The working image used for segmentation.
+        original_size (tuple): (width, height) of the upright photo at full resolution.
+        raw (bytes): The encoded photo as received.
+    """
+    image: Image.Image
+    original_size: tuple
+    raw: bytes
+
+    def __init__(self, raw: bytes, image: Image.Image, original_size: tuple):
+        self.raw = raw
+        self.image = image
+        self.original_size = original_size
+
+    @property
+    def is_downscaled(self) -> bool:
+        return self.image.size != self.original_size
+
+    def load_original(self) -> Image.Image:
+        """
+        Decodes the photo again at full resolution, upright and in RGB.
+
+        Returns:
+            Image: The full-resolution photo.
+        """
+        with Image.open(io.BytesIO(self.raw)) as original:
+            return ImageOps.exif_transpose(original).convert("RGB")
+
+    def close(self):
+        self.image.close()
+
+
+def get_upright_size(image: Image.Image) -> tuple:
+    """
+    Returns the (width, height) of an image after its EXIF orientation is applied.
+    """
+    width, height = image.size
+    if image.getexif().get(EXIF_ORIENTATION_TAG) in TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def ingest_image(raw, max_side: int = Constants.MAX_SIDE) -> IngestedImage:
+    """
+    Decodes an incoming photo into an upright RGB image whose longest side is at most max_side.
+
+    JPEGs are decoded with Pillow's draft mode, which lets the decoder downscale by up to 8x
+    instead of materializing every pixel of the camera's full resolution first.
+
+    Args:
+        raw (bytes): The encoded photo.
+        max_side (int): The longest side of the working image.
+
+    Returns:
+        IngestedImage: The working image and a handle to the original pixels.
+    """
+    raw = bytes(raw)
+
+    with metrics.timer("ingest.decode_seconds"):
+        image = Image.open(io.BytesIO(raw))
+        original_size = get_upright_size(image)
+
+        scale = max_side / max(image.size)
+        if image.format == "JPEG" and scale < 1:
+            # The decoder picks the smallest power-of-two reduction that is still at least this size
+            image.draft("RGB", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side))
+
+    metrics.set_gauge("ingest.original_megapixels", original_size[0] * original_size[1] / 1e6)
+    metrics.set_gauge("ingest.working_megapixels", image.width * image.height / 1e6)
+    return IngestedImage(raw=raw, image=image, original_size=original_size)
@@ -0,0 +1,200 @@
+"""
+Pluggable CPU inference backends for the Segformer clothes model.
+
+Usage:
+    python -m core.inference_backends export [--model NAME] [--output PATH]
+"""
+import argparse
+import os
+import time
+
+import torch
+from transformers import SegformerForSemanticSegmentation
+
+from utils.constants import ClothesSegformer as Constants
+
+# Input resolution of the Segformer image processor, used to trace and export the model
+EXAMPLE_INPUT_SHAPE = (1, 3, 512, 512)
+
+
+def load_torch_model(model_name: str, local_files_only: bool = False) -> SegformerForSemanticSegmentation:
+    """
+    Loads the Segformer checkpoint as a read-only eager PyTorch model.
+
+    Args:
+        model_name (str): The Hugging Face checkpoint name.
+        local_files_only (bool): Only use the locally cached checkpoint, never the network.
+
+    Returns:
+        SegformerForSemanticSegmentation: The model in eval mode.
+    """
+    model = SegformerForSemanticSegmentation.from_pretrained(model_name, local_files_only=local_files_only)
+    model.eval()
+    model.requires_grad_(False)
+    return model
+
+
+class LogitsOnly(torch.nn.Module):
+    """
+    Wraps the Hugging Face model so it takes a pixel tensor and returns a plain logits tensor,
+    which is what tracing and ONNX export expect.
+    """
+    def __init__(self, model: SegformerForSemanticSegmentation):
+        super().__init__()
+        self.model = model
+        # A new module starts in training mode, which tracing and freezing reject
+        self.eval()
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values, return_dict=False)[0]
+
+
+class SegformerBackend:
+    """
+    Base class for segmentation inference backends.
+    A backend maps a (batch, 3, height, width) pixel tensor to (batch, num_labels, height / 4, width / 4) logits.
+    """
+    name = None
+
+    def __call__(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+
+class EagerBackend(SegformerBackend):
+    """
+    Runs the model in eager-mode PyTorch fp32.
+    """
+    name = "eager"
+
+    def __init__(self, model: SegformerForSemanticSegmentation):
+        self.model = LogitsOnly(model)
+
+    def __call__(self, pixel_values):
+        with torch.inference_mode():
+            return self.model(pixel_values)
+
+
+class TorchScriptBackend(EagerBackend):
+    """
+    Runs a traced and frozen TorchScript graph of the model.
+    """
+    name = "torchscript"
+
+    def __init__(self, model: SegformerForSemanticSegmentation):
+        super().__init__(model)
+        with torch.no_grad():
+            traced = torch.jit.trace(self.model, torch.zeros(EXAMPLE_INPUT_SHAPE))
+            self.model = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+
+class CompiledBackend(EagerBackend):
+    """
+    Runs the model through torch.compile. The first call pays the compilation cost.
+    """
+    name = "compile"
+
+    def __init__(self, model: SegformerForSemanticSegmentation):
+        super().__init__(model)
+        self.model = torch.compile(self.model)
+
+
+class QuantizedBackend(EagerBackend):
+    """
+    Runs the model with its linear layers dynamically quantized to int8.
+    """
+    name = "quantized"
+
+    def __init__(self, model: SegformerForSemanticSegmentation):
+        super().__init__(torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8))
+
+
+class OnnxBackend(SegformerBackend):
+    """
+    Runs an exported ONNX graph of the model through onnxruntime.
+    Requires the optional onnxruntime package and a graph created by the export command.
+    """
+    name = "onnx"
+
+    def __init__(self, onnx_path: str):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError(Constants.ONNX_RUNTIME_MISSING_ERROR_MESSAGE)
+
+        self.session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+
+    def __call__(self, pixel_values):
+        logits = self.session.run(None, {"pixel_values": pixel_values.cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+TORCH_BACKENDS = {
+    backend.name: backend for backend in (EagerBackend, TorchScriptBackend, CompiledBackend, QuantizedBackend)
+}
+BACKEND_NAMES = tuple(TORCH_BACKENDS) + (OnnxBackend.name,)
+
+
+def create_backend(backend_name: str, model_name: str, onnx_path: str = Constants.ONNX_MODEL_PATH) -> SegformerBackend:
+    """
+    Creates the inference backend with the given name.
+
+    Args:
+        backend_name (str): One of BACKEND_NAMES.
+        model_name (str): The Hugging Face checkpoint name, used by the PyTorch backends.
+        onnx_path (str): The exported graph, used by the ONNX backend.
+
+    Returns:
+        SegformerBackend: The backend, ready for inference.
+    """
+    if backend_name == OnnxBackend.name:
+        return OnnxBackend(onnx_path)
+
+    if backend_name not in TORCH_BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend_name}. Choose one of {', '.join(BACKEND_NAMES)}")
+
+    return TORCH_BACKENDS[backend_name](load_torch_model(model_name))
+
+
+def export_onnx(model_name: str = Constants.B2_CLOTHES_MODEL_NAME, output_path: str = Constants.ONNX_MODEL_PATH):
+    """
+    Exports the locally cached checkpoint to an ONNX graph with dynamic batch and image size.
+
+    Args:
+        model_name (str): The Hugging Face checkpoint name. Must already be in the local cache.
+        output_path (str): Where to write the ONNX graph.
+    """
+    start = time.perf_counter()
+    model = LogitsOnly(load_torch_model(model_name, local_files_only=True))
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    torch.onnx.export(
+        model,
+        (torch.zeros(EXAMPLE_INPUT_SHAPE),),
+        output_path,
+        input_names=["pixel_values"],
+        output_names=["logits"],
+        dynamic_axes={
+            "pixel_values": {0: "batch", 2: "height", 3: "width"},
+            "logits": {0: "batch", 2: "logits_height", 3: "logits_width"},
+        },
+        opset_version=17,
+    )
+
+    print(f"Exported '{model_name}' to {output_path} in {time.perf_counter() - start:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snappo segmentation inference backends")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export the cached checkpoint to ONNX")
+    export_parser.add_argument("--model", default=Constants.B2_CLOTHES_MODEL_NAME)
+    export_parser.add_argument("--output", default=Constants.ONNX_MODEL_PATH)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_onnx(model_name=args.model, output_path=args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from core.runtime_config import parse_worker_layout, export_thread_environment
+from utils.constants import InferenceExecutor as Constants
+from utils.metrics import metrics
+
+
+class InferenceQueueFullError(Exception):
+    """
+    Raised when the inference queue has no room for another request.
+    """
+
+
+class InferenceTimeoutError(Exception):
+    """
+    Raised when an inference request does not complete within its timeout.
+    """
+
+
+def _initialize_worker(initializer, worker_slots, workers_per_process, threads_per_worker):
+    """
+    Claims the next worker slot and passes it to the pool's initializer.
+    Kept at module level so it can be pickled for process pools.
+    """
+    with worker_slots.get_lock():
+        slot = worker_slots.value
+        worker_slots.value += 1
+    initializer(slot, workers_per_process, threads_per_worker)
+
+
+def _timed_call(fn, args):
+    """
+    Runs fn(*args) inside a worker and reports when the work actually started.
+    Kept at module level so it can be pickled for process pools.
+    """
+    started_at = time.time()
+    return fn(*args), started_at
+
+
+class InferenceExecutor:
+    """
+    Runs blocking model inference off the asyncio event loop on a bounded worker pool.
+
+    Requests beyond `max_workers + max_queue_size` are rejected immediately with
+    InferenceQueueFullError, and callers stop waiting after `timeout_seconds`.
+    A timed-out request keeps its queue slot until its worker actually finishes,
+    so the reported queue depth always reflects the real load on the pool.
+
+    The pool is sized by a "<workers>x<threads per worker>" layout. The optional initializer runs
+    once in every worker as initializer(slot, workers_per_process, threads_per_worker), which lets
+    each worker claim its own share of threads and CPUs. workers_per_process is 1 for process pools
+    and the number of workers for thread pools.
+
+    Attributes:
+        executor_type (str): "thread" or "process".
+        max_workers (int): Number of workers running inference concurrently.
+        threads_per_worker (int): Intra-op threads each worker is meant to use.
+        max_queue_size (int): Number of requests allowed to wait for a free worker.
+        timeout_seconds (float): Default time a caller waits for a result.
+    """
+    def __init__(self,
+                 executor_type: str = Constants.EXECUTOR_TYPE,
+                 worker_layout: str = Constants.WORKER_LAYOUT,
+                 max_queue_size: int = Constants.MAX_QUEUE_SIZE,
+                 timeout_seconds: float = Constants.REQUEST_TIMEOUT_SECONDS,
+                 initializer=None):
+        if executor_type not in ("thread", "process"):
+            raise ValueError(f"Unknown executor type: {executor_type}")
+
+        self.executor_type = executor_type
+        self.max_workers, self.threads_per_worker = parse_worker_layout(worker_layout)
+        self.max_queue_size = max_queue_size
+        self.timeout_seconds = timeout_seconds
+        self.initializer = initializer
+
+        self._pool = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        """
+        Creates the worker pool on first use.
+        """
+        if self._pool is None:
+            # Spawn rather than fork, since the parent may already hold torch threads
+            context = multiprocessing.get_context("spawn")
+            initializer, initargs = None, ()
+            if self.initializer is not None:
+                initializer = _initialize_worker
+                workers_per_process = 1 if self.executor_type == "process" else self.max_workers
+                initargs = (self.initializer, context.Value("i", 0), workers_per_process, self.threads_per_worker)
+
+            if self.executor_type == "process":
+                # Spawned workers size their native thread pools from the environment on import
+                export_thread_environment(self.threads_per_worker)
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=context,
+                                                 initializer=initializer,
+                                                 initargs=initargs)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix="inference",
+                                                initializer=initializer,
+                                                initargs=initargs)
+        return self._pool
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue_size
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Number of requests submitted and not yet finished, running or waiting.
+        """
+        return self._pending
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Number of requests waiting for a free worker.
+        """
+        return max(0, self._pending - self.max_workers)
+
+    def _publish_gauges(self):
+        metrics.set_gauge("inference.in_flight", self.in_flight)
+        metrics.set_gauge("inference.queue_depth", self.queue_depth)
+
+    def _release_slot(self, _future):
+        with self._lock:
+            self._pending -= 1
+            self._publish_gauges()
+
+    async def run(self, fn, *args, timeout: float = None):
+        """
+        Runs fn(*args) on the worker pool and awaits its result without blocking the event loop.
+
+        Args:
+            fn (callable): The blocking function to run. Must be picklable for process pools.
+            *args: Positional arguments for fn.
+            timeout (float, optional): Seconds to wait for the result. Defaults to `timeout_seconds`.
+
+        Returns:
+            Any: The return value of fn.
+
+        Raises:
+            InferenceQueueFullError: If the pool and its queue are already full.
+            InferenceTimeoutError: If the result is not ready in time.
+        """
+        timeout = self.timeout_seconds if timeout is None else timeout
+
+        with self._lock:
+            if self._pending >= self.capacity:
+                metrics.increment("inference.rejected")
+                raise InferenceQueueFullError(f"{Constants.QUEUE_FULL_ERROR_MESSAGE} "
+                                              f"{self._pending}/{self.capacity} requests in flight")
+            self._pending += 1
+            self._publish_gauges()
+
+        submitted_at = time.time()
+        try:
+            future = self._get_pool().submit(_timed_call, fn, args)
+        except Exception:
+            self._release_slot(None)
+            raise
+        future.add_done_callback(self._release_slot)
+
+        try:
+            # On timeout the wrapped future is cancelled, which drops the request if it is still queued
+            result, started_at = await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            metrics.increment("inference.timeouts")
+            raise InferenceTimeoutError(f"{Constants.TIMEOUT_ERROR_MESSAGE} {timeout:.0f}s")
+
+        finished_at = time.time()
+        metrics.increment("inference.completed")
+        metrics.observe("inference.wait_seconds", max(0.0, started_at - submitted_at))
+        metrics.observe("inference.run_seconds", finished_at - started_at)
+        return result
+
+    def shutdown(self, wait: bool = False):
+        """
+        Shuts down the worker pool, dropping any requests that have not started yet.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
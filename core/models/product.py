@@ -1,81 +1,200 @@
+import asyncio
+import functools
 import json
-from io import BytesIO
-import requests
-from PIL import Image
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from currency_symbols import CurrencySymbols
 
+from core.product_image_store import get_product_image_store
+from utils.constants import ProductImages as Constants
+from utils.metrics import metrics
+from utils.response_enum import ProductResponseKeys
 from utils.response_parser import ResponseParser
 
+# Shared pool for downloading product thumbnails concurrently
+image_fetch_pool = ThreadPoolExecutor(max_workers=Constants.FETCH_WORKERS, thread_name_prefix="product-images")
+
+# Response keys of every product field, looked up once instead of for every product
+LYKDAT_KEYS = {key.name: key.value.lykdat_key for key in ProductResponseKeys}
+SERPAPI_KEYS = {key.name: key.value.serpapi_key for key in ProductResponseKeys}
+
+
+@functools.lru_cache(maxsize=256)
+def get_currency_symbol(currency: str) -> str:
+    """
+    Returns the symbol of a currency code. Cached, so products in one currency share one symbol string.
+    """
+    try:
+        return CurrencySymbols.get_symbol(currency=currency)
+    except KeyError:
+        return "$"
+
+
 class Product:
-    name: str
-    price: float
-    currency: str
-    url: str
-    image_url: str
-    image_data: BytesIO
-    brand: str
-    source_api: str
-
-    def __init__(self, response, source: str):
-        self.source_api = source
-        parsed_response = ResponseParser.parse_lykdat_product(
-            response) if source == "lykdat" else ResponseParser.parse_serpapi_product(response)
-        self.price = parsed_response.get("price", -1)
-        self.url = parsed_response.get("url", "")
-
-        image_url = parsed_response.get("image_url", "")
+    """
+    The metadata of a product found by a search.
+
+    The image itself is not held here: image_path refers to its file in the product image store,
+    see fetch_product_images, and is opened only when the image is sent. Products are compact
+    records without a __dict__, and serialize to a flat list of their fields, see to_record.
+
+    Attributes:
+        name (str): The name of the product.
+        price (float): The price of the product, -1 if unknown.
+        currency (str): The currency symbol of the price.
+        url (str): The link to the product page.
+        image_url (str): The link to the product image.
+        image_path (str): The stored file of the product image, or None if it was not fetched.
+        brand (str): The brand, or the store for SerpAPI results.
+        source_api (str): The API the product was found with, "lykdat" or "serpapi".
+    """
+    __slots__ = ("name", "price", "currency", "url", "image_url", "image_path", "brand", "source_api")
+
+    def __init__(self, name: str, price: float, currency: str, url: str, image_url: str, brand: str,
+                 source_api: str, image_path: str = None):
+        self.name = name
+        self.price = price
+        self.currency = currency
+        self.url = url
         self.image_url = image_url
-        self.image_data = self.get_image_data_from_url(url=image_url)
+        self.image_path = image_path
+        self.brand = brand
+        self.source_api = source_api
 
-        self.brand = parsed_response.get("brand", "")
-        self.name = parsed_response.get("name", "")
+    @classmethod
+    def from_response(cls, response: dict, source: str):
+        """
+        Builds a product from one result of the Lykdat or SerpAPI response.
+        """
+        return cls.from_lykdat(response) if source == "lykdat" else cls.from_serpapi(response)
+
+    @classmethod
+    def from_lykdat(cls, response: dict):
+        return cls(name=response[LYKDAT_KEYS["NAME"]],
+                   price=response[LYKDAT_KEYS["PRICE"]],
+                   currency=get_currency_symbol(response[LYKDAT_KEYS["CURRENCY"]]),
+                   url=response[LYKDAT_KEYS["PRODUCT_URL"]],
+                   image_url=response[LYKDAT_KEYS["IMAGE_URL"]],
+                   brand=response[LYKDAT_KEYS["BRAND"]],
+                   source_api="lykdat")
 
-        if source == "lykdat":
-            try:
-                self.currency = CurrencySymbols.get_symbol(currency=parsed_response.get("currency", ""))
-            except KeyError:
-                self.currency = "$"
-        else:
-            self.currency = parsed_response.get("currency", "")
+    @classmethod
+    def from_serpapi(cls, response: dict):
+        currency, price = ResponseParser.separate_currency_symbol_and_price(
+            price_with_symbol=response[SERPAPI_KEYS["PRICE"]])
+        return cls(name=response[SERPAPI_KEYS["NAME"]],
+                   price=price,
+                   currency=sys.intern(currency),
+                   url=response[SERPAPI_KEYS["PRODUCT_URL"]],
+                   image_url=response[SERPAPI_KEYS["IMAGE_URL"]],
+                   brand=response[SERPAPI_KEYS["BRAND"]],
+                   source_api="serpapi")
 
     def __repr__(self):
         return str(self.to_dict())
 
-    @staticmethod
-    def get_image_data_from_url(url: str):
+    @property
+    def has_image(self) -> bool:
+        return self.image_path is not None
+
+    def open_image(self):
         """
-        Returns the image content as a BytesIO object.
+        Opens the stored image file for reading, or returns None if there is none (anymore).
         """
+        if self.image_path is None:
+            return None
         try:
-            response = requests.get(url, timeout=8)
-            if response.status_code != 200:
-                print(f"Failed to download image. Status code:\n\t{response.status_code}")
-                return None
-
-            image_data = BytesIO(response.content)
-            try:
-                img = Image.open(image_data)
-                img.verify()
-                image_data.seek(0)
-                return image_data
-            except Exception as e:
-                print(f"Downloaded content is not an image file: {str(e)}")
-                return None
-        except Exception as e:
-            print(f"Failed to get image from url when initializing Product object: {str(e)}")
+            return open(self.image_path, "rb")
+        except FileNotFoundError:
             return None
 
     def to_dict(self):
-        return {
-            "name": self.name,
-            "price": self.price,
-            "currency": self.currency,
-            "url": self.url,
-            "image_url": self.image_url,
-            "image_data": self.image_data,
-            "brand": self.brand,
-            "source_api": self.source_api
-        }
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def to_record(self) -> list:
+        """
+        Returns the fields of the product as a list, in the order of __slots__, for compact storage.
+        """
+        return [getattr(self, field) for field in self.__slots__]
+
+    @classmethod
+    def from_record(cls, record: list):
+        """
+        Rebuilds a product from the output of to_record.
+        """
+        return cls(**dict(zip(cls.__slots__, record)))
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return json.dumps(self.to_record(), separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data: str):
+        return cls.from_record(json.loads(data))
+
+
+def fetch_product_images(products: list[Product], deadline_seconds: float = Constants.FETCH_DEADLINE_SECONDS) -> list[Product]:
+    """
+    Downloads the images of all given products concurrently, under one deadline for the whole set.
+    Images already in the product image store are not downloaded again.
+    Products whose image did not arrive in time, or failed, keep image_path as None.
+
+    Args:
+        products (list[Product]): The products to fetch images for.
+        deadline_seconds (float): The time budget for all downloads together.
+
+    Returns:
+        list[Product]: The same products, with image_path set where the download completed in time.
+    """
+    start = time.perf_counter()
+    futures = {
+        image_fetch_pool.submit(get_product_image_store().fetch, product.image_url): product
+        for product in products if product.image_path is None and product.image_url
+    }
+    done, not_done = wait(futures, timeout=deadline_seconds)
+
+    for future in done:
+        futures[future].image_path = future.result()
+    for future in not_done:
+        # Drops downloads that have not started yet; running ones finish in the background
+        future.cancel()
+
+    metrics.observe("product_images.fetch_seconds", time.perf_counter() - start)
+    metrics.increment("product_images.fetched", len(done))
+    metrics.increment("product_images.deadline_missed", len(not_done))
+    return products
+
+
+
+async def fetch_product_images_async(products: list[Product],
+                                     deadline_seconds: float = Constants.FETCH_DEADLINE_SECONDS) -> list[Product]:
+    """
+    The asyncio counterpart of fetch_product_images. Downloads run as tasks on the event loop,
+    and downloads still running at the deadline are cancelled.
+
+    Args:
+        products (list[Product]): The products to fetch images for.
+        deadline_seconds (float): The time budget for all downloads together.
+
+    Returns:
+        list[Product]: The same products, with image_path set where the download completed in time.
+    """
+    start = time.perf_counter()
+    tasks = {
+        asyncio.create_task(get_product_image_store().fetch_async(product.image_url)): product
+        for product in products if product.image_path is None and product.image_url
+    }
+    if not tasks:
+        return products
+
+    done, not_done = await asyncio.wait(tasks, timeout=deadline_seconds)
+
+    for task in done:
+        tasks[task].image_path = task.result()
+    for task in not_done:
+        task.cancel()
+
+    metrics.observe("product_images.fetch_seconds", time.perf_counter() - start)
+    metrics.increment("product_images.fetched", len(done))
+    metrics.increment("product_images.deadline_missed", len(not_done))
+    return products
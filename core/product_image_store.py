@@ -0,0 +1,284 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from io import BytesIO
+from PIL import Image
+
+from utils.constants import ProductImages as Constants
+from utils.http_client import http_client, get_async_http_client
+from utils.image_hashing import content_hash
+from utils.metrics import metrics
+
+
+class StoredImage:
+    """
+    The index entry of a product image URL.
+
+    Attributes:
+        path (str): The file holding the verified image bytes.
+        etag (str): The ETag the image was served with, for revalidation.
+        last_modified (str): The Last-Modified header the image was served with, for revalidation.
+        fetched_at (float): When the image was last downloaded or revalidated.
+    """
+    __slots__ = ("path", "etag", "last_modified", "fetched_at")
+
+    def __init__(self, path: str, etag: str, last_modified: str, fetched_at: float):
+        self.path = path
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def is_fresh(self, fresh_seconds: float) -> bool:
+        return time.time() - self.fetched_at < fresh_seconds
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ProductImageStore:
+    """
+    A shared on-disk store of product images, looked up by URL.
+
+    Image bytes are verified once, then written to a file named after their content hash, so the
+    same picture behind several URLs is stored once. A SQLite index maps each URL to its file and
+    validators. Within `fresh_seconds` a URL is served from disk without any request; after that
+    it is revalidated with If-None-Match / If-Modified-Since, and a 304 costs no image transfer.
+    The least recently used URLs are dropped once the files exceed `max_megabytes`.
+
+    Lookups are counted in utils.metrics as "product_image_store.hits", ".revalidated",
+    ".downloads" and ".evictions".
+    """
+    def __init__(self,
+                 directory: str = Constants.STORE_DIR,
+                 max_megabytes: int = Constants.STORE_MAX_MEGABYTES,
+                 fresh_seconds: float = Constants.STORE_FRESH_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_megabytes * 2 ** 20
+        self.fresh_seconds = fresh_seconds
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "url TEXT PRIMARY KEY, content_key TEXT NOT NULL, etag TEXT, last_modified TEXT, "
+            "fetched_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS contents (content_key TEXT PRIMARY KEY, size INTEGER NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS images_last_used ON images (last_used)")
+        self._connection.commit()
+
+    @staticmethod
+    def verify_image(content: bytes) -> bool:
+        """
+        Returns whether the downloaded content is a readable image file.
+        """
+        try:
+            Image.open(BytesIO(content)).verify()
+            return True
+        except Exception as e:
+            print(f"Downloaded content is not an image file: {str(e)}")
+            return False
+
+    def path_of(self, content_key: str) -> str:
+        return os.path.join(self.directory, content_key[:2], content_key)
+
+    def lookup(self, url: str):
+        """
+        Returns the index entry of a URL, or None if it is not stored or its file is gone.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content_key, etag, last_modified, fetched_at FROM images WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        content_key, etag, last_modified, fetched_at = row
+        path = self.path_of(content_key)
+        return StoredImage(path, etag, last_modified, fetched_at) if os.path.exists(path) else None
+
+    def _touch(self, url: str, revalidated: bool = False):
+        now = time.time()
+        with self._lock:
+            if revalidated:
+                self._connection.execute("UPDATE images SET fetched_at = ?, last_used = ? WHERE url = ?",
+                                         (now, now, url))
+            else:
+                self._connection.execute("UPDATE images SET last_used = ? WHERE url = ?", (now, url))
+            self._connection.commit()
+
+    def _write_file(self, content_key: str, content: bytes) -> str:
+        path = self.path_of(content_key)
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name first, so readers never see a partial file
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(file_descriptor, "wb") as f:
+            f.write(content)
+        os.replace(temporary_path, path)
+        return path
+
+    def _evict(self):
+        """
+        Drops the least recently used URLs, and files no URL points to anymore, until under budget.
+        """
+        total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM contents").fetchone()[0]
+        while total_bytes > self.max_bytes:
+            row = self._connection.execute("SELECT url, content_key FROM images ORDER BY last_used LIMIT 1").fetchone()
+            if row is None:
+                break
+
+            url, content_key = row
+            self._connection.execute("DELETE FROM images WHERE url = ?", (url,))
+            metrics.increment("product_image_store.evictions")
+
+            still_used = self._connection.execute(
+                "SELECT 1 FROM images WHERE content_key = ? LIMIT 1", (content_key,)
+            ).fetchone()
+            if still_used is None:
+                size = self._connection.execute(
+                    "SELECT size FROM contents WHERE content_key = ?", (content_key,)
+                ).fetchone()
+                self._connection.execute("DELETE FROM contents WHERE content_key = ?", (content_key,))
+                total_bytes -= size[0] if size else 0
+                try:
+                    os.remove(self.path_of(content_key))
+                except FileNotFoundError:
+                    pass
+
+    def store(self, url: str, content: bytes, etag: str = None, last_modified: str = None) -> str:
+        """
+        Stores verified image bytes for a URL and returns the path of their file.
+        """
+        content_key = content_hash(content)
+        path = self._write_file(content_key, content)
+        now = time.time()
+
+        with self._lock:
+            self._connection.execute("INSERT OR IGNORE INTO contents (content_key, size) VALUES (?, ?)",
+                                     (content_key, len(content)))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO images (url, content_key, etag, last_modified, fetched_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, content_key, etag, last_modified, now, now)
+            )
+            self._evict()
+            self._connection.commit()
+
+        metrics.set_gauge("product_image_store.entries", self.count())
+        return path
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def handle_response(self, url: str, stored: StoredImage, status_code: int, headers, content: bytes):
+        """
+        Applies a (conditional) download to the store.
+
+        Returns:
+            str: The path of the image file, or None if there is no usable image.
+        """
+        if status_code == 304 and stored is not None:
+            self._touch(url, revalidated=True)
+            metrics.increment("product_image_store.revalidated")
+            return stored.path
+
+        if status_code != 200:
+            print(f"Failed to download image. Status code:\n\t{status_code}")
+            return None
+
+        if not self.verify_image(content):
+            return None
+
+        metrics.increment("product_image_store.downloads")
+        return self.store(url, content, etag=headers.get("ETag"), last_modified=headers.get("Last-Modified"))
+
+    def get_fresh(self, url: str) -> tuple:
+        """
+        Returns (index entry or None, path if the entry can be served without revalidation or None).
+        """
+        stored = self.lookup(url)
+        if stored is not None and stored.is_fresh(self.fresh_seconds):
+            self._touch(url)
+            metrics.increment("product_image_store.hits")
+            return stored, stored.path
+        return stored, None
+
+    def fetch(self, url: str):
+        """
+        Returns the path of the image behind a URL, downloading or revalidating it if needed.
+
+        Args:
+            url (str): The image URL.
+
+        Returns:
+            str: The path of the verified image file, or None if the image could not be fetched.
+        """
+        try:
+            stored, path = self.get_fresh(url)
+            if path is not None:
+                return path
+
+            headers = stored.conditional_headers() if stored is not None else {}
+            response = http_client.get(url, headers=headers, timeout=Constants.REQUEST_TIMEOUT_SECONDS)
+            return self.handle_response(url, stored, response.status_code, response.headers, response.content)
+        except Exception as e:
+            print(f"Failed to get image from url when initializing Product object: {str(e)}")
+            return None
+
+    async def fetch_async(self, url: str):
+        """
+        The asyncio counterpart of fetch. Disk and index work runs in a thread.
+        """
+        try:
+            stored, path = await asyncio.to_thread(self.get_fresh, url)
+            if path is not None:
+                return path
+
+            headers = stored.conditional_headers() if stored is not None else {}
+            response = await get_async_http_client().get(url, headers=headers,
+                                                         timeout=Constants.REQUEST_TIMEOUT_SECONDS)
+            return await asyncio.to_thread(self.handle_response, url, stored, response.status_code,
+                                           response.headers, response.content)
+        except Exception as e:
+            print(f"Failed to get image from url when initializing Product object: {str(e)}")
+            return None
+
+
+# Process-wide product image store, created on first use by get_product_image_store
+_product_image_store = None
+_product_image_store_lock = threading.Lock()
+
+
+def get_product_image_store() -> ProductImageStore:
+    """
+    Returns the process-wide product image store, creating it on first use.
+
+    If the configured directory or its index cannot be opened, e.g. on a read-only data directory,
+    images are kept in a temporary directory for this process only, without caching across restarts.
+    """
+    global _product_image_store
+
+    with _product_image_store_lock:
+        if _product_image_store is None:
+            try:
+                _product_image_store = ProductImageStore()
+            except (OSError, sqlite3.Error) as e:
+                print(f"{Constants.STORE_UNAVAILABLE_ERROR_MESSAGE} {e}")
+                _product_image_store = ProductImageStore(directory=tempfile.mkdtemp(prefix="snappo-images-"))
+        return _product_image_store
@@ -0,0 +1,142 @@
+import asyncio
+
+from api.serp_api import search_product_async as search_serp_async
+from core.models.product import Product
+from core.product_image_store import get_product_image_store
+from utils.constants import SearchEngine as Constants
+from utils.metrics import metrics
+
+
+class ProductResults:
+    """
+    The results of a product search, kept as the raw API results and turned into products on demand.
+
+    A Product is built, and its image fetched, only when its index is first asked for, and the next
+    index is prefetched in the background. A product without a usable image is replaced by the first
+    SerpAPI result for its name, or marked unusable if there is none, and find_usable skips it.
+    find_usable tries a few products at a time, so a run of unusable ones costs one request a bounded
+    number of image fetches and fallbacks. All raw results are kept, so browsing can go past the first
+    few without another API call.
+
+    Built products are counted in utils.metrics as "product_results.materialized".
+
+    Attributes:
+        raw_results (list[dict]): The raw results of the API, in their order.
+        source (str): The API the raw results come from.
+    """
+    def __init__(self, raw_results: list[dict], source: str = "lykdat"):
+        self.raw_results = raw_results
+        self.source = source
+        self._products = {}  # index -> Product once materialized, None if unusable
+        self._tasks = {}  # index -> task materializing it
+
+    def __len__(self):
+        return len(self.raw_results)
+
+    def __bool__(self):
+        return bool(self.raw_results)
+
+    async def get(self, index: int):
+        """
+        Returns the product at an index, building it and fetching its image if needed,
+        and starts preparing the next one.
+
+        Args:
+            index (int): The index of the product, between 0 and len(self) - 1.
+
+        Returns:
+            Product or None: The product to show, or None if it has no usable image.
+        """
+        task = self._prepare(index)
+        if index + 1 < len(self):
+            self._prepare(index + 1)
+
+        # Shielded, so a cancelled caller does not cancel the preparation for the next one
+        return await asyncio.shield(task)
+
+    async def find_usable(self, index: int, max_attempts: int = Constants.MAX_PRODUCTS_PER_REQUEST):
+        """
+        Returns the first usable product from an index on, wrapping around past the last one.
+
+        Args:
+            index (int): The index to start from, between 0 and len(self) - 1.
+            max_attempts (int): The most products to try, from the index on.
+
+        Returns:
+            tuple: The index and the product, or (None, None) if none of the products tried is usable.
+        """
+        for offset in range(min(len(self), max_attempts)):
+            candidate = (index + offset) % len(self)
+            product = await self.get(candidate)
+            if product is not None:
+                return candidate, product
+
+        metrics.increment("product_results.none_usable")
+        return None, None
+
+    def mark_unusable(self, index: int):
+        """
+        Skips a product from now on, e.g. when Telegram rejected its photo.
+        """
+        self._products[index] = None
+
+    def _prepare(self, index: int) -> asyncio.Future:
+        if index in self._products:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(self._products[index])
+            return future
+
+        task = self._tasks.get(index)
+        if task is None or task.cancelled():
+            task = asyncio.create_task(self._materialize(index))
+            self._tasks[index] = task
+        return task
+
+    async def _materialize(self, index: int) -> Product:
+        try:
+            product = Product.from_response(self.raw_results[index], source=self.source)
+            metrics.increment("product_results.materialized")
+
+            if product.image_url:
+                product.image_path = await get_product_image_store().fetch_async(product.image_url)
+
+            if not product.has_image:
+                # Fallback to SerpAPI using product name
+                serp_results = await search_serp_async(query=product.name, limit=Constants.FALLBACK_LIMIT)
+                product = serp_results[0] if serp_results and serp_results[0].has_image else None
+
+            if product is None:
+                metrics.increment("product_results.unusable")
+            self._products[index] = product
+            return product
+        finally:
+            if self._tasks.get(index) is asyncio.current_task():
+                del self._tasks[index]
+
+    def cancel(self):
+        """
+        Cancels the products still being prepared, e.g. when a new photo arrives.
+        """
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    def to_dict(self) -> dict:
+        return {
+            "source": self.source,
+            "raw_results": self.raw_results,
+            "products": {str(index): product.to_record() if product is not None else None
+                         for index, product in self._products.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """
+        Rebuilds results from the output of to_dict, keeping the products already built.
+        """
+        results = cls(raw_results=data.get("raw_results", []), source=data.get("source", "lykdat"))
+        results._products = {
+            int(index): Product.from_record(product) if product is not None else None
+            for index, product in data.get("products", {}).items()
+        }
+        return results
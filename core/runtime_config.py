@@ -0,0 +1,90 @@
+import os
+
+import cv2
+import torch
+
+from utils.constants import InferenceExecutor as Constants
+
+# Thread pools of native libraries that would otherwise each size themselves to every core
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def parse_worker_layout(layout: str = Constants.WORKER_LAYOUT) -> tuple:
+    """
+    Parses a "<workers>x<threads per worker>" layout, e.g. "2x2".
+
+    Args:
+        layout (str): The layout string.
+
+    Returns:
+        tuple: (workers, threads_per_worker)
+    """
+    try:
+        workers, threads_per_worker = (int(part) for part in layout.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"Invalid worker layout '{layout}', expected '<workers>x<threads per worker>'")
+
+    if workers < 1 or threads_per_worker < 1:
+        raise ValueError(f"Invalid worker layout '{layout}', both parts must be at least 1")
+    return workers, threads_per_worker
+
+
+def get_available_cpus() -> list[int]:
+    """
+    Returns the CPUs this process is allowed to run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def get_worker_cpus(slot: int, threads_per_worker: int) -> list[int]:
+    """
+    Returns the CPUs reserved for a worker, so that workers get disjoint slices of the machine.
+    Slots wrap around when the layout asks for more threads than there are CPUs.
+
+    Args:
+        slot (int): The index of the worker.
+        threads_per_worker (int): The number of CPUs per worker.
+
+    Returns:
+        list[int]: The CPU ids for the worker.
+    """
+    cpus = get_available_cpus()
+    start = slot * threads_per_worker
+    return [cpus[(start + offset) % len(cpus)] for offset in range(min(threads_per_worker, len(cpus)))]
+
+
+def export_thread_environment(threads: int):
+    """
+    Sets the thread count environment variables of native libraries for processes started from now on.
+    They only take effect in a process that has not loaded those libraries yet, e.g. spawned workers.
+
+    Args:
+        threads (int): Intra-op threads per worker.
+    """
+    for env_var in THREAD_ENV_VARS:
+        os.environ[env_var] = str(threads)
+
+
+def configure_runtime(threads: int, interop_threads: int = 1, cpus: list[int] = None):
+    """
+    Limits the intra-op threads of PyTorch and OpenCV for the calling worker,
+    and optionally pins it to the given CPUs.
+
+    Args:
+        threads (int): Intra-op threads per inference.
+        interop_threads (int): Inter-op threads. Can only be set before PyTorch runs parallel work.
+        cpus (list[int], optional): CPUs to pin the calling thread or process to.
+    """
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # Already set, or PyTorch has already started inter-op work in this process
+        pass
+    cv2.setNumThreads(threads)
+
+    if cpus and hasattr(os, "sched_setaffinity"):
+        # With pid 0 this pins the calling thread; native thread pools it starts inherit the mask
+        os.sched_setaffinity(0, cpus)
@@ -1,10 +1,20 @@
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from PIL import Image
 
-from api.lykdat_api import search_lykdat
+from api.lykdat_api import search_lykdat, search_lykdat_results_async
 from api.serp_api import search_product as search_serp
+from core.inference_executor import InferenceExecutor
 from core.models.product import Product
-from core.segmentation import ClothesSegformer
+from core.product_results import ProductResults
+from core.segmentation import ClothesSegformer, segment_clothes
+from utils.constants import SearchEngine as Constants
+from utils.constants import SegmentationCache as SegmentationCacheConstants
+from utils.metrics import metrics
+
+# Shared pool for SerpAPI fallback lookups
+fallback_pool = ThreadPoolExecutor(max_workers=Constants.FALLBACK_WORKERS, thread_name_prefix="serp-fallback")
 
 class SearchEngine:
     """
@@ -63,31 +73,64 @@ class SearchEngine:
             clothe_types.append(clothe_type)
         return clothe_types
 
-    def search_product_by_type(self, clothe_type: str) -> list[Product]:
+    @staticmethod
+    def search_serp_fallbacks(queries, deadline_seconds: float = Constants.FALLBACK_DEADLINE_SECONDS) -> dict:
         """
-        Searches for similar products based on a given clothing type.
+        Runs SerpAPI fallback searches concurrently, under one deadline for all of them.
+        Searches that do not finish in time are dropped.
 
         Args:
-            clothe_type (str): The type of clothing to search for.
+            queries (Iterable[str]): The product names to search for. Duplicates are searched once.
+            deadline_seconds (float): The time budget for all searches together.
 
         Returns:
-            list[Product]: A list of Product objects containing search results.
+            dict: A dictionary mapping each completed query to its list of Product results.
         """
-        processed_results = []
-        clothe_image = self.detected_clothes[clothe_type]
+        start = time.perf_counter()
+        futures = {
+            fallback_pool.submit(search_serp, query=query, limit=Constants.FALLBACK_LIMIT): query
+            for query in set(queries)
+        }
+        if not futures:
+            return {}
+
+        done, not_done = wait(futures, timeout=deadline_seconds)
+        for future in not_done:
+            future.cancel()
+
+        metrics.observe("search.fallback_seconds", time.perf_counter() - start)
+        metrics.increment("search.fallback_queries", len(futures))
+        metrics.increment("search.fallback_dropped", len(not_done))
+        return {futures[future]: future.result() for future in done}
+
+    def get_fallback_queries(self, lykdat_results: list[Product]) -> list[str]:
+        """
+        Returns the names of the Lykdat products without a usable image, to be searched on SerpAPI instead.
+        """
+        return [product.name for product in lykdat_results if not self.is_valid_image_data(img_data=product.image_path)]
 
-        # First attempt with Lykdat API
-        lykdat_results = search_lykdat(image=clothe_image)
+    def merge_fallback_results(self, lykdat_results: list[Product], fallback_results: dict) -> list[Product]:
+        """
+        Replaces every Lykdat product without a usable image by the first SerpAPI result for its name,
+        and drops it if there is none.
+
+        Args:
+            lykdat_results (list[Product]): The products found by Lykdat.
+            fallback_results (dict): A dictionary mapping product names to their SerpAPI results.
+
+        Returns:
+            list[Product]: The products to show.
+        """
+        processed_results = []
 
         for product in lykdat_results:
             # Check if image URL is valid
             # TODO: Make sure the new flow works!
             # valid_image = self.is_valid_image_url(url=product.image_url)
-            valid_image = self.is_valid_image_data(img_data=product.image_data)
+            valid_image = self.is_valid_image_data(img_data=product.image_path)
 
             if not valid_image:
-                # Fallback to SerpAPI using product name
-                serp_results = search_serp(query=product.name)
+                serp_results = fallback_results.get(product.name)
                 if not serp_results:
                     # Skip if no results from SerpAPI
                     continue
@@ -98,6 +141,45 @@ class SearchEngine:
 
         return processed_results
 
+    def search_product_by_type(self, clothe_type: str) -> list[Product]:
+        """
+        Searches for similar products based on a given clothing type.
+
+        Args:
+            clothe_type (str): The type of clothing to search for.
+
+        Returns:
+            list[Product]: A list of Product objects containing search results.
+        """
+        clothe_image = self.detected_clothes[clothe_type]
+
+        # First attempt with Lykdat API
+        lykdat_results = search_lykdat(image=clothe_image)
+
+        # Fallback to SerpAPI using product name, for all products without a usable image at once
+        fallback_results = self.search_serp_fallbacks(self.get_fallback_queries(lykdat_results))
+
+        return self.merge_fallback_results(lykdat_results, fallback_results)
+
+    async def search_product_results_async(self, clothe_type: str) -> ProductResults:
+        """
+        Searches for similar products and returns all of them as ProductResults, once the first
+        usable product is ready to show. The others are built, and their images fetched, when they are reached.
+
+        Args:
+            clothe_type (str): The type of clothing to search for.
+
+        Returns:
+            ProductResults: The products found, the first usable one already built.
+        """
+        start = time.perf_counter()
+        results = await search_lykdat_results_async(image=self.detected_clothes[clothe_type])
+
+        if results:
+            await results.find_usable(0)
+            metrics.observe("search.time_to_first_result_seconds", time.perf_counter() - start)
+        return results
+
     def extract_clothes_from_image(self, image: Image):
         """
         Extracts clothing items from a given image using ClothesSegmorfer.
@@ -105,5 +187,26 @@ class SearchEngine:
         Args:
             image (Image): The image to analyze.
         """
-        self.detected_clothes = self.segformer.get_clothes_from_image(image=image)
+        self.set_detected_clothes(self.segformer.get_clothes_from_image(image=image))
+
+    async def extract_clothes_from_image_async(self, image, executor: InferenceExecutor):
+        """
+        Extracts clothing items from raw image bytes on the given inference executor,
+        without blocking the event loop.
+
+        Args:
+            image (bytes): The input image as a byte stream.
+            executor (InferenceExecutor): The pool to run segmentation on.
+        """
+        # Only photos missing from the segmentation cache wait for the shared segmentation rate limit
+        self.set_detected_clothes(await executor.run(segment_clothes, image, SegmentationCacheConstants.ENABLED, True))
+
+    def set_detected_clothes(self, detected_clothes: dict):
+        """
+        Stores clothing items extracted elsewhere, e.g. by the inference executor.
+
+        Args:
+            detected_clothes (dict): A dictionary mapping clothing types to their respective images.
+        """
+        self.detected_clothes = detected_clothes
         self.clothe_types = list(self.detected_clothes.keys())
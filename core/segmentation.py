@@ -1,35 +1,225 @@
-import io
+import queue
+import threading
+import time
+from concurrent.futures import Future
 import torch
-from transformers import SegformerImageProcessor, SegformerForSemanticSegmentation
+from transformers import SegformerImageProcessor
 import cv2
 from PIL import Image
 import matplotlib.pyplot as plt
 import numpy as np
 
+from core.image_ingest import ingest_image
+from core.segmentation_cache import CachedSegmentation, SegmentationCache, segmentation_cache
+from core.inference_backends import SegformerBackend, create_backend
+from core.runtime_config import configure_runtime, get_worker_cpus
 from utils.constants import ClothesSegformer as Constants
+from utils.constants import InferenceExecutor as ExecutorConstants
+from utils.constants import SegmentationCache as CacheConstants
+from utils.metrics import metrics, get_resident_memory_mb
+from utils.rate_limiter import TokenBucket, segmentation_rate_limiter
+
+
+# The batch scheduler of the inference worker running in the current thread, see initialize_inference_worker
+_worker_context = threading.local()
+
+
+class SegformerModelRegistry:
+    """
+    A process-wide registry that loads each Segformer checkpoint once and shares it across all sessions.
+    The shared processor and model are treated as read-only: per-request state (image, inputs,
+    segmentation map) is never stored on them. The model runs on the inference backend chosen
+    by SNAPPO_SEGMENTATION_BACKEND.
+    """
+    _models = {}
+    _batch_schedulers = {}  # (model name, worker slots, threads per worker) -> scheduler
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, model_name: str = Constants.B2_CLOTHES_MODEL_NAME):
+        """
+        Returns the shared processor and model for the given checkpoint, loading them on first use.
+
+        Args:
+            model_name (str): The Hugging Face checkpoint name.
+
+        Returns:
+            tuple: (SegformerImageProcessor, SegformerBackend)
+        """
+        with cls._lock:
+            if model_name not in cls._models:
+                cls._models[model_name] = cls._load(model_name, Constants.INFERENCE_BACKEND)
+            return cls._models[model_name]
+
+    @classmethod
+    def get_batch_scheduler(cls, worker_slots: range, threads_per_worker: int,
+                            model_name: str = Constants.B2_CLOTHES_MODEL_NAME):
+        """
+        Returns the batch scheduler shared by the inference workers of a process, one per worker layout,
+        or None when batching is disabled. A batch never waits for more images than there are workers
+        to submit them, so a process with a single worker does not batch at all.
+
+        Args:
+            worker_slots (range): The slots of the inference workers in this process, which submit to the scheduler.
+            threads_per_worker (int): Intra-op threads of each of those workers.
+            model_name (str): The Hugging Face checkpoint name.
+
+        Returns:
+            SegmentationBatchScheduler: The scheduler in front of the shared model, or None.
+        """
+        max_batch_size = min(Constants.BATCH_MAX_SIZE, len(worker_slots))
+        if max_batch_size <= 1:
+            return None
+
+        processor, model = cls.get(model_name)
+        key = (model_name, tuple(worker_slots), threads_per_worker)
+        with cls._lock:
+            if key not in cls._batch_schedulers:
+                # A batch carries the work of every worker, so it gets all of their threads and CPUs
+                cpus = None
+                if ExecutorConstants.PIN_CPU_AFFINITY:
+                    cpus = sorted({cpu for slot in worker_slots for cpu in get_worker_cpus(slot, threads_per_worker)})
+                cls._batch_schedulers[key] = SegmentationBatchScheduler(
+                    forward=lambda images: ClothesSegformer.compute_logits(processor, model, images),
+                    max_batch_size=max_batch_size,
+                    max_wait_ms=Constants.BATCH_MAX_WAIT_MS,
+                    threads=len(worker_slots) * threads_per_worker,
+                    cpus=cpus,
+                )
+            return cls._batch_schedulers[key]
+
+    @staticmethod
+    def _load(model_name: str, backend_name: str):
+        """
+        Loads the processor and model from disk and reports the cold-load time and resident memory.
+        """
+        memory_before = get_resident_memory_mb()
+        start = time.perf_counter()
+
+        processor = SegformerImageProcessor.from_pretrained(model_name)
+        model = create_backend(backend_name, model_name)
+
+        load_seconds = time.perf_counter() - start
+        memory_after = get_resident_memory_mb()
+
+        metrics.increment("segformer.model_loads")
+        metrics.set_gauge("segformer.cold_load_seconds", load_seconds)
+        metrics.set_gauge("process.resident_memory_mb", memory_after)
+        print(f"{Constants.MODEL_LOADED_MESSAGE} '{model_name}' ({backend_name}) in {load_seconds:.2f}s "
+              f"(resident memory: {memory_before:.0f}MB -> {memory_after:.0f}MB)")
+
+        return processor, model
+
+
+class SegmentationBatchScheduler:
+    """
+    Collects concurrent segmentation requests and runs them through the model as a single batch.
+
+    A request waits until `max_batch_size` images are queued or `max_wait_ms` has passed since
+    the first image of the batch arrived, whichever comes first. The processor and model then run
+    once on the stacked batch and each caller receives the logits of its own image.
+    Batching only happens across callers in the same process, e.g. inference executor threads.
+
+    Attributes:
+        max_batch_size (int): The maximal number of images in a single forward pass.
+        max_wait_ms (float): The maximal time the first image of a batch waits for company.
+        threads (int): Intra-op threads of the batching thread, which runs every forward pass.
+        cpus (list[int]): CPUs the batching thread is pinned to, or None.
+    """
+    def __init__(self, forward, max_batch_size: int, max_wait_ms: float, threads: int, cpus: list[int] = None):
+        self.forward = forward
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.threads = threads
+        self.cpus = cpus
+
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, image) -> Future:
+        """
+        Queues an image for the next batch.
+
+        Args:
+            image (Image): The image to segment.
+
+        Returns:
+            Future: Resolves to the (1, num_labels, h, w) logits tensor of the image.
+        """
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="segformer-batcher", daemon=True)
+                self._worker.start()
+
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def _collect_batch(self) -> list:
+        """
+        Blocks for the first request, then gathers more until the batch is full or the wait expires.
+        """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        configure_runtime(self.threads, cpus=self.cpus)
+
+        while True:
+            batch = self._collect_batch()
+            images = [image for image, _ in batch]
+
+            # The intra-op thread count of PyTorch is process-wide, and workers set their own when they start
+            if torch.get_num_threads() != self.threads:
+                torch.set_num_threads(self.threads)
+
+            try:
+                with metrics.timer("segformer.forward_seconds"):
+                    logits = self.forward(images)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            metrics.increment("segformer.batches")
+            metrics.increment("segformer.batched_images", len(batch))
+            for index, (_, future) in enumerate(batch):
+                future.set_result(logits[index:index + 1])
+
 
 class ClothesSegformer:
     """
     A class for segmenting clothing items from images using a pre-trained Segformer model.
     This class provides methods for image preprocessing, segmentation, and extraction of individual clothing items.
+
+    The underlying model is shared process-wide through SegformerModelRegistry, so creating
+    a ClothesSegformer is cheap. Instances hold no per-request state and are safe to share.
+    Inside an inference worker, forward passes go through the worker's batch scheduler, if any.
     """
-    model: SegformerForSemanticSegmentation
+    model: SegformerBackend
     processor: SegformerImageProcessor
 
-    image = None
-    inputs = None
-
-    seg_map: torch.Tensor
-    colored_mask: np.ndarray
-
     label_to_name = Constants.LABEL_TO_NAME
     color_map = Constants.COLOR_MAP
 
     def __init__(self):
         """
-        Initializes the ClothesSegmorfer by loading the pre-trained model and processor.
+        Initializes the ClothesSegmorfer with the shared pre-trained model and processor.
         """
         self.processor, self.model = self.load_model()
+        self.batch_scheduler = getattr(_worker_context, "batch_scheduler", None)
 
     ##################################
     ### Clothes Extraction Methods ###
@@ -37,63 +227,154 @@ class ClothesSegformer:
     @staticmethod
     def load_model():
         """
-        Loads the pre-trained Segformer model and image processor for semantic segmentation.
+        Returns the shared pre-trained Segformer model and image processor, loading them once per process.
 
         Returns:
-            tuple: (SegformerImageProcessor, SegformerForSemanticSegmentation)
+            tuple: (SegformerImageProcessor, SegformerBackend)
         """
-        processor = SegformerImageProcessor.from_pretrained(Constants.B2_CLOTHES_MODEL_NAME)
-        model = SegformerForSemanticSegmentation.from_pretrained(Constants.B2_CLOTHES_MODEL_NAME)
-        model.eval()
-        return processor, model
+        return SegformerModelRegistry.get(Constants.B2_CLOTHES_MODEL_NAME)
 
-    def process_image_inputs(self):
+    @staticmethod
+    def compute_logits(processor, model, images: list):
         """
-        Processes the input image using the Segformer image processor.
+        Runs the Segformer image processor and model once on a batch of images.
+
+        Args:
+            processor (SegformerImageProcessor): The image processor.
+            model (SegformerBackend): The segmentation model's inference backend.
+            images (list[Image]): The images to segment.
+
+        Returns:
+            torch.Tensor: Logits of shape (batch, num_labels, height / 4, width / 4).
         """
-        self.inputs = self.processor(images=self.image, return_tensors="pt")
+        inputs = processor(images=images, return_tensors="pt")
+        return model(inputs["pixel_values"])
 
-    def get_segmentation_map(self):
+    @staticmethod
+    def get_working_size(mode: str, logits_size, image_size, max_side: int = Constants.WORKING_MAX_SIDE) -> tuple:
+        """
+        Returns the resolution at which the per-pixel labels are computed for a given mode.
+
+        Args:
+            mode (str): "full" for the original image size, "model" for the logits resolution,
+                or "capped" for the image size scaled down so its longest side is at most max_side.
+            logits_size (tuple): (height, width) of the model logits.
+            image_size (tuple): (width, height) of the original image.
+            max_side (int): The longest side allowed in "capped" mode.
+
+        Returns:
+            tuple: (height, width) of the working resolution.
+        """
+        width, height = image_size
+        if mode == "full":
+            return height, width
+        if mode == "model":
+            return tuple(logits_size)
+        if mode == "capped":
+            scale = min(1.0, max_side / max(width, height))
+            return max(1, round(height * scale)), max(1, round(width * scale))
+
+        raise ValueError(f"Unknown segmentation map mode: {mode}")
+
+    @staticmethod
+    def upsample_label_map(labels, size):
+        """
+        Resizes a label map to the given size with nearest-neighbour sampling.
+        Works on the compact uint8 labels, so it costs one byte per output pixel.
+
+        Args:
+            labels (torch.Tensor): Label map of shape (h, w).
+            size (tuple): (height, width) of the output.
+
+        Returns:
+            torch.Tensor: Label map of shape (height, width).
+        """
+        height, width = size
+        rows = (torch.arange(height) * labels.shape[0] // height).clamp_(max=labels.shape[0] - 1)
+        cols = (torch.arange(width) * labels.shape[1] // width).clamp_(max=labels.shape[1] - 1)
+        return labels[rows][:, cols]
+
+    @staticmethod
+    def logits_to_segmentation_map(logits, image_size,
+                                   mode: str = Constants.SEGMENTATION_MAP_MODE,
+                                   max_side: int = Constants.WORKING_MAX_SIDE):
+        """
+        Turns the logits of a single image into a per-pixel label map of its original size.
+
+        In "full" mode the logits are bilinearly upsampled to the original size before the argmax,
+        which allocates a float tensor of num_labels x height x width. The "model" and "capped"
+        modes take the argmax at a lower working resolution and only upsample the uint8 label map.
+
+        Args:
+            logits (torch.Tensor): Logits of shape (1, num_labels, h, w).
+            image_size (tuple): (width, height) of the original image.
+            mode (str): "full", "model" or "capped". See get_working_size.
+            max_side (int): The longest working side in "capped" mode.
+
+        Returns:
+            torch.Tensor: uint8 segmentation map of shape (height, width).
+        """
+        working_size = ClothesSegformer.get_working_size(mode, logits.shape[-2:], image_size, max_side)
+
+        if working_size != tuple(logits.shape[-2:]):
+            logits = torch.nn.functional.interpolate(
+                logits,
+                size=working_size,  # (height, width)
+                mode="bilinear",
+                align_corners=False,
+            )
+        labels = logits.argmax(dim=1)[0].to(torch.uint8)
+
+        image_height_width = tuple(image_size[::-1])
+        if working_size != image_height_width:
+            labels = ClothesSegformer.upsample_label_map(labels, image_height_width)
+
+        return labels
+
+    def get_segmentation_map(self, image):
         """
         Generates a segmentation map for the input image.
+        Concurrent calls are batched into a single forward pass when batching is enabled.
+
+        Args:
+            image (Image): The image to segment.
 
         Returns:
             torch.Tensor: Segmentation map of the image.
         """
-        self.process_image_inputs()
-
-        with torch.no_grad():
-            outputs = self.model(**self.inputs)
+        if self.batch_scheduler is not None:
+            logits = self.batch_scheduler.submit(image).result()
+        else:
+            with metrics.timer("segformer.forward_seconds"):
+                logits = self.compute_logits(self.processor, self.model, [image])
 
-        logits = outputs.logits
-        upsampled_logits = torch.nn.functional.interpolate(
-            logits,
-            size=self.image.size[::-1],  # (height, width)
-            mode="bilinear",
-            align_corners=False,
-        )
-        return upsampled_logits.argmax(dim=1)[0]
+        return self.logits_to_segmentation_map(logits, image.size)
 
-    def extract_clothes(self) -> dict:
+    def extract_clothes(self, image, seg_map) -> dict:
         """
         Extracts individual clothing items from the segmented image.
+        Label statistics come from a single pass over the map, after which each item
+        only touches the pixels inside its own bounding box.
+
+        Args:
+            image (Image): The segmented image.
+            seg_map (torch.Tensor): Segmentation map of the image.
 
         Returns:
-            dict: A dictionary containing extracted clothing items with labels as keys and images as values.
+            dict: A dictionary containing extracted clothing items with labels as keys and images as values,
+                ordered from the largest mask area to the smallest.
         """
-        # detected_items = []
         detected_items = {}
-        img_array = np.array(self.image)
-        unique_labels = np.unique(self.seg_map.cpu().numpy())
+        img_array = np.array(image)
+        label_map = self.to_label_array(seg_map)
+        counts, boxes = self.summarize_labels(label_map)
 
-        for label in unique_labels:
-            if label not in self.label_to_name:
-                continue
+        present_labels = [label for label in self.label_to_name if label < len(counts) and counts[label] > 0]
+        for label in sorted(present_labels, key=lambda present_label: counts[present_label], reverse=True):
+            clothe_type = self.label_to_name[label]
 
             # Get masked crop
-            cropped_img, cropped_mask = self.create_masked_crop(label, img_array)
-            if cropped_img is None:
-                continue
+            cropped_img, cropped_mask = self.create_masked_crop(label_map, label, boxes[label], img_array)
 
             # Create transparent image
             rgba = self.create_transparent_crop(cropped_img, cropped_mask)
@@ -103,31 +384,70 @@ class ClothesSegformer:
             pil_image = Image.fromarray(rgba)
             background.paste(pil_image, (0, 0), pil_image)
 
-            detected_items[self.label_to_name[label]] = background
+            detected_items[clothe_type] = background
 
         return detected_items
 
-    def get_clothes_from_image(self, image) -> dict:
+    def get_clothes_from_image(self, image, use_cache: bool = CacheConstants.ENABLED,
+                               rate_limiter: TokenBucket = None) -> dict:
         """
         Processes an image to extract clothing items.
+        Photos seen before are answered from the segmentation cache.
 
         Args:
             image (bytes): The input image as a byte stream.
+            use_cache (bool, optional): Whether to use the segmentation cache. Defaults to SNAPPO_SEGMENTATION_CACHE.
+            rate_limiter (TokenBucket, optional): Waited on before running the model, so cache hits are not limited.
 
         Returns:
             dict: Extracted clothing items.
+
+        Raises:
+            RateLimitExceededError: If the photo would wait too long for the rate limiter.
+        """
+        if not use_cache:
+            if rate_limiter is not None:
+                rate_limiter.acquire_blocking()
+            return self.segment_ingested_image(ingest_image(image))[1]
+
+        # An exact re-send is answered without decoding the photo
+        raw_key = SegmentationCache.raw_key(image)
+        cached = segmentation_cache.get_by_raw(raw_key)
+        if cached is not None:
+            return cached.detected_items
+
+        ingested = ingest_image(image)
+        pixels_key, signature, cached = segmentation_cache.get(ingested.image)
+        if cached is None:
+            if rate_limiter is not None:
+                rate_limiter.acquire_blocking()
+            label_map, detected_items = self.segment_ingested_image(ingested)
+            cached = CachedSegmentation(label_map, detected_items, signature)
+            segmentation_cache.put(pixels_key, cached)
+
+        segmentation_cache.add_raw_alias(raw_key, pixels_key)
+        return cached.detected_items
+
+    def segment_ingested_image(self, ingested) -> tuple:
         """
-        if self.image:
-            self.image.close()
+        Segments a decoded photo and extracts its clothing items.
 
-        self.image = Image.open(io.BytesIO(image))
+        Args:
+            ingested (IngestedImage): The decoded photo.
 
+        Returns:
+            tuple: (label_map, detected_items) with the uint8 label map as a numpy array.
+        """
         # Get segmentation map
-        self.seg_map = self.get_segmentation_map()
+        seg_map = self.get_segmentation_map(ingested.image)
 
-        # Extract clothes using segmentation map
-        detected_items = self.extract_clothes()
-        return detected_items
+        # Extract clothes using segmentation map, cutting crops from the original pixels if configured
+        crop_source = ingested.image
+        if Constants.CROP_FROM_ORIGINAL and ingested.is_downscaled:
+            crop_source = ingested.load_original()
+
+        label_map = self.to_label_array(seg_map)
+        return label_map, self.extract_clothes(crop_source, label_map)
 
     ##################################################
     ### Extracted Clothes Image Processing Methods ###
@@ -149,67 +469,104 @@ class ClothesSegformer:
         rgba[..., 3] = cropped_mask * 255
         return rgba
 
-    def create_mask_and_indices(self, label):
+    @staticmethod
+    def to_label_array(seg_map) -> np.ndarray:
         """
-        Creates a binary mask and retrieves indices for a clothing item.
+        Returns the segmentation map as a numpy label array.
+        """
+        return seg_map.cpu().numpy() if torch.is_tensor(seg_map) else np.asarray(seg_map)
+
+    @staticmethod
+    def summarize_labels(label_map: np.ndarray) -> tuple:
+        """
+        Computes the pixel count and bounding box of every label in a single pass over the label map.
+
+        Each pixel is binned by (label, row) and by (label, column), so the cost is O(height * width)
+        regardless of how many labels are present.
 
         Args:
-            label (int): Label ID to create the mask for.
+            label_map (np.ndarray): Label map of shape (height, width).
 
         Returns:
-            tuple: (mask, y_indices, x_indices) or (None, None, None) if no mask is found.
+            tuple: (counts, boxes) where counts[label] is the number of pixels of the label and
+                boxes[label] is its inclusive (y_min, y_max, x_min, x_max), or -1s if the label is absent.
         """
-        mask = (self.seg_map == label).cpu().numpy()
-        if not np.any(mask):
-            return None, None, None
-
-        y_indices, x_indices = np.where(mask)
-        if len(y_indices) == 0 or len(x_indices) == 0:
-            return None, None, None
-
-        return mask, y_indices, x_indices
+        height, width = label_map.shape
+        labels = label_map.astype(np.int64)
+        num_labels = int(labels.max()) + 1 if labels.size else 0
+
+        row_counts = np.bincount((labels * height + np.arange(height)[:, None]).ravel(),
+                                 minlength=num_labels * height).reshape(num_labels, height)
+        column_present = np.bincount((labels * width + np.arange(width)[None, :]).ravel(),
+                                     minlength=num_labels * width).reshape(num_labels, width) > 0
+        row_present = row_counts > 0
+        counts = row_counts.sum(axis=1)
+
+        boxes = np.full((num_labels, 4), -1, dtype=np.int64)
+        present = counts > 0
+        boxes[present, 0] = row_present[present].argmax(axis=1)
+        boxes[present, 1] = height - 1 - row_present[present, ::-1].argmax(axis=1)
+        boxes[present, 2] = column_present[present].argmax(axis=1)
+        boxes[present, 3] = width - 1 - column_present[present, ::-1].argmax(axis=1)
+
+        return counts, boxes
 
-    def get_bounding_box(self, indices, padding=5):
+    @staticmethod
+    def get_bounding_box(map_shape, box, padding=5):
         """
-        Calculates the bounding box coordinates for a segmented clothing item.
+        Pads the bounding box of a segmented clothing item, clamped to the segmentation map.
 
         Args:
-            indices (tuple): (y_indices, x_indices) of the segmented item.
+            map_shape (tuple): (height, width) of the segmentation map.
+            box (tuple): Inclusive (y_min, y_max, x_min, x_max) of the segmented item.
             padding (int, optional): Padding around the bounding box. Defaults to 5.
 
         Returns:
             tuple: (y_min, y_max, x_min, x_max) bounding box coordinates.
         """
-        y_indices, x_indices = indices
-        y_min = max(0, np.min(y_indices) - padding)
-        y_max = min(self.seg_map.shape[0], np.max(y_indices) + padding)
-        x_min = max(0, np.min(x_indices) - padding)
-        x_max = min(self.seg_map.shape[1], np.max(x_indices) + padding)
+        y_min, y_max, x_min, x_max = (int(value) for value in box)
+        y_min = max(0, y_min - padding)
+        y_max = min(map_shape[0], y_max + padding)
+        x_min = max(0, x_min - padding)
+        x_max = min(map_shape[1], x_max + padding)
         return y_min, y_max, x_min, x_max
 
-    def create_masked_crop(self, label, img_array):
+    def create_masked_crop(self, label_map, label, box, img_array):
         """Create masked crop of an image for a given label.
 
+        The source image may be larger than the label map, e.g. when crops are cut from the
+        original photo. The box is then scaled to the image and only the item's mask is upsampled.
+
         Args:
+            label_map: Label map of the image
             label: Label ID to create mask for
+            box: Inclusive (y_min, y_max, x_min, x_max) of the label, from summarize_labels
             img_array: Source image array
 
         Returns:
-            tuple: (cropped_img, cropped_mask) or (None, None) if no mask found
+            tuple: (cropped_img, cropped_mask)
         """
-        # Get mask and indices
-        mask, y_indices, x_indices = self.create_mask_and_indices(label)
-        if mask is None:
-            return None, None
+        map_height, map_width = label_map.shape
+        y_min, y_max, x_min, x_max = self.get_bounding_box(label_map.shape, box)
+        y_max, x_max = min(y_max, map_height - 1), min(x_max, map_width - 1)
 
-        # Get bounding box
-        y_min, y_max, x_min, x_max = self.get_bounding_box((y_indices, x_indices))
+        # Compare labels only inside the bounding box
+        cropped_mask = label_map[y_min:y_max + 1, x_min:x_max + 1] == label
 
-        # Crop image and mask
-        cropped_img = img_array[y_min:y_max + 1, x_min:x_max + 1].copy()
-        cropped_mask = mask[y_min:y_max + 1, x_min:x_max + 1]
+        image_height, image_width = img_array.shape[:2]
+        if (image_height, image_width) == (map_height, map_width):
+            return img_array[y_min:y_max + 1, x_min:x_max + 1], cropped_mask
 
-        return cropped_img, cropped_mask
+        # Scale the box to the source image and upsample the mask with nearest-neighbour sampling
+        image_y_min, image_y_end = y_min * image_height // map_height, -(-(y_max + 1) * image_height // map_height)
+        image_x_min, image_x_end = x_min * image_width // map_width, -(-(x_max + 1) * image_width // map_width)
+        rows = np.clip(np.arange(image_y_min, image_y_end) * map_height // image_height - y_min,
+                       0, cropped_mask.shape[0] - 1)
+        cols = np.clip(np.arange(image_x_min, image_x_end) * map_width // image_width - x_min,
+                       0, cropped_mask.shape[1] - 1)
+
+        cropped_img = img_array[image_y_min:image_y_end, image_x_min:image_x_end]
+        return cropped_img, cropped_mask[rows][:, cols]
 
     ##########################################
     ### Presenting Model's Results Methods ###
@@ -244,12 +601,12 @@ class ClothesSegformer:
         plt.tight_layout()
         plt.show()
 
-    def display_segmentation_plot(self):
+    def display_segmentation_plot(self, image, seg_map):
         fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(15, 5))
-        colored_mask = self.create_colored_mask()
+        colored_mask = self.create_colored_mask(seg_map)
 
         # Original image
-        ax1.imshow(self.image)
+        ax1.imshow(image)
         ax1.set_title('Original Image')
         ax1.axis('off')
 
@@ -259,7 +616,7 @@ class ClothesSegformer:
         ax2.axis('off')
 
         # Blended result
-        img_array = np.array(self.image)
+        img_array = np.array(image.convert("RGB"))
         blended = cv2.addWeighted(img_array, 0.7, colored_mask, 0.3, 0)
         ax3.imshow(blended)
         ax3.set_title('Blended Result')
@@ -267,24 +624,68 @@ class ClothesSegformer:
 
         plt.show()
 
-    def create_colored_mask(self):
-        colored_mask = np.zeros((self.seg_map.shape[0], self.seg_map.shape[1], 3), dtype=np.uint8)
+    def create_colored_mask(self, seg_map):
+        label_map = self.to_label_array(seg_map)
+        palette = np.zeros((max(256, int(label_map.max()) + 1), 3), dtype=np.uint8)
         for label, color in self.color_map.items():
-            mask = self.seg_map == label
-            colored_mask[mask] = color
-        return colored_mask
+            palette[label] = color
+        return palette[label_map]
 
-    def print_detected_items(self):
-        unique_labels = np.unique(self.seg_map)
+    def print_detected_items(self, seg_map):
+        label_map = self.to_label_array(seg_map)
+        counts = np.bincount(label_map.ravel())
         print("\nDetected items:")
-        for label in unique_labels:
-            if label in self.color_map:
-                percentage = (self.seg_map == label).sum() / (self.seg_map.shape[0] * self.seg_map.shape[1]) * 100
+        for label, count in enumerate(counts):
+            if count and label in self.color_map:
+                percentage = count / label_map.size * 100
                 print(f"Class {label}: {percentage:.1f}% of image")
 
     @staticmethod
     def test_clothes_extraction(image_url="media/demo_photo_0.jpeg"):
         segformer = ClothesSegformer()
-        clothes = segformer.get_clothes_from_image(image_url)
-        segformer.display_segmentation_plot()
-        segformer.display_extracted_clothes_plot(clothes_list=clothes)
+        with Image.open(image_url) as image:
+            seg_map = segformer.get_segmentation_map(image)
+            clothes = segformer.extract_clothes(image, seg_map)
+            segformer.display_segmentation_plot(image, seg_map)
+        segformer.display_extracted_clothes_plot(
+            clothes_list=[{"clothe_type": name, "image": img} for name, img in clothes.items()]
+        )
+
+
+def initialize_inference_worker(slot: int, workers_per_process: int, threads_per_worker: int):
+    """
+    Prepares an inference executor worker: limits its intra-op threads, pins it to its own
+    slice of CPUs when SNAPPO_INFERENCE_PIN_CPUS is set, loads the shared model, and picks the
+    batch scheduler of the workers in its process, which runs their forward passes.
+
+    Args:
+        slot (int): The index of the worker.
+        workers_per_process (int): The number of workers sharing the worker's process.
+        threads_per_worker (int): Intra-op threads for the worker.
+    """
+    cpus = get_worker_cpus(slot, threads_per_worker) if ExecutorConstants.PIN_CPU_AFFINITY else None
+    configure_runtime(threads_per_worker, cpus=cpus)
+    ClothesSegformer.load_model()
+
+    # Slots are handed out in order, so the workers of a process hold consecutive slots
+    first_slot = slot - slot % workers_per_process
+    _worker_context.batch_scheduler = SegformerModelRegistry.get_batch_scheduler(
+        range(first_slot, first_slot + workers_per_process), threads_per_worker)
+
+
+def segment_clothes(image, use_cache: bool = CacheConstants.ENABLED, rate_limited: bool = False) -> dict:
+    """
+    Extracts clothing items from raw image bytes using the process-wide shared model.
+    Kept at module level so the inference executor can run it in a thread or process pool.
+
+    Args:
+        image (bytes): The input image as a byte stream.
+        use_cache (bool, optional): Whether to use the segmentation cache. Defaults to SNAPPO_SEGMENTATION_CACHE.
+        rate_limited (bool, optional): Whether a cache miss waits on segmentation_rate_limiter.
+            In a process pool every worker process has its own limiter.
+
+    Returns:
+        dict: Extracted clothing items.
+    """
+    rate_limiter = segmentation_rate_limiter if rate_limited else None
+    return ClothesSegformer().get_clothes_from_image(image, use_cache=use_cache, rate_limiter=rate_limiter)
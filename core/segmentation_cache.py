@@ -0,0 +1,127 @@
+import numpy as np
+from PIL import Image
+
+from utils.cache import LRUCache
+from utils.constants import SegmentationCache as Constants
+from utils.image_hashing import PhotoSignature, content_hash, image_content_hash, hamming_distance
+from utils.metrics import metrics
+
+
+class CachedSegmentation:
+    """
+    The segmentation result of one photo, as kept in the segmentation cache.
+
+    Attributes:
+        label_map (np.ndarray): The compact uint8 label map of the photo.
+        detected_items (dict): A dictionary mapping clothing types to their cropped images.
+        signature (PhotoSignature): The signature of the photo, for near-identical lookups.
+    """
+    __slots__ = ("label_map", "detected_items", "signature")
+
+    def __init__(self, label_map: np.ndarray, detected_items: dict, signature: PhotoSignature):
+        self.label_map = label_map
+        self.detected_items = detected_items
+        self.signature = signature
+
+    def estimate_size(self) -> int:
+        """
+        Returns the approximate number of bytes held by the label map, the crops and the thumbnail.
+        """
+        crops_size = sum(image.width * image.height * len(image.getbands()) for image in self.detected_items.values())
+        return self.label_map.nbytes + crops_size + self.signature.thumbnail.nbytes
+
+
+class SegmentationCache:
+    """
+    A content-addressed cache of segmentation results.
+
+    Results are keyed by a hash of the decoded pixels of the working image. A photo that was
+    re-encoded on the way (e.g. forwarded and recompressed) is matched by a perceptual hash
+    within `max_distance` bits, confirmed by the same working size and a grayscale thumbnail
+    within `max_pixel_difference` levels on average. The raw bytes of every photo are also remembered, so an exact
+    re-send is answered before the photo is even decoded.
+    Entries are evicted by LRU, TTL and a memory budget. Hits, near hits, rejected near hits
+    and misses are counted in utils.metrics under "segmentation_cache".
+    """
+    def __init__(self,
+                 max_entries: int = Constants.MAX_ENTRIES,
+                 max_megabytes: int = Constants.MAX_MEGABYTES,
+                 ttl_seconds: float = Constants.TTL_SECONDS,
+                 max_distance: int = Constants.MAX_HASH_DISTANCE,
+                 max_pixel_difference: float = Constants.MAX_PIXEL_DIFFERENCE):
+        self.max_distance = max_distance
+        self.max_pixel_difference = max_pixel_difference
+        self._results = LRUCache(name="segmentation_cache",
+                                 max_entries=max_entries,
+                                 max_bytes=max_megabytes * 2 ** 20,
+                                 ttl_seconds=ttl_seconds,
+                                 size_of=CachedSegmentation.estimate_size)
+        # Raw photo bytes hash -> decoded pixels hash
+        self._raw_aliases = LRUCache(name="segmentation_cache.raw_aliases",
+                                     max_entries=max_entries * 4,
+                                     ttl_seconds=ttl_seconds)
+
+    @staticmethod
+    def raw_key(raw) -> str:
+        return content_hash(bytes(raw))
+
+    def get_by_raw(self, raw_key: str):
+        """
+        Returns the cached result for a photo whose exact bytes were seen before, or None.
+        """
+        pixels_key = self._raw_aliases.peek(raw_key)
+        result = self._results.peek(pixels_key) if pixels_key is not None else None
+        if result is not None:
+            metrics.increment("segmentation_cache.hits")
+        return result
+
+    def get(self, image: Image.Image) -> tuple:
+        """
+        Looks up a decoded photo by its pixels, then by its signature.
+
+        Args:
+            image (Image): The working image of the photo.
+
+        Returns:
+            tuple: (pixels_key, PhotoSignature, CachedSegmentation or None). On a near hit,
+                pixels_key is the key of the matching entry rather than of this image.
+        """
+        pixels_key = image_content_hash(image)
+        signature = PhotoSignature(image, thumbnail_size=Constants.THUMBNAIL_SIZE)
+
+        result = self._results.peek(pixels_key)
+        if result is not None:
+            metrics.increment("segmentation_cache.hits")
+            return pixels_key, signature, result
+
+        for candidate_key, candidate in reversed(self._results.items()):
+            if hamming_distance(candidate.signature.perceptual_hash, signature.perceptual_hash) > self.max_distance:
+                continue
+            if signature.matches(candidate.signature, self.max_distance, self.max_pixel_difference):
+                metrics.increment("segmentation_cache.near_hits")
+                return candidate_key, signature, candidate
+            metrics.increment("segmentation_cache.near_hits_rejected")
+
+        metrics.increment("segmentation_cache.misses")
+        return pixels_key, signature, None
+
+    def cached_crop_ids(self) -> set:
+        """
+        Returns the ids of the crops held by the cached results. Sessions served from the cache
+        in this process share these crops rather than holding copies of their own.
+        """
+        return {id(image) for _, result in self._results.items() for image in result.detected_items.values()}
+
+    def put(self, pixels_key: str, result: CachedSegmentation):
+        self._results.put(pixels_key, result)
+
+    def add_raw_alias(self, raw_key: str, pixels_key: str):
+        self._raw_aliases.put(raw_key, pixels_key)
+
+    def clear(self):
+        self._results.clear()
+        self._raw_aliases.clear()
+
+
+# Process-wide segmentation cache
+segmentation_cache = SegmentationCache()
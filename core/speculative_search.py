@@ -0,0 +1,86 @@
+import asyncio
+
+from core.product_results import ProductResults
+from core.search_engine import SearchEngine
+from utils.constants import SpeculativeSearch as Constants
+from utils.metrics import metrics
+
+# Caps speculative searches across all chats; created on first use, inside the bot's event loop
+_speculation_slots = None
+
+
+def get_speculation_slots() -> asyncio.Semaphore:
+    global _speculation_slots
+
+    if _speculation_slots is None:
+        _speculation_slots = asyncio.Semaphore(Constants.MAX_CONCURRENT)
+    return _speculation_slots
+
+
+class SpeculativeSearches:
+    """
+    Product searches started in the background for the items of one photo, before the user picks one.
+
+    Items are searched in the order given, which for detected clothes is by mask area, largest first.
+    Searches wait for one of the process-wide speculation slots, so speculative API spend stays capped
+    however many chats are active. A search the user asks for before it got a slot is dropped, and the
+    caller searches directly instead. Started, used and wasted searches are counted in utils.metrics
+    under "speculative_search".
+
+    Attributes:
+        tasks (dict): A dictionary mapping clothing types to the tasks searching for them.
+    """
+    def __init__(self, search_engine: SearchEngine, clothe_types: list[str],
+                 max_items: int = Constants.MAX_ITEMS_PER_PHOTO):
+        self.search_engine = search_engine
+        self._started = set()
+        self.tasks = {
+            clothe_type: asyncio.create_task(self._search(clothe_type))
+            for clothe_type in clothe_types[:max_items]
+        }
+        metrics.increment("speculative_search.started", len(self.tasks))
+
+    async def _search(self, clothe_type: str) -> ProductResults:
+        async with get_speculation_slots():
+            self._started.add(clothe_type)
+            return await self.search_engine.search_product_results_async(clothe_type)
+
+    async def take(self, clothe_type: str):
+        """
+        Returns the results of the speculative search for a clothing type, waiting for it if it is running.
+
+        Args:
+            clothe_type (str): The clothing type the user picked.
+
+        Returns:
+            ProductResults or None: The products found, or None if there is no usable speculative search.
+        """
+        task = self.tasks.pop(clothe_type, None)
+        if task is None:
+            return None
+
+        if not task.done() and clothe_type not in self._started:
+            # Still waiting for a slot, searching directly is faster
+            task.cancel()
+            metrics.increment("speculative_search.dropped")
+            return None
+
+        # Waits without propagating the task's cancellation into the caller
+        await asyncio.wait({task})
+        if task.cancelled() or task.exception() is not None:
+            return None
+
+        metrics.increment("speculative_search.used")
+        return task.result()
+
+    def cancel(self):
+        """
+        Cancels the searches that were never taken, e.g. when a new photo arrives.
+        """
+        for task in self.tasks.values():
+            if task.done() and not task.cancelled() and task.exception() is None:
+                # Stops preparing the next product of a finished search
+                task.result().cancel()
+            task.cancel()
+        metrics.increment("speculative_search.wasted", len(self.tasks))
+        self.tasks.clear()
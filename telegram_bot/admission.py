@@ -0,0 +1,95 @@
+import asyncio
+
+from utils.metrics import metrics
+
+
+class PhotoSupersededError(Exception):
+    """
+    Raised when the processing of a photo was cancelled because the chat sent a newer one.
+    """
+
+
+class PhotoAdmission:
+    """
+    Keeps only the latest photo of every chat in flight.
+
+    `note_arrival()` is called as soon as an update arrives, before it waits for its chat's turn,
+    and `note_done()` once it was handled, so only chats with a photo still waiting are tracked.
+    A newer photo cancels the processing of the chat's current one, and photos that were already
+    superseded when their turn comes are discarded without being processed.
+
+    Superseded photos are counted in utils.metrics as "admission.photos_cancelled" (stopped while
+    processing) and "admission.photos_discarded" (never processed).
+    """
+    def __init__(self):
+        self._latest_photo = {}  # chat id -> message id of the latest photo
+        self._processing = {}  # chat id -> task processing a photo
+
+    @staticmethod
+    def get_photo_message(update):
+        message = getattr(update, "message", None)
+        return message if message is not None and message.photo else None
+
+    def note_arrival(self, update):
+        """
+        Records a newly arrived update, cancelling the chat's photo in processing if this is a newer photo.
+        """
+        message = self.get_photo_message(update)
+        if message is None:
+            return
+
+        chat_id = message.chat_id
+        self._latest_photo[chat_id] = max(message.message_id, self._latest_photo.get(chat_id, 0))
+
+        task = self._processing.get(chat_id)
+        if task is not None and not task.done():
+            task.cancel()
+            metrics.increment("admission.photos_cancelled")
+
+    def note_done(self, update):
+        """
+        Forgets a handled photo, unless a newer photo of the chat is still waiting.
+        """
+        message = self.get_photo_message(update)
+        if message is not None and self._latest_photo.get(message.chat_id) == message.message_id:
+            del self._latest_photo[message.chat_id]
+
+    def is_superseded(self, message) -> bool:
+        """
+        Returns whether a newer photo of the same chat arrived after this one.
+        """
+        superseded = message.message_id < self._latest_photo.get(message.chat_id, message.message_id)
+        if superseded:
+            metrics.increment("admission.photos_discarded")
+        return superseded
+
+    async def run_latest(self, message, coroutine):
+        """
+        Runs the processing of a photo as a task that a newer photo of the chat can cancel.
+
+        Args:
+            message (Message): The photo message.
+            coroutine (Coroutine): The processing of the photo.
+
+        Returns:
+            Any: The result of the coroutine.
+
+        Raises:
+            PhotoSupersededError: If a newer photo cancelled the processing.
+        """
+        chat_id = message.chat_id
+        task = asyncio.create_task(coroutine)
+        self._processing[chat_id] = task
+        try:
+            # Waits without the task's cancellation being raised here as our own
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            if self._processing.get(chat_id) is task:
+                del self._processing[chat_id]
+
+        if task.cancelled():
+            raise PhotoSupersededError(f"Photo {message.message_id} of chat {chat_id} was superseded")
+        return task.result()
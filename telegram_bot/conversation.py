@@ -0,0 +1,74 @@
+from telegram import Update
+from telegram.ext import BaseHandler, ConversationHandler
+
+from telegram_bot.session_store import SessionStore
+
+# Session field holding the conversation state of the chat
+STATE_FIELD = "conversation_state"
+
+
+class SessionConversation(BaseHandler):
+    """
+    Routes the updates of a chat to the handlers of its conversation state, like a ConversationHandler,
+    but keeps the state in the chat's session rather than in the application.
+
+    Every update first refreshes the chat's session from the shared backend, if there is one, and the
+    session, along with the state the handler moved to, is saved back once the handler is done. A chat
+    routed to any bot worker therefore continues under the state the previous worker left it in.
+
+    Handlers are tried in order: the entry points while the chat has no state, the handlers of its
+    state otherwise. Updates no handler accepts are ignored, as are updates without a chat.
+
+    Attributes:
+        entry_points (list[BaseHandler]): The handlers that start the conversation.
+        states (dict): Conversation state -> list[BaseHandler].
+        sessions (SessionStore): The store holding the chat sessions.
+    """
+    def __init__(self, entry_points: list, states: dict, sessions: SessionStore):
+        super().__init__(self.handle_conversation_update)
+        self.entry_points = entry_points
+        self.states = states
+        self.sessions = sessions
+
+    def check_update(self, update) -> bool:
+        # The state is only known once the session is refreshed, so handlers are chosen in the callback
+        return isinstance(update, Update) and update.effective_chat is not None
+
+    def select_handler(self, update, state) -> tuple:
+        """
+        Returns the first handler of a state that accepts the update.
+
+        Args:
+            update (Update): The incoming update.
+            state: The conversation state of the chat, or None if it has none.
+
+        Returns:
+            tuple: (handler, check_result), or (None, None) if no handler accepts the update.
+        """
+        handlers = self.entry_points if state is None else self.states.get(state, [])
+        for handler in handlers:
+            check_result = handler.check_update(update)
+            if check_result is not None and check_result is not False:
+                return handler, check_result
+        return None, None
+
+    async def handle_conversation_update(self, update, context):
+        chat_id = update.effective_chat.id
+        await self.sessions.refresh(chat_id)
+        try:
+            session = self.sessions.get(chat_id)
+            state = session.get(STATE_FIELD) if session is not None else None
+            handler, check_result = self.select_handler(update, state)
+            if handler is None:
+                return
+
+            new_state = await handler.handle_update(update, context.application, check_result, context)
+
+            # Looked up again, the handler may have replaced the session
+            session = self.sessions.setdefault(chat_id, {})
+            if new_state == ConversationHandler.END:
+                session.pop(STATE_FIELD, None)
+            elif new_state is not None:
+                session[STATE_FIELD] = new_state
+        finally:
+            await self.sessions.save(chat_id)
@@ -0,0 +1,145 @@
+"""
+Posts synthetic Telegram updates to the bot's webhook, to exercise webhook ingress locally.
+
+Every fake chat sends a sequence of updates, all chats at once, so the bot's per-chat ordering
+and overall concurrency can be watched in its logs and metrics. The "text" flow sends numbered
+text messages. The "photo" flow sends a photo, picks an item and then taps "Next product";
+its photo must be the file id of a photo the bot can download, e.g. one sent to it before.
+The bot's replies to the fake chats fail at Telegram, which does not affect the processing.
+
+Usage:
+    python -m telegram_bot.fake_sender [--url URL] [--secret-token TOKEN] [--chats N] [--messages N]
+                                       [--flow text|photo] [--photo-file-id ID] [--item TYPE]
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import httpx
+
+from utils.constants import TelegramBot as Constants
+from utils.metrics import Metrics
+
+# Telegram sends the webhook's secret token in this header
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+update_ids = itertools.count(1)
+
+
+def build_user(chat_id: int) -> dict:
+    return {"id": chat_id, "is_bot": False, "first_name": f"Fake {chat_id}"}
+
+
+def build_message(chat_id: int, message_id: int, **content) -> dict:
+    """
+    Builds a minimal private-chat message, as Telegram would post it.
+    """
+    user = build_user(chat_id)
+    return {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+        "from": user,
+        **content,
+    }
+
+
+def build_text_update(chat_id: int, text: str) -> dict:
+    update_id = next(update_ids)
+    return {"update_id": update_id, "message": build_message(chat_id, update_id, text=text)}
+
+
+def build_photo_update(chat_id: int, file_id: str) -> dict:
+    update_id = next(update_ids)
+    photo = [{"file_id": file_id, "file_unique_id": f"fake{update_id}", "width": 1280, "height": 960}]
+    return {"update_id": update_id, "message": build_message(chat_id, update_id, photo=photo)}
+
+
+def build_callback_update(chat_id: int, data: str) -> dict:
+    """
+    Builds a button tap, on a message of the bot in the chat.
+    """
+    update_id = next(update_ids)
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": build_user(chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": build_message(chat_id, update_id, text="Fake bot message"),
+        },
+    }
+
+
+def build_chat_updates(chat_id: int, message_count: int, flow: str, photo_file_id: str, item: str) -> list:
+    """
+    Builds the updates one fake chat sends, in order.
+    """
+    if flow == "text":
+        return [build_text_update(chat_id, f"message {index}") for index in range(message_count)]
+
+    updates = [build_photo_update(chat_id, photo_file_id), build_callback_update(chat_id, f"ITEM_{item}")]
+    updates += [build_callback_update(chat_id, "NEXT_PRODUCT") for _ in range(message_count - len(updates))]
+    return updates[:message_count]
+
+
+async def send_chat_updates(client: httpx.AsyncClient, url: str, headers: dict, updates: list,
+                            latencies: list) -> int:
+    """
+    Sends the updates of one fake chat in order, each after the previous one was accepted.
+    Returns the number of updates the webhook rejected.
+    """
+    failures = 0
+    for update in updates:
+        start = time.perf_counter()
+        response = await client.post(url, json=update, headers=headers)
+        latencies.append(time.perf_counter() - start)
+        failures += response.status_code != 200
+    return failures
+
+
+async def send_updates(url: str, secret_token: str, chat_count: int, message_count: int,
+                       flow: str = "text", photo_file_id: str = "", item: str = ""):
+    headers = {SECRET_TOKEN_HEADER: secret_token} if secret_token else {}
+    latencies = []
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=30) as client:
+        failures = await asyncio.gather(*(
+            send_chat_updates(client, url, headers,
+                              build_chat_updates(1_000_000 + chat, message_count, flow, photo_file_id, item),
+                              latencies)
+            for chat in range(chat_count)
+        ))
+    elapsed = time.perf_counter() - start
+
+    summary = Metrics.summarize_samples(latencies)
+    print(f"Sent {len(latencies)} updates from {chat_count} chats in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.0f}/s), {sum(failures)} rejected")
+    print(f"Webhook response time: p50 {summary['p50'] * 1000:.1f}ms, "
+          f"p95 {summary['p95'] * 1000:.1f}ms, max {summary['max'] * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send fake Telegram updates to the Snappo webhook")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{Constants.WEBHOOK_PORT}/{Constants.WEBHOOK_PATH}")
+    parser.add_argument("--secret-token", default=Constants.WEBHOOK_SECRET_TOKEN)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=5, help="Updates sent by every chat")
+    parser.add_argument("--flow", choices=("text", "photo"), default="text")
+    parser.add_argument("--photo-file-id", default="", help="File id of the photo sent in the photo flow")
+    parser.add_argument("--item", default="Upper clothes", help="Clothing type picked in the photo flow")
+
+    args = parser.parse_args()
+    if args.flow == "photo" and not args.photo_file_id:
+        parser.error("--photo-file-id is required for the photo flow")
+
+    asyncio.run(send_updates(url=args.url, secret_token=args.secret_token,
+                             chat_count=args.chats, message_count=args.messages,
+                             flow=args.flow, photo_file_id=args.photo_file_id, item=args.item))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import os
+
+from utils.cache import LRUCache
+from utils.constants import TelegramBot as Constants
+
+
+class FileIdCache:
+    """
+    Remembers the Telegram file_id of every product photo already uploaded, so later sends of the
+    same photo, to any chat, reference it instead of uploading the bytes again.
+
+    Photos are keyed by the content hash of their file in the product image store, so the same
+    picture behind different URLs is uploaded once, or by their URL while they have no file.
+    Hits and misses are counted in utils.metrics under "telegram.file_id_cache".
+    """
+    def __init__(self, max_entries: int = Constants.FILE_ID_CACHE_ENTRIES):
+        self._file_ids = LRUCache(name="telegram.file_id_cache", max_entries=max_entries)
+
+    @staticmethod
+    def key_for(product) -> str:
+        # Files in the product image store are named after their content hash
+        return os.path.basename(product.image_path) if product.image_path else product.image_url
+
+    def get(self, product):
+        return self._file_ids.get(self.key_for(product))
+
+    def put(self, product, file_id: str):
+        self._file_ids.put(self.key_for(product), file_id)
+
+    def discard(self, product):
+        self._file_ids.pop(self.key_for(product))
+
+
+# Process-wide cache of uploaded photo ids, valid for this bot token only
+file_id_cache = FileIdCache()
@@ -1,3 +1,5 @@
+import asyncio
+import json
 import logging
 from typing import Any
 
@@ -6,19 +8,33 @@ from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup, InputFile,
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     MessageHandler,
     ContextTypes,
     CallbackQueryHandler,
     filters,
-    ConversationHandler
 )
 
 from telegram_bot import messages, buttons
-from utils.constants import TelegramBot as Constants
+from telegram_bot.admission import PhotoAdmission, PhotoSupersededError
+from telegram_bot.file_id_cache import file_id_cache
+from telegram_bot.conversation import SessionConversation
+from telegram_bot.session_backends import create_session_backend
+from telegram_bot.session_store import SessionStore
+from telegram_bot.update_processor import PerChatUpdateProcessor
+from utils.constants import (TelegramBot as Constants, SpeculativeSearch as SpeculativeConstants,
+                             SearchEngine as SearchConstants)
+from core.product_image_store import get_product_image_store
 from core.search_engine import SearchEngine
+from core.speculative_search import SpeculativeSearches
+from core.segmentation import ClothesSegformer, initialize_inference_worker
+from core.inference_executor import InferenceExecutor, InferenceQueueFullError, InferenceTimeoutError
 from utils.env_manager import get_api_key, TELEGRAM_BOT_API_KEY_ENV
+from utils.http_client import http_client, close_async_http_client
+from utils.metrics import metrics, get_resident_memory_mb
+from utils.rate_limiter import RateLimitExceededError
 
 # Initialize logging for tracking the bot activity
 logging.basicConfig(
@@ -31,15 +47,31 @@ WAITING_PHOTO = 0
 WAITING_ITEM_SELECTION = 1
 SHOWING_PRODUCT = 2
 
-# In-memory storage for user data (per chat)
-user_sessions = {}
+# Optional shared store of serialized sessions, conversation states included, see SNAPPO_SESSION_BACKEND
+session_backend = create_session_backend()
+
+# In-memory storage for user data (per chat), bounded in count, idle time and memory
+user_sessions = SessionStore(backend=session_backend)
+
+# Runs segmentation off the event loop so other chats keep moving during inference
+inference_executor = InferenceExecutor(initializer=initialize_inference_worker)
+
+# Keeps only the latest photo of each chat in flight
+photo_admission = PhotoAdmission()
+
+# Logs all metrics periodically, see start_background_tasks
+metrics_log_task = None
+
+# Removes the crops of expired shared sessions periodically, see start_background_tasks
+crops_prune_task = None
 
 async def extract_clothes_from_user_image(update, chat_id, image) -> Any:
     """
     Processes the user-uploaded image to extract clothing items.
     Stores detected clothing types in the user session.
     """
-    user_sessions[chat_id]["search_engine"].extract_clothes_from_image(image)
+    # Segmentation is shared by all chats, so a burst of new photos from a few of them waits its turn
+    await user_sessions[chat_id]["search_engine"].extract_clothes_from_image_async(image, inference_executor)
     clothe_types = user_sessions[chat_id]["search_engine"].clothe_types
 
     if not clothe_types:
@@ -49,20 +81,55 @@ async def extract_clothes_from_user_image(update, chat_id, image) -> Any:
 
     # Store detected clothing items in user session
     user_sessions[chat_id]["clothe_types"] = clothe_types
+
+    if SpeculativeConstants.ENABLED:
+        # Search for the largest items while the user is still choosing
+        user_sessions[chat_id]["speculative_searches"] = SpeculativeSearches(
+            search_engine=user_sessions[chat_id]["search_engine"],
+            clothe_types=clothe_types
+        )
     return WAITING_ITEM_SELECTION
 
 
+async def download_and_extract_clothes(update, chat_id) -> Any:
+    """
+    Downloads the user's photo and extracts its clothing items.
+    """
+    # Download photo as bytes (in memory)
+    photo_file = await update.message.photo[-1].get_file()
+    image_bytes = await photo_file.download_as_bytearray()
+
+    return await extract_clothes_from_user_image(update=update,
+                                                 chat_id=chat_id,
+                                                 image=image_bytes)
+
+
 async def search_matching_products(chat_id, clothing_type):
     """
     Searches for products matching the detected clothing type.
-    Returns a list of product dictionaries containing:
+    Returns the ProductResults of the search, with the first product ready to show.
+    Each product contains:
     - 'image_url'
     - 'name'
     - 'price'
     - 'link'
     """
-    products = user_sessions[chat_id]["search_engine"].search_product_by_type(clothing_type)
-    return products
+    speculative_searches = user_sessions[chat_id].get("speculative_searches")
+    if speculative_searches is not None:
+        products = await speculative_searches.take(clothing_type)
+        if products is not None:
+            return products
+
+    return await user_sessions[chat_id]["search_engine"].search_product_results_async(clothing_type)
+
+
+def cancel_background_searches(chat_id: int):
+    """
+    Cancels the background searches started for the previous photo of the chat, if any.
+    """
+    session = user_sessions.get(chat_id)
+    if session is not None:
+        session.cancel_background_work()
 
 
 # === HANDLERS ===
@@ -89,7 +156,15 @@ async def set_user_session_per_chat_id(chat_id: int):
     user_sessions.setdefault(chat_id, {})
     user_sessions[chat_id]["search_engine"] = SearchEngine()
     user_sessions[chat_id]["products"] = {}  # Will store matching products
-    clothe_types = user_sessions[chat_id]["search_engine"].clothe_types
+
+    # Drop idle sessions and trim the oldest ones before this photo adds to memory
+    sessions_bytes = user_sessions.enforce_limits()
+
+    # The segmentation model is shared, so memory should stay flat as sessions grow
+    resident_memory_mb = get_resident_memory_mb()
+    metrics.set_gauge("process.resident_memory_mb", resident_memory_mb)
+    logging.info(f"{Constants.SESSION_MEMORY_LOG_MESSAGE} {len(user_sessions)} sessions holding "
+                 f"{sessions_bytes / 2 ** 20:.1f}MB, {resident_memory_mb:.0f}MB resident")
 
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -99,6 +174,13 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     chat_id = update.effective_chat.id
 
+    if photo_admission.is_superseded(update.message):
+        # The chat already sent a newer photo, only that one is processed
+        return WAITING_PHOTO
+
+    # Results for the previous photo are no longer needed
+    cancel_background_searches(chat_id=chat_id)
+
     # Set session's SearchEngine and products dict
     await set_user_session_per_chat_id(chat_id=chat_id)
 
@@ -106,13 +188,11 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(messages.PHOTO_PROCESSING_MESSAGE)
 
     try:
-        # Download photo as bytes (in memory)
-        photo_file = await update.message.photo[-1].get_file()
-        image_bytes = await photo_file.download_as_bytearray()
-
-        await extract_clothes_from_user_image(update=update,
-                                              chat_id=chat_id,
-                                              image=image_bytes)
+        # A newer photo from the chat cancels this one
+        next_state = await photo_admission.run_latest(update.message,
+                                                      download_and_extract_clothes(update=update, chat_id=chat_id))
+        if next_state == WAITING_PHOTO:
+            return WAITING_PHOTO
 
         # Ask user which clothing item to search for
         keyboard = [
@@ -127,6 +207,20 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return WAITING_ITEM_SELECTION
 
+    except PhotoSupersededError as e:
+        logging.info(e)
+        return WAITING_PHOTO
+
+    except (InferenceQueueFullError, RateLimitExceededError) as e:
+        logging.warning(f"{Constants.PHOTO_PROCESSING_ERROR_MESSAGE} {e}")
+        await update.message.reply_text(messages.BUSY_ERROR_MESSAGE)
+        return WAITING_PHOTO
+
+    except InferenceTimeoutError as e:
+        logging.warning(f"{Constants.PHOTO_PROCESSING_ERROR_MESSAGE} {e}")
+        await update.message.reply_text(messages.PROCESSING_TIMEOUT_ERROR_MESSAGE)
+        return WAITING_PHOTO
+
     except Exception as e:
         logging.error(f"{Constants.PHOTO_PROCESSING_ERROR_MESSAGE} {e}")
         await update.message.reply_text(messages.GENERAL_ERROR_MESSAGE)
@@ -147,15 +241,25 @@ async def item_selection_callback(update: Update, context: ContextTypes.DEFAULT_
     # Parse clothing item
     if query.data.startswith("ITEM_"):
         chosen_clothe_type = query.data.replace("ITEM_", "")
+
+        search_engine = user_data.get("search_engine")
+        if search_engine is None or chosen_clothe_type not in search_engine.detected_clothes:
+            # The session, or the crops of its photo, were evicted meanwhile
+            await query.message.reply_text(messages.SESSION_EXPIRED_ERROR_MESSAGE)
+            return WAITING_PHOTO
+
         user_data["chosen_clothe_type"] = chosen_clothe_type
 
         # Let user know we are searching
         await query.message.reply_text(messages.CLOTHE_SELECTION_MESSAGE)
 
-        # Search for products
+        # Search for products, only the first one is built before it is shown
         products = await search_matching_products(chat_id=chat_id,
                                                   clothing_type=chosen_clothe_type)
 
+        previous_products = user_data["products"].get(chosen_clothe_type)
+        if previous_products is not None:
+            previous_products.cancel()
         user_data["products"][chosen_clothe_type] = products
         user_data["current_product_index"] = 0
 
@@ -180,6 +284,49 @@ def build_clothe_message(product):
     )
 
 
+async def get_product_photo(product):
+    """
+    Returns the product photo to send: the file from the shared image store, fetched again if it
+    was evicted since the search, or the image URL for Telegram to download if neither works.
+    """
+    image_file = product.open_image()
+    if image_file is None and product.image_url:
+        product.image_path = await get_product_image_store().fetch_async(product.image_url)
+        image_file = product.open_image()
+
+    if image_file is None:
+        return product.image_url
+
+    with image_file:
+        return InputFile(image_file)
+
+
+async def send_product_photo(bot, chat_id, product, **message_kwargs):
+    """
+    Sends the photo of a product, by its Telegram file_id when it was uploaded before.
+    Only the first send of a photo downloads it from the image store and uploads it.
+    """
+    file_id = file_id_cache.get(product)
+    if file_id is not None:
+        try:
+            with metrics.timer("telegram.send_photo_seconds.cached"):
+                return await bot.send_photo(chat_id=chat_id, photo=file_id, **message_kwargs)
+        except BadRequest as e:
+            logging.warning(f"{Constants.STALE_FILE_ID_LOG_MESSAGE} {e}")
+            file_id_cache.discard(product)
+
+    # The photo is read from the shared image store for this send only
+    photo = await get_product_photo(product)
+    with metrics.timer("telegram.send_photo_seconds.upload"):
+        message = await bot.send_photo(chat_id=chat_id, photo=photo, **message_kwargs)
+
+    if isinstance(photo, InputFile):
+        metrics.increment("telegram.upload_bytes", len(photo.input_file_content))
+    if message.photo:
+        file_id_cache.put(product, message.photo[-1].file_id)
+    return message
+
+
 async def show_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Displays the current product to the user, providing the Next, Search Another, or Confirm buttons.
@@ -195,7 +342,7 @@ async def show_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user_data = user_sessions.get(chat_id, {})
     chosen_clothe_type = user_data.get("chosen_clothe_type")
-    products = user_data.get("products", {}).get(chosen_clothe_type, [])
+    products = user_data.get("products", {}).get(chosen_clothe_type)
     current_index = user_data.get("current_product_index", 0)
 
     if not products:
@@ -207,42 +354,54 @@ async def show_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Keep index in range
     current_index = current_index % len(products)
-    user_data["current_product_index"] = current_index
-
-    product = products[current_index]
-
-    # Build the reply text
-    text_msg = build_clothe_message(product=product)
 
     # Buttons
     reply_markup = InlineKeyboardMarkup(buttons.CLOTHE_MESSAGE_BUTTONS)
 
-    # Edit current message or send a new one
+    # Replace the previous product message when navigating
     if query:
         try:
             await query.message.delete()
         except:
             pass
 
+    # Every product tried, rejected by Telegram or not, counts towards the products one tap may build
+    attempts_left = SearchConstants.MAX_PRODUCTS_PER_REQUEST
+    while attempts_left > 0:
+        # Built on first view, while the one after it is prepared in the background
+        first_candidate = current_index
+        current_index, product = await products.find_usable(current_index, max_attempts=attempts_left)
+        if product is None:
+            break
+        attempts_left -= (current_index - first_candidate) % len(products) + 1
+
+        # Build the reply text
+        text_msg = build_clothe_message(product=product)
+
         # Send a new message with product photo
-        await context.bot.send_photo(
-            chat_id=chat_id,
-            photo=InputFile(product.image_data),
-            caption=text_msg,
-            parse_mode="Markdown",
-            reply_markup=reply_markup
-        )
-        return SHOWING_PRODUCT
-    else:
-        # If not a callback, just send a new message
-        await update.message.reply_photo(
-            photo=InputFile(product.image_data),
-            caption=text_msg,
-            parse_mode="Markdown",
-            reply_markup=reply_markup
-        )
+        try:
+            await send_product_photo(
+                bot=context.bot,
+                chat_id=chat_id,
+                product=product,
+                caption=text_msg,
+                parse_mode="Markdown",
+                reply_markup=reply_markup
+            )
+        except BadRequest as e:
+            # Telegram could not use the photo or the caption, move on to the next product
+            logging.warning(f"{Constants.PRODUCT_REJECTED_LOG_MESSAGE} {e}")
+            products.mark_unusable(current_index)
+            current_index = (current_index + 1) % len(products)
+            continue
+
+        user_data["current_product_index"] = current_index
         return SHOWING_PRODUCT
 
+    if query:
+        await query.message.reply_text(messages.NO_MORE_PRODUCTS_MESSAGE)
+    return WAITING_PHOTO
+
 
 async def product_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -252,7 +411,12 @@ async def product_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     chat_id = query.message.chat_id
-    user_data = user_sessions.get(chat_id, {})
+    user_data = user_sessions.get(chat_id)
+
+    if user_data is None:
+        # The session was evicted meanwhile
+        await query.message.reply_text(messages.SESSION_EXPIRED_ERROR_MESSAGE)
+        return WAITING_PHOTO
 
     if query.data == "NEXT_PRODUCT":
         # Show next product
@@ -301,6 +465,41 @@ async def product_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SHOWING_PRODUCT
 
 
+async def log_metrics_periodically(interval_seconds: float):
+    """
+    Logs a snapshot of all metrics every interval_seconds, for as long as the bot runs.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        # Publishes the connection reuse rates as gauges, so they are part of the snapshot
+        http_client.connection_stats()
+        logging.info(f"{Constants.METRICS_LOG_MESSAGE} {json.dumps(metrics.snapshot(), sort_keys=True)}")
+
+
+async def start_background_tasks(application: Application):
+    """
+    Starts the periodic metrics log once the bot is initialized, unless it is disabled,
+    and the periodic pruning of session crops when sessions are shared.
+    """
+    global metrics_log_task, crops_prune_task
+
+    if Constants.METRICS_LOG_INTERVAL_SECONDS > 0:
+        metrics_log_task = asyncio.create_task(log_metrics_periodically(Constants.METRICS_LOG_INTERVAL_SECONDS))
+    if user_sessions.backend is not None:
+        crops_prune_task = asyncio.create_task(user_sessions.prune_crops_periodically())
+
+
+async def shutdown_async_resources(application: Application):
+    """
+    Stops the periodic tasks and closes the connection pool of the async search pipeline when the bot stops.
+    """
+    if metrics_log_task is not None:
+        metrics_log_task.cancel()
+    if crops_prune_task is not None:
+        crops_prune_task.cancel()
+    await close_async_http_client()
+
+
 def setup_and_run_bot():
     """
     Initializes and starts the Telegram bot application.
@@ -313,11 +512,27 @@ def setup_and_run_bot():
         print("Error: Telegram Bot API key is not set.")
         return
 
-    application = Application.builder().token(bot_api_key).build()
-    application.bot_data["search_engine"] = SearchEngine()
+    if Constants.INGRESS_MODE == "webhook" and not Constants.WEBHOOK_URL:
+        # The listen address, e.g. 0.0.0.0, is not where Telegram can reach the bot
+        print(Constants.WEBHOOK_URL_MISSING_ERROR_MESSAGE)
+        return
+
+    application = (
+        Application.builder()
+        .token(bot_api_key)
+        .post_init(start_background_tasks)
+        .post_shutdown(shutdown_async_resources)
+        # Different chats are handled concurrently, each chat's updates in order
+        .concurrent_updates(PerChatUpdateProcessor(on_arrival=photo_admission.note_arrival,
+                                                   on_done=photo_admission.note_done))
+        .build()
+    )
+
+    # Load the shared segmentation model once, before the first photo arrives
+    ClothesSegformer.load_model()
 
-    # Conversation handler
-    conv_handler = ConversationHandler(
+    # Conversation handler, its state is kept in the chat's session so any worker can continue it
+    conv_handler = SessionConversation(
         entry_points=[
             MessageHandler(filters.PHOTO & ~filters.COMMAND, handle_photo),
             MessageHandler(filters.ALL & ~filters.COMMAND, welcome_message),
@@ -334,16 +549,26 @@ def setup_and_run_bot():
                 CallbackQueryHandler(product_callback, pattern="^(NEXT_PRODUCT|SEARCH_ANOTHER|DONE|UPLOAD_NEW)$"),
             ],
         },
-        fallbacks=[],
-        per_chat=True,
-        per_user=True,
+        sessions=user_sessions,
     )
 
     application.add_handler(conv_handler)
 
-    # Start the bot (polling)
+    # Start the bot
     print("Bot is running! Press Ctrl+C to stop.")
-    application.run_polling()
+    try:
+        if Constants.INGRESS_MODE == "webhook":
+            application.run_webhook(
+                listen=Constants.WEBHOOK_LISTEN,
+                port=Constants.WEBHOOK_PORT,
+                url_path=Constants.WEBHOOK_PATH,
+                webhook_url=Constants.WEBHOOK_URL,
+                secret_token=Constants.WEBHOOK_SECRET_TOKEN or None,
+            )
+        else:
+            application.run_polling()
+    finally:
+        inference_executor.shutdown()
 
 
 
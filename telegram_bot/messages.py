@@ -5,12 +5,16 @@ DETECTED_CLOTHES_MESSAGE = "👗 I detected these clothing items in the photo. \
 CLOTHE_SELECTION_MESSAGE = "🎉 What a great choice! 🛍️\n\nGive me a few seconds to find a similar product for you to purchase! 🔍"
 SEARCH_ANOTHER_CLOTHE_MESSAGE = "Which clothing item do you want to search for?"
 NO_PRODUCTS_FOUND_MESSAGE =  "😞 Sorry, I couldn't find any products for that item.\nPlease send a new photo and I'll try again! 📸"
+NO_MORE_PRODUCTS_MESSAGE = "😞 Sorry, I couldn't find any more products for that item.\nPlease send a new photo and I'll try again! 📸"
 FOUND_ITEM_RESPONSE_MESSAGE = "🎉 Awesome! I'm glad I could help! 😊\n\nFeel free to send me another picture anytime to search for more items 📸🛍️"
 NEW_UPLOAD_RESPONSE_MESSAGE = "No worries! 😊\nSend me a new photo whenever you're ready 📸"
 
 ### Error Messages ###
 GENERAL_ERROR_MESSAGE = "Something went wrong. 😞\nPlease try again with another photo. 📸"
 INVALID_SELECTION_ERROR_MESSAGE = "❌ Invalid selection, please try again ❌"
+BUSY_ERROR_MESSAGE = "I'm a bit busy right now 🙈\nPlease try again with your photo in a minute 📸"
+PROCESSING_TIMEOUT_ERROR_MESSAGE = "Processing your photo took too long ⏳\nPlease try again in a moment 📸"
+SESSION_EXPIRED_ERROR_MESSAGE = "I no longer have your last photo ⌛\nPlease send it again 📸"
 NO_ITEMS_FOUND_ERROR_MESSAGE = "Something went wrong 😞\nI couldn't detect clothing in that photo.\nPlease try again with another photo 📸"
 
 ### Buttons Text ###
@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import threading
+import time
+
+from utils.constants import SessionBackends as Constants
+
+
+class SessionBackend:
+    """
+    Base class for the shared stores of serialized chat sessions.
+    Values are strings (JSON), stored under string keys with an optional time to live.
+    """
+    name = None
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl_seconds: float = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class MemoryBackend(SessionBackend):
+    """
+    Keeps the state in this process only. Useful for tests, or a single worker that does not need to survive restarts.
+    """
+    name = "memory"
+
+    def __init__(self):
+        self._values = {}  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def _is_live(self, entry) -> bool:
+        return entry is not None and (entry[1] is None or entry[1] > time.time())
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+        return entry[0] if self._is_live(entry) else None
+
+    def set(self, key, value, ttl_seconds=None):
+        expires_at = time.time() + ttl_seconds if ttl_seconds else None
+        with self._lock:
+            self._values[key] = (value, expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class SqliteBackend(SessionBackend):
+    """
+    Keeps the state in a SQLite database, shared by the bot workers of one machine and kept across restarts.
+    """
+    name = "sqlite"
+
+    def __init__(self, database_path: str = Constants.SQLITE_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Several worker processes may write at once, so wait for their locks instead of failing
+        self._connection = sqlite3.connect(database_path, timeout=10, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self._connection.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def set(self, key, value, ttl_seconds=None):
+        expires_at = time.time() + ttl_seconds if ttl_seconds else None
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                                     (key, value, expires_at))
+            self._connection.execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),))
+            self._connection.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._connection.execute("DELETE FROM state WHERE key = ?", (key,))
+            self._connection.commit()
+
+
+class RedisBackend(SessionBackend):
+    """
+    Keeps the state in Redis, or any server speaking its protocol, shared by workers on any machine.
+    Requires the optional redis package. Any client with the redis-py interface can be passed in
+    instead, e.g. a fakeredis instance as a local stand-in.
+    """
+    name = "redis"
+
+    def __init__(self, url: str = Constants.REDIS_URL, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError(Constants.REDIS_MISSING_ERROR_MESSAGE)
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+
+    @staticmethod
+    def _decode(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    def get(self, key):
+        return self._decode(self.client.get(key))
+
+    def set(self, key, value, ttl_seconds=None):
+        self.client.set(key, value, px=int(ttl_seconds * 1000) if ttl_seconds else None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+SESSION_BACKENDS = {backend.name: backend for backend in (MemoryBackend, SqliteBackend, RedisBackend)}
+
+
+def create_session_backend(backend_name: str = Constants.BACKEND):
+    """
+    Creates the session backend with the given name.
+
+    Args:
+        backend_name (str): One of SESSION_BACKENDS, or "none" to keep sessions in process memory only.
+
+    Returns:
+        SessionBackend: The backend, or None for "none".
+    """
+    if backend_name == "none":
+        return None
+
+    if backend_name not in SESSION_BACKENDS:
+        raise ValueError(f"Unknown session backend: {backend_name}. "
+                         f"Choose one of none, {', '.join(SESSION_BACKENDS)}")
+    return SESSION_BACKENDS[backend_name]()
@@ -0,0 +1,346 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image
+
+from core.product_results import ProductResults
+from core.search_engine import SearchEngine
+from core.segmentation_cache import segmentation_cache
+from telegram_bot.session_backends import SessionBackend
+from utils.constants import TelegramBot as Constants, SessionBackends as BackendConstants
+from utils.image_hashing import content_hash
+from utils.metrics import metrics
+
+# Rough footprint of a session's plain fields and of one product without its image
+SESSION_BASE_BYTES = 2 * 1024
+PRODUCT_BYTES = 1024
+
+# Session fields that are serialized as they are
+PLAIN_FIELDS = ("welcomed", "clothe_types", "chosen_clothe_type", "current_product_index", "conversation_state")
+
+
+def save_crop(image: Image.Image, crops_dir: str = BackendConstants.CROPS_DIR) -> str:
+    """
+    Writes an item crop to the shared crops directory, named after its content, and returns its path.
+    """
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    content = buffer.getvalue()
+
+    path = os.path.join(crops_dir, f"{content_hash(content)}.png")
+    if not os.path.exists(path):
+        os.makedirs(crops_dir, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(content)
+        os.replace(temporary_path, path)
+    else:
+        # Refreshed, so that pruning keeps crops that are still referenced
+        os.utime(path)
+    return path
+
+
+def load_crop(path: str):
+    """
+    Reads an item crop written by save_crop, or returns None if it is gone.
+    """
+    try:
+        with Image.open(path) as image:
+            return image.convert("RGB")
+    except (FileNotFoundError, OSError):
+        return None
+
+
+def prune_crops(max_age_seconds: float, crops_dir: str = BackendConstants.CROPS_DIR):
+    """
+    Removes crops that no session saved for longer than max_age_seconds.
+    """
+    if not os.path.isdir(crops_dir):
+        return
+
+    oldest_kept = time.time() - max_age_seconds
+    for entry in os.scandir(crops_dir):
+        try:
+            if entry.stat().st_mtime < oldest_kept:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+class Session(dict):
+    """
+    The state of one chat. A plain dict of the handlers' fields, plus the time it was last used.
+
+    Its payloads can be dropped under memory pressure, heaviest first: the item crops of the last
+    photo, then the product results. The chat then has to send its photo again.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_access = time.monotonic()
+        # Bumped on every save to a shared backend, to tell stale copies from fresh ones
+        self.revision = 0
+        self._crops_source = None
+        self._crop_refs = {}
+
+    def snapshot(self) -> dict:
+        """
+        Serializes the session into plain JSON types. Crops are written to the shared crops
+        directory and referenced by path, products as their raw results and the ones built so far.
+
+        Returns:
+            dict: The compact session state.
+        """
+        state = {field: self[field] for field in PLAIN_FIELDS if field in self}
+        state["revision"] = self.revision
+
+        search_engine = self.get("search_engine")
+        if search_engine is not None:
+            if self._crops_source is not search_engine.detected_clothes:
+                # Saved once per photo, not on every update
+                self._crop_refs = {clothe_type: save_crop(image)
+                                   for clothe_type, image in search_engine.detected_clothes.items()}
+                self._crops_source = search_engine.detected_clothes
+            state["crops"] = self._crop_refs
+
+        state["products"] = {
+            clothe_type: results.to_dict()
+            for clothe_type, results in self.get("products", {}).items()
+        }
+        return state
+
+    @classmethod
+    def from_snapshot(cls, state: dict):
+        """
+        Rebuilds a session from the output of snapshot. Crops that are gone are left out.
+        """
+        session = cls({field: state[field] for field in PLAIN_FIELDS if field in state})
+        session.revision = state.get("revision", 0)
+
+        if "crops" in state:
+            crops = {clothe_type: load_crop(path) for clothe_type, path in state["crops"].items()}
+            search_engine = SearchEngine()
+            search_engine.set_detected_clothes({clothe_type: crop for clothe_type, crop in crops.items() if crop})
+            session["search_engine"] = search_engine
+            session._crops_source = search_engine.detected_clothes
+            session._crop_refs = {clothe_type: path for clothe_type, path in state["crops"].items() if crops[clothe_type]}
+
+        session["products"] = {
+            clothe_type: ProductResults.from_dict(results)
+            for clothe_type, results in state.get("products", {}).items()
+        }
+        return session
+
+    def has_payloads(self) -> bool:
+        search_engine = self.get("search_engine")
+        return bool(search_engine is not None and search_engine.detected_clothes) or bool(self.get("products"))
+
+    def estimate_size(self, shared_crop_ids=frozenset()) -> int:
+        """
+        Returns the approximate number of bytes held by the session alone.
+
+        Args:
+            shared_crop_ids (set, optional): Ids of crops that are also held elsewhere, e.g. by the
+                segmentation cache. They are not counted, since dropping them would free nothing.
+        """
+        size = SESSION_BASE_BYTES
+
+        search_engine = self.get("search_engine")
+        if search_engine is not None:
+            size += sum(image.width * image.height * len(image.getbands())
+                        for image in search_engine.detected_clothes.values() if id(image) not in shared_crop_ids)
+
+        size += PRODUCT_BYTES * sum(len(products) for products in self.get("products", {}).values())
+        return size
+
+    def drop_payloads(self):
+        """
+        Frees the crops of the last photo, and the product results if there were no crops left to free.
+        """
+        search_engine = self.get("search_engine")
+        if search_engine is not None and search_engine.detected_clothes:
+            search_engine.detected_clothes = {}
+            self.cancel_background_work()
+            return
+
+        self["products"] = {}
+
+    def cancel_background_work(self):
+        speculative_searches = self.pop("speculative_searches", None)
+        if speculative_searches is not None:
+            speculative_searches.cancel()
+
+        for results in self.get("products", {}).values():
+            results.cancel()
+
+
+class SessionStore:
+    """
+    A bounded store of chat sessions, used like a dict keyed by chat id.
+
+    Sessions idle for longer than `idle_ttl_seconds` are removed. Beyond `max_megabytes` the
+    payloads of the least recently used sessions are dropped first, images before product results,
+    and only then whole sessions. Crops shared with the segmentation cache count towards its budget
+    rather than this one. Beyond `max_sessions` the least recently used sessions are removed.
+    Limits are enforced by `enforce_limits()`, which the bot calls whenever a new photo arrives.
+
+    With a shared backend, the store is a cache in front of it: `refresh()` loads the latest state
+    of a chat before an update is handled and `save()` writes it back afterwards, so several bot
+    workers can serve the same chats and a restart loses no one mid-flow. Evicted sessions are
+    then simply reloaded from the backend, and `prune_crops_periodically()` removes the crops of
+    sessions that expired from it.
+
+    Session sizes are published in utils.metrics as "sessions.bytes", with the evictions counted
+    under "sessions.expired", "sessions.payloads_dropped" and "sessions.evicted".
+    """
+    def __init__(self,
+                 idle_ttl_seconds: float = Constants.SESSION_IDLE_TTL_SECONDS,
+                 max_sessions: int = Constants.MAX_SESSIONS,
+                 max_megabytes: int = Constants.SESSIONS_MAX_MEGABYTES,
+                 backend: SessionBackend = None):
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_megabytes * 2 ** 20
+        self.backend = backend
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def backend_key(chat_id) -> str:
+        return f"session:{chat_id}"
+
+    async def refresh(self, chat_id):
+        """
+        Replaces the local copy of a chat's session if the backend holds a newer one.
+        """
+        if self.backend is None:
+            return
+
+        raw_state = await asyncio.to_thread(self.backend.get, self.backend_key(chat_id))
+        if raw_state is None:
+            return
+
+        state = json.loads(raw_state)
+        local = self._sessions.get(chat_id)
+        if local is None or local.revision < state.get("revision", 0):
+            session = await asyncio.to_thread(Session.from_snapshot, state)
+            if local is not None:
+                # Another worker moved the chat on, the local searches are for a stale state
+                local.cancel_background_work()
+            self[chat_id] = session
+            metrics.increment("sessions.loaded")
+
+    async def save(self, chat_id):
+        """
+        Writes a chat's session to the backend, if there is one.
+        """
+        session = self._sessions.get(chat_id)
+        if self.backend is None or session is None:
+            return
+
+        session.revision += 1
+        state = await asyncio.to_thread(session.snapshot)
+        await asyncio.to_thread(self.backend.set, self.backend_key(chat_id), json.dumps(state),
+                                self.idle_ttl_seconds)
+
+    def _touch(self, chat_id) -> Session:
+        session = self._sessions[chat_id]
+        session.last_access = time.monotonic()
+        self._sessions.move_to_end(chat_id)
+        return session
+
+    def __getitem__(self, chat_id) -> Session:
+        with self._lock:
+            return self._touch(chat_id)
+
+    def __setitem__(self, chat_id, session: dict):
+        with self._lock:
+            self._sessions[chat_id] = session if isinstance(session, Session) else Session(session)
+            self._sessions.move_to_end(chat_id)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, chat_id, default=None):
+        with self._lock:
+            return self._touch(chat_id) if chat_id in self._sessions else default
+
+    def setdefault(self, chat_id, default: dict = None) -> Session:
+        with self._lock:
+            if chat_id not in self._sessions:
+                self._sessions[chat_id] = Session(default or {})
+            return self._touch(chat_id)
+
+    def pop(self, chat_id, default=None):
+        with self._lock:
+            return self._sessions.pop(chat_id, default)
+
+    def session_sizes(self) -> dict:
+        """
+        Returns the approximate size in bytes of every session, by chat id.
+        """
+        with self._lock:
+            sessions = list(self._sessions.items())
+        shared_crop_ids = segmentation_cache.cached_crop_ids()
+        return {chat_id: session.estimate_size(shared_crop_ids) for chat_id, session in sessions}
+
+    def enforce_limits(self):
+        """
+        Applies the idle TTL, the memory budget and the session count limit, in that order.
+
+        Returns:
+            int: The approximate number of bytes held by the remaining sessions.
+        """
+        now = time.monotonic()
+        with self._lock:
+            # Least recently used first, so idle sessions are all at the front
+            while self._sessions:
+                chat_id, session = next(iter(self._sessions.items()))
+                if now - session.last_access <= self.idle_ttl_seconds:
+                    break
+                self._sessions.pop(chat_id).cancel_background_work()
+                metrics.increment("sessions.expired")
+
+            # Crops shared with the segmentation cache are bounded by its own budget
+            shared_crop_ids = segmentation_cache.cached_crop_ids()
+            sizes = {chat_id: session.estimate_size(shared_crop_ids) for chat_id, session in self._sessions.items()}
+            total_bytes = sum(sizes.values())
+
+            for chat_id, session in list(self._sessions.items())[:-1]:
+                if total_bytes <= self.max_bytes:
+                    break
+                # The most recent session is spared, it is the one being served right now
+                while session.has_payloads() and total_bytes > self.max_bytes:
+                    session.drop_payloads()
+                    metrics.increment("sessions.payloads_dropped")
+                    size = session.estimate_size(shared_crop_ids)
+                    total_bytes -= sizes[chat_id] - size
+                    sizes[chat_id] = size
+
+            while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or total_bytes > self.max_bytes):
+                chat_id, session = self._sessions.popitem(last=False)
+                session.cancel_background_work()
+                total_bytes -= sizes.pop(chat_id)
+                metrics.increment("sessions.evicted")
+
+            metrics.set_gauge("sessions.active", len(self._sessions))
+            metrics.set_gauge("sessions.bytes", total_bytes)
+
+        return total_bytes
+
+    async def prune_crops_periodically(self, interval_seconds: float = BackendConstants.CROPS_PRUNE_INTERVAL_SECONDS):
+        """
+        Removes the crops of expired shared sessions every interval_seconds, for as long as the bot runs.
+        The crops directory is scanned in a thread, off the event loop.
+        """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            # Crops outlive the sessions referencing them, which expire from the backend after the idle TTL
+            await asyncio.to_thread(prune_crops, max_age_seconds=2 * self.idle_ttl_seconds)
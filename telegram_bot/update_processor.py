@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from telegram.ext import BaseUpdateProcessor
+
+from utils.constants import TelegramBot as Constants
+from utils.metrics import metrics
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different chats concurrently, and the updates of each chat one at a time,
+    in the order they arrived. This keeps the ConversationHandler state machine of a chat correct
+    while one slow chat no longer delays everyone else.
+
+    At most `max_concurrent_updates` updates are handled at once. Updates waiting for their chat's
+    turn do not take one of those slots, but at most `max_pending_updates` are accepted in total.
+
+    The optional `on_arrival` callback sees every update as soon as it arrives, before it waits
+    for its chat's turn, e.g. to cancel work that the update makes obsolete. The optional `on_done`
+    callback sees it once it was handled, whether it succeeded, failed or was cancelled.
+
+    The number of updates being handled is published in utils.metrics as "updates.in_flight",
+    and their handling time as "updates.processing_seconds".
+    """
+    def __init__(self,
+                 max_concurrent_updates: int = Constants.MAX_CONCURRENT_UPDATES,
+                 max_pending_updates: int = Constants.MAX_PENDING_UPDATES,
+                 on_arrival=None,
+                 on_done=None):
+        super().__init__(max_concurrent_updates=max(max_pending_updates, max_concurrent_updates))
+        self.on_arrival = on_arrival
+        self.on_done = on_done
+        self.max_running_updates = max_concurrent_updates
+        self._running_slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chat_locks = {}  # chat id -> [lock, number of updates holding or waiting for it]
+        self._running = 0
+
+    @staticmethod
+    def get_chat_id(update):
+        chat = getattr(update, "effective_chat", None)
+        return chat.id if chat is not None else None
+
+    async def do_process_update(self, update, coroutine):
+        if self.on_arrival is not None:
+            self.on_arrival(update)
+
+        try:
+            await self._process_in_order(update, coroutine)
+        finally:
+            if self.on_done is not None:
+                self.on_done(update)
+
+    async def _process_in_order(self, update, coroutine):
+        chat_id = self.get_chat_id(update)
+        if chat_id is None:
+            # Not tied to a conversation, nothing to keep in order
+            async with self._running_slots:
+                await self._run(coroutine)
+            return
+
+        chat_lock = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        chat_lock[1] += 1
+        try:
+            # Locks are granted first come, first served, so a chat's updates run in arrival order
+            async with chat_lock[0]:
+                async with self._running_slots:
+                    await self._run(coroutine)
+        finally:
+            chat_lock[1] -= 1
+            if chat_lock[1] == 0:
+                del self._chat_locks[chat_id]
+
+    async def _run(self, coroutine):
+        self._running += 1
+        metrics.set_gauge("updates.in_flight", self._running)
+        start = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            self._running -= 1
+            metrics.set_gauge("updates.in_flight", self._running)
+            metrics.observe("updates.processing_seconds", time.perf_counter() - start)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
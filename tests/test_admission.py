@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram_bot.admission import PhotoAdmission, PhotoSupersededError
+from telegram_bot.update_processor import PerChatUpdateProcessor
+
+
+class FakeMessage:
+    def __init__(self, chat_id: int, message_id: int, photo: bool = True):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.photo = [object()] if photo else []
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class FakeUpdate:
+    def __init__(self, chat_id: int, message_id: int, photo: bool = True):
+        self.effective_chat = FakeChat(chat_id)
+        self.message = FakeMessage(chat_id, message_id, photo)
+
+
+def test_only_the_latest_photo_runs_and_nothing_is_kept_afterwards():
+    admission = PhotoAdmission()
+    processed = []
+
+    async def handle(update):
+        if not update.message.photo:
+            return
+        # Like handle_photo: superseded photos return early, the others run through run_latest
+        if admission.is_superseded(update.message):
+            return
+        try:
+            await admission.run_latest(update.message, asyncio.sleep(0.01))
+        except PhotoSupersededError:
+            return
+        processed.append((update.message.chat_id, update.message.message_id))
+
+    async def send_updates():
+        processor = PerChatUpdateProcessor(max_concurrent_updates=4, max_pending_updates=16,
+                                           on_arrival=admission.note_arrival, on_done=admission.note_done)
+        updates = [FakeUpdate(1, 1), FakeUpdate(1, 2), FakeUpdate(1, 3), FakeUpdate(2, 1), FakeUpdate(2, 2, photo=False)]
+        await asyncio.gather(*(processor.process_update(update, handle(update)) for update in updates))
+
+    asyncio.run(send_updates())
+
+    # Photo 1 of chat 1 was cancelled by the newer ones and photo 2 was discarded
+    assert sorted(processed) == [(1, 3), (2, 1)]
+    # The handled photos are forgotten, so an earlier message id does not count as superseded anymore
+    assert not admission.is_superseded(FakeMessage(1, 1))
+    assert not admission.is_superseded(FakeMessage(2, 0))
+
+
+def test_photos_handled_outside_run_latest_are_forgotten():
+    admission = PhotoAdmission()
+    update = FakeUpdate(1, 7)
+
+    # e.g. a photo sent while the chat is choosing an item, which handle_photo never sees
+    admission.note_arrival(update)
+    admission.note_done(update)
+
+    assert not admission.is_superseded(FakeMessage(1, 6))
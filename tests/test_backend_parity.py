@@ -0,0 +1,80 @@
+import glob
+import os
+
+import pytest
+
+pytest.importorskip("PIL")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from PIL import Image
+from transformers import SegformerImageProcessor
+
+from core.benchmarks import mask_agreement
+from core.inference_backends import TORCH_BACKENDS, OnnxBackend, EagerBackend, load_torch_model
+from core.segmentation import ClothesSegformer
+from utils.constants import ClothesSegformer as SegformerConstants
+
+DEMO_PHOTOS_PATTERN = os.path.join(os.path.dirname(os.path.dirname(__file__)), "media", "demo_photo_*")
+
+# Minimal pixel agreement with eager PyTorch. The int8 linear layers move a few boundary pixels.
+MIN_AGREEMENT = {
+    "torchscript": 0.99,
+    "quantized": 0.95,
+    "onnx": 0.99,
+}
+
+
+@pytest.fixture(scope="module")
+def checkpoint():
+    try:
+        processor = SegformerImageProcessor.from_pretrained(SegformerConstants.B2_CLOTHES_MODEL_NAME,
+                                                            local_files_only=True)
+        model = load_torch_model(SegformerConstants.B2_CLOTHES_MODEL_NAME, local_files_only=True)
+    except OSError:
+        pytest.skip(f"'{SegformerConstants.B2_CLOTHES_MODEL_NAME}' is not in the local Hugging Face cache")
+    return processor, model
+
+
+@pytest.fixture(scope="module")
+def images():
+    images = []
+    for path in sorted(glob.glob(DEMO_PHOTOS_PATTERN)):
+        with Image.open(path) as image:
+            images.append(image.convert("RGB"))
+    assert images, f"No demo photos match {DEMO_PHOTOS_PATTERN}"
+    return images
+
+
+@pytest.fixture(scope="module")
+def eager_label_maps(checkpoint, images):
+    processor, model = checkpoint
+    return label_maps(processor, EagerBackend(model), images)
+
+
+def label_maps(processor, backend, images: list) -> list:
+    return [
+        ClothesSegformer.to_label_array(ClothesSegformer.logits_to_segmentation_map(
+            ClothesSegformer.compute_logits(processor, backend, [image]), image.size))
+        for image in images
+    ]
+
+
+def build_backend(backend_name: str, model):
+    if backend_name != OnnxBackend.name:
+        return TORCH_BACKENDS[backend_name](model)
+
+    pytest.importorskip("onnxruntime")
+    if not os.path.exists(SegformerConstants.ONNX_MODEL_PATH):
+        pytest.skip(f"No exported ONNX graph at {SegformerConstants.ONNX_MODEL_PATH}")
+    return OnnxBackend(SegformerConstants.ONNX_MODEL_PATH)
+
+
+@pytest.mark.parametrize("backend_name", sorted(MIN_AGREEMENT))
+def test_backend_label_maps_match_eager(backend_name, checkpoint, images, eager_label_maps):
+    processor, model = checkpoint
+    backend = build_backend(backend_name, model)
+
+    for reference, label_map in zip(eager_label_maps, label_maps(processor, backend, images)):
+        agreement, _ = mask_agreement(reference, label_map, ClothesSegformer.label_to_name)
+        assert agreement >= MIN_AGREEMENT[backend_name]
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("PIL")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from telegram import Update
+from telegram.ext import CallbackQueryHandler, MessageHandler, filters
+
+from telegram_bot.conversation import SessionConversation
+from telegram_bot.fake_sender import build_callback_update, build_photo_update, build_text_update
+from telegram_bot.session_backends import MemoryBackend
+from telegram_bot.session_store import SessionStore
+
+WAITING_PHOTO, WAITING_ITEM_SELECTION = 0, 1
+
+
+class FakeContext:
+    application = None
+
+
+def build_worker(backend, handled: list) -> SessionConversation:
+    """
+    A bot worker with its own session store on the shared backend, recording which handler ran.
+    """
+    def record(name, next_state):
+        async def callback(update, context):
+            handled.append(name)
+            return next_state
+        return callback
+
+    return SessionConversation(
+        entry_points=[MessageHandler(filters.PHOTO, record("photo", WAITING_ITEM_SELECTION))],
+        states={
+            WAITING_PHOTO: [MessageHandler(filters.PHOTO, record("photo", WAITING_ITEM_SELECTION))],
+            WAITING_ITEM_SELECTION: [CallbackQueryHandler(record("item", WAITING_PHOTO), pattern=r"^ITEM_.*$")],
+        },
+        sessions=SessionStore(backend=backend),
+    )
+
+
+def test_workers_continue_the_conversation_state_of_each_other():
+    backend = MemoryBackend()
+    handled = []
+    first_worker, second_worker = build_worker(backend, handled), build_worker(backend, handled)
+
+    async def send(worker, update):
+        update = Update.de_json(update, None)
+        assert worker.check_update(update)
+        await worker.handle_conversation_update(update, FakeContext())
+
+    async def run():
+        await send(first_worker, build_photo_update(7, "photo-file-id"))
+        # Only a worker that sees the first worker's state accepts the item selection
+        await send(second_worker, build_callback_update(7, "ITEM_Hat"))
+        # Back to waiting for a photo, so text is not accepted by either worker
+        await send(first_worker, build_text_update(7, "hello"))
+        await send(first_worker, build_callback_update(7, "ITEM_Hat"))
+
+    asyncio.run(run())
+
+    assert handled == ["photo", "item"]
+    assert first_worker.sessions[7]["conversation_state"] == WAITING_PHOTO
@@ -0,0 +1,45 @@
+import io
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from PIL import Image, ImageDraw
+
+from api.lykdat_cache import LykdatCache
+from utils.image_hashing import hamming_distance
+
+
+def build_crop(color: tuple) -> Image.Image:
+    """
+    An item of the given color on the plain white background segmentation crops are pasted on.
+    """
+    crop = Image.new("RGB", (120, 160), "white")
+    ImageDraw.Draw(crop).rectangle((20, 20, 100, 140), fill=color)
+    return crop
+
+
+def reencode(image: Image.Image) -> Image.Image:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=80)
+    return Image.open(io.BytesIO(buffer.getvalue())).convert("RGB")
+
+
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_only_the_same_crop_is_served_a_cached_response(tmp_path, on_disk):
+    cache = LykdatCache(database_path=str(tmp_path / "lykdat.db"))
+    shirt, jacket = build_crop((40, 40, 40)), build_crop((200, 30, 30))
+
+    # Items of the same cut share their outline, so their fingerprints alone would pass as the same crop
+    assert hamming_distance(cache.signature(shirt).perceptual_hash,
+                            cache.signature(jacket).perceptual_hash) <= cache.max_distance
+
+    signature, response = cache.get(shirt)
+    assert response is None
+    cache.put(signature, {"result": "shirt"})
+    if on_disk:
+        cache = LykdatCache(database_path=str(tmp_path / "lykdat.db"))
+
+    assert cache.get(jacket)[1] is None
+    assert cache.get(reencode(shirt))[1] == {"result": "shirt"}
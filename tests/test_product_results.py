@@ -0,0 +1,43 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+pytest.importorskip("PIL")
+
+from core import product_results
+from core.product_results import ProductResults
+
+MOCK_RESPONSE_PATH = os.path.join(os.path.dirname(__file__), "mock_data", "lykdat_global_search_response_mock.json")
+
+
+class MissingImageStore:
+    async def fetch_async(self, url: str):
+        return None
+
+
+def test_a_request_builds_only_a_few_unusable_products(monkeypatch):
+    fallback_queries = []
+
+    async def search_serp_async(query: str, limit: int):
+        fallback_queries.append(query)
+        return []
+
+    monkeypatch.setattr(product_results, "get_product_image_store", MissingImageStore)
+    monkeypatch.setattr(product_results, "search_serp_async", search_serp_async)
+
+    with open(MOCK_RESPONSE_PATH) as f:
+        raw_results = json.load(f)["data"]["result_groups"][0]["similar_products"]
+    results = ProductResults(raw_results=raw_results)
+
+    async def find_usable():
+        found = await results.find_usable(0, max_attempts=3)
+        # Let the product prepared ahead finish
+        await asyncio.sleep(0.01)
+        return found
+
+    assert len(results) > 4
+    assert asyncio.run(find_usable()) == (None, None)
+    # The three products tried, and the one prepared ahead of them
+    assert len(fallback_queries) == 4
@@ -0,0 +1,53 @@
+import asyncio
+import io
+
+import pytest
+
+from utils.rate_limiter import RateLimitExceededError, TokenBucket
+
+
+def test_cancelled_waiter_gives_its_token_back():
+    bucket = TokenBucket("test", rate_per_second=10.0, burst=1, max_wait_seconds=60.0)
+
+    async def cancel_waiter():
+        await bucket.acquire()
+        waiter = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+        # Only the first call used a token, so the next caller waits for one refill, not two
+        await bucket.acquire(max_wait_seconds=0.15)
+
+    asyncio.run(cancel_waiter())
+
+
+def test_segmentation_cache_hits_do_not_use_a_token(monkeypatch):
+    np = pytest.importorskip("numpy")
+    Image = pytest.importorskip("PIL.Image")
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from core import segmentation
+    from core.segmentation_cache import segmentation_cache
+
+    segmentations = []
+
+    def segment_ingested_image(self, ingested):
+        segmentations.append(ingested)
+        return np.zeros((1, 1), dtype=np.uint8), {}
+
+    # No model is needed, only the cache and the limiter are exercised
+    monkeypatch.setattr(segmentation.ClothesSegformer, "segment_ingested_image", segment_ingested_image)
+    segmentation_cache.clear()
+    segformer = object.__new__(segmentation.ClothesSegformer)
+    bucket = TokenBucket("test", rate_per_second=0.001, burst=1, max_wait_seconds=0.0)
+
+    photo = io.BytesIO()
+    Image.new("RGB", (64, 48), (30, 120, 200)).save(photo, format="PNG")
+    for _ in range(3):
+        segformer.get_clothes_from_image(photo.getvalue(), use_cache=True, rate_limiter=bucket)
+    segmentation_cache.clear()
+
+    assert len(segmentations) == 1
+    with pytest.raises(RateLimitExceededError):
+        bucket.acquire_blocking()
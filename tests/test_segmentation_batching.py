@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("PIL")
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from PIL import Image
+
+from core import segmentation
+from core.inference_executor import InferenceExecutor
+from core.segmentation import ClothesSegformer, SegformerModelRegistry, initialize_inference_worker
+
+forward_passes = []
+
+
+def fake_processor(images, return_tensors):
+    return {"pixel_values": torch.zeros((len(images), 3, 8, 8))}
+
+
+def fake_model(pixel_values):
+    forward_passes.append((threading.current_thread().name, torch.get_num_threads(), len(pixel_values)))
+    return torch.zeros((len(pixel_values), 18, 2, 2))
+
+
+def segment_and_get_scheduler(image):
+    segformer = ClothesSegformer()
+    segformer.get_segmentation_map(image)
+    return segformer.batch_scheduler
+
+
+@pytest.fixture(autouse=True)
+def fake_segformer(monkeypatch):
+    monkeypatch.setattr(SegformerModelRegistry, "get", classmethod(lambda cls, model_name=None: (fake_processor,
+                                                                                                 fake_model)))
+    monkeypatch.setattr(SegformerModelRegistry, "_batch_schedulers", {})
+    monkeypatch.setattr(segmentation.Constants, "BATCH_MAX_SIZE", 4)
+    forward_passes.clear()
+
+
+def run_burst(layout: str, requests: int) -> set:
+    executor = InferenceExecutor(executor_type="thread", worker_layout=layout, max_queue_size=requests,
+                                 initializer=initialize_inference_worker)
+
+    async def burst():
+        image = Image.new("RGB", (8, 8))
+        return await asyncio.gather(*(executor.run(segment_and_get_scheduler, image) for _ in range(requests)))
+
+    try:
+        return set(asyncio.run(burst()))
+    finally:
+        executor.shutdown(wait=True)
+
+
+def test_each_layout_runs_its_forward_passes_with_its_own_threads():
+    first_schedulers = run_burst("2x1", requests=4)
+    second_schedulers = run_burst("2x3", requests=4)
+
+    # The workers of an executor share one scheduler, and every layout gets its own
+    assert len(first_schedulers) == 1 and len(second_schedulers) == 1
+    assert first_schedulers != second_schedulers
+
+    # Forward passes run on the batching thread, with the threads of all workers of the layout
+    assert {name for name, _, _ in forward_passes} == {"segformer-batcher"}
+    assert {threads for _, threads, _ in forward_passes} == {2, 6}
+
+
+def test_batches_are_capped_at_the_workers_that_can_fill_them(monkeypatch):
+    monkeypatch.setattr(segmentation.Constants, "BATCH_MAX_WAIT_MS", 2000.0)
+
+    # Two workers fill a batch of two right away, rather than waiting for four images that cannot come
+    start = time.perf_counter()
+    schedulers = run_burst("2x1", requests=4)
+    assert time.perf_counter() - start < 1.5
+    assert [scheduler.max_batch_size for scheduler in schedulers] == [2]
+
+    # A single worker has no one to batch with, so it runs its own forward passes without waiting
+    forward_passes.clear()
+    assert run_burst("1x2", requests=2) == {None}
+    assert {name for name, _, _ in forward_passes} == {"inference_0"}
@@ -0,0 +1,161 @@
+import asyncio
+import functools
+import json
+import os
+
+import pytest
+
+pytest.importorskip("PIL")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import numpy as np
+from PIL import Image
+
+from core.product_results import ProductResults
+from core.segmentation_cache import CachedSegmentation, segmentation_cache
+from telegram_bot import session_store
+from telegram_bot.session_backends import SqliteBackend, RedisBackend
+from telegram_bot.session_store import Session, SessionStore
+from utils.image_hashing import PhotoSignature
+
+MOCK_RESPONSE_PATH = os.path.join(os.path.dirname(__file__), "mock_data", "lykdat_global_search_response_mock.json")
+
+
+class FakeSearchEngine:
+    """
+    Holds detected clothes like SearchEngine, without loading the segmentation model.
+    """
+    def __init__(self):
+        self.detected_clothes = {}
+
+    def set_detected_clothes(self, detected_clothes: dict):
+        self.detected_clothes = detected_clothes
+
+
+class FakeBackgroundWork:
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture(autouse=True)
+def local_crops(monkeypatch, tmp_path):
+    monkeypatch.setattr(session_store, "SearchEngine", FakeSearchEngine)
+    monkeypatch.setattr(session_store, "save_crop",
+                        functools.partial(session_store.save_crop, crops_dir=str(tmp_path / "crops")))
+    monkeypatch.setattr(session_store, "prune_crops",
+                        functools.partial(session_store.prune_crops, crops_dir=str(tmp_path / "crops")))
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SqliteBackend(str(tmp_path / "sessions.sqlite3"))
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisBackend(client=fakeredis.FakeRedis())
+
+
+def build_session() -> Session:
+    with open(MOCK_RESPONSE_PATH) as f:
+        raw_results = json.load(f)["data"]["result_groups"][0]["similar_products"]
+    products = ProductResults(raw_results=raw_results)
+    products.mark_unusable(1)
+
+    search_engine = FakeSearchEngine()
+    search_engine.set_detected_clothes({"Hat": Image.new("RGB", (40, 30), (200, 10, 10))})
+
+    return Session({
+        "welcomed": True,
+        "clothe_types": ["Hat"],
+        "chosen_clothe_type": "Hat",
+        "current_product_index": 2,
+        "conversation_state": 2,
+        "search_engine": search_engine,
+        "products": {"Hat": products},
+    })
+
+
+def assert_same_session(loaded: Session, original: Session):
+    for field in session_store.PLAIN_FIELDS:
+        assert loaded[field] == original[field]
+
+    loaded_crop = loaded["search_engine"].detected_clothes["Hat"]
+    original_crop = original["search_engine"].detected_clothes["Hat"]
+    assert loaded_crop.size == original_crop.size
+    assert loaded_crop.tobytes() == original_crop.tobytes()
+
+    assert loaded["products"]["Hat"].to_dict() == original["products"]["Hat"].to_dict()
+
+
+def test_snapshot_round_trips_through_json():
+    session = build_session()
+    session.revision = 3
+
+    loaded = Session.from_snapshot(json.loads(json.dumps(session.snapshot())))
+
+    assert_same_session(loaded, session)
+    assert loaded.revision == 3
+
+
+def test_save_and_refresh_share_sessions_between_workers(backend):
+    first_worker, second_worker = SessionStore(backend=backend), SessionStore(backend=backend)
+    chat_id = 42
+
+    async def run():
+        first_worker[chat_id] = build_session()
+        await first_worker.save(chat_id)
+
+        await second_worker.refresh(chat_id)
+        assert_same_session(second_worker[chat_id], first_worker[chat_id])
+
+        # The second worker moves the chat on while the first one still has searches running
+        background_work = FakeBackgroundWork()
+        first_worker[chat_id]["speculative_searches"] = background_work
+        second_worker[chat_id]["current_product_index"] = 3
+        await second_worker.save(chat_id)
+
+        await first_worker.refresh(chat_id)
+        assert first_worker[chat_id]["current_product_index"] == 3
+        assert background_work.cancelled
+
+        # A copy that is already current is kept
+        current = first_worker[chat_id]
+        await first_worker.refresh(chat_id)
+        assert first_worker[chat_id] is current
+
+    asyncio.run(run())
+
+
+def test_crops_shared_with_the_segmentation_cache_are_not_counted():
+    session = build_session()
+    crop = session["search_engine"].detected_clothes["Hat"]
+    owned_size = session.estimate_size()
+
+    segmentation_cache.put("shared", CachedSegmentation(np.zeros((30, 40), dtype=np.uint8), {"Hat": crop},
+                                                        PhotoSignature(crop)))
+    try:
+        store = SessionStore()
+        store[1] = session
+        assert store.session_sizes() == {1: owned_size - crop.width * crop.height * 3}
+    finally:
+        segmentation_cache.clear()
+
+
+def test_crops_of_expired_sessions_are_pruned_in_the_background(backend):
+    store = SessionStore(idle_ttl_seconds=60, backend=backend)
+    expired_crop = session_store.save_crop(Image.new("RGB", (4, 4), (1, 2, 3)))
+    current_crop = session_store.save_crop(Image.new("RGB", (4, 4), (4, 5, 6)))
+    os.utime(expired_crop, (0, 0))
+
+    async def run():
+        pruning = asyncio.create_task(store.prune_crops_periodically(interval_seconds=0.01))
+        await asyncio.sleep(0.1)
+        pruning.cancel()
+
+    asyncio.run(run())
+
+    assert not os.path.exists(expired_crop)
+    assert os.path.exists(current_crop)
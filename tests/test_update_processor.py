@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram_bot.update_processor import PerChatUpdateProcessor
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class FakeUpdate:
+    def __init__(self, chat_id: int):
+        self.effective_chat = FakeChat(chat_id)
+
+
+def test_updates_run_in_order_per_chat_within_the_concurrency_bound():
+    chat_ids = (1, 2, 3, 4)
+    updates_per_chat = 6
+    max_concurrent_updates = 2
+
+    handled = {chat_id: [] for chat_id in chat_ids}
+    running = {"now": 0, "peak": 0}
+
+    async def handle(chat_id: int, index: int):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        # Later updates of a chat finish faster, so only the processor keeps them in order
+        await asyncio.sleep(0.002 * (updates_per_chat - index))
+        handled[chat_id].append(index)
+        running["now"] -= 1
+
+    async def send_updates():
+        processor = PerChatUpdateProcessor(max_concurrent_updates=max_concurrent_updates, max_pending_updates=64)
+        await asyncio.gather(*(
+            processor.process_update(FakeUpdate(chat_id), handle(chat_id, index))
+            for index in range(updates_per_chat)
+            for chat_id in chat_ids
+        ))
+
+    asyncio.run(send_updates())
+
+    assert handled == {chat_id: list(range(updates_per_chat)) for chat_id in chat_ids}
+    assert running["peak"] == max_concurrent_updates
+
+
+def test_on_arrival_sees_updates_before_they_wait_for_their_chat():
+    arrived, handled = [], []
+
+    async def handle(index: int):
+        await asyncio.sleep(0.01)
+        handled.append(index)
+
+    async def send_updates():
+        processor = PerChatUpdateProcessor(max_concurrent_updates=1, max_pending_updates=8,
+                                           on_arrival=lambda update: arrived.append(len(handled)))
+        await asyncio.gather(*(processor.process_update(FakeUpdate(1), handle(index)) for index in range(3)))
+
+    asyncio.run(send_updates())
+
+    # Every update arrived before the first one was handled
+    assert arrived == [0, 0, 0]
+    assert handled == [0, 1, 2]
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+from utils.metrics import metrics
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache with optional TTL, entry count and byte budgets.
+
+    Hits, misses and evictions are counted in utils.metrics under the cache's name,
+    and the current number of entries and bytes are published as gauges.
+
+    Attributes:
+        name (str): Prefix of the cache's metrics.
+        max_entries (int): The maximal number of entries, or None for no limit.
+        max_bytes (int): The maximal total size of the entries, or None for no limit.
+        ttl_seconds (float): Default lifetime of an entry, or None for no expiry.
+    """
+    def __init__(self, name: str, max_entries: int = None, max_bytes: int = None,
+                 ttl_seconds: float = None, size_of=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.size_of = size_of
+
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.peek(key) is not None
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def _publish_gauges(self):
+        metrics.set_gauge(f"{self.name}.entries", len(self._entries))
+        metrics.set_gauge(f"{self.name}.bytes", self._total_bytes)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at, _ = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove(key)
+            metrics.increment(f"{self.name}.expirations")
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for the key and counts a hit or a miss.
+        """
+        with self._lock:
+            value = self._lookup(key)
+
+        metrics.increment(f"{self.name}.hits" if value is not None else f"{self.name}.misses")
+        return default if value is None else value
+
+    def peek(self, key, default=None):
+        """
+        Returns the cached value for the key without counting a hit or a miss.
+        """
+        with self._lock:
+            value = self._lookup(key)
+        return default if value is None else value
+
+    def put(self, key, value, ttl_seconds: float = None):
+        """
+        Stores a value, evicting the least recently used entries if the cache goes over budget.
+        Values larger than the whole byte budget are not stored.
+
+        Args:
+            key: The cache key.
+            value: The value to store. Must not be None.
+            ttl_seconds (float, optional): Lifetime of this entry. Defaults to the cache's TTL.
+        """
+        size = self.size_of(value) if self.size_of else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = time.monotonic() + ttl_seconds if ttl_seconds is not None else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, size)
+            self._total_bytes += size
+
+            while self._entries and (
+                    (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                    (self.max_bytes is not None and self._total_bytes > self.max_bytes)):
+                self._remove(next(iter(self._entries)))
+                metrics.increment(f"{self.name}.evictions")
+
+            self._publish_gauges()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries[key][0]
+            self._remove(key)
+            self._publish_gauges()
+            return value
+
+    def items(self) -> list:
+        """
+        Returns a snapshot of the unexpired (key, value) pairs, least recently used first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (value, expires_at, _) in self._entries.items()
+                    if expires_at is None or expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+            self._publish_gauges()
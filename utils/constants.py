@@ -1,3 +1,6 @@
+from utils.env_manager import get_setting, CONFIG_DIR
+
+
 class SerpAPI:
 	SERPAPI_SEARCH_ENDPOINT = "https://serpapi.com/search"
 	SEARCH_MOCK_RESPONSE_PATH = "tests/mock_data/serpapi_mock_full_response.json"
@@ -6,14 +9,115 @@ class SerpAPI:
 	SHOPPING_RESULTS_PARSING_ERROR_MESSAGE = "Error parsing shopping results:"
 	SEARCH_ERROR_MESSAGE = "Error during SerpAPI search:"
 
+class RateLimits:
+	# Token buckets shared by all chats of a bot process: average calls per second and burst size
+	SEGMENTATION_PER_SECOND = get_setting("SNAPPO_SEGMENTATION_RATE", 4.0)
+	SEGMENTATION_BURST = get_setting("SNAPPO_SEGMENTATION_BURST", 8)
+	LYKDAT_PER_SECOND = get_setting("SNAPPO_LYKDAT_RATE", 2.0)
+	LYKDAT_BURST = get_setting("SNAPPO_LYKDAT_BURST", 5)
+	SERPAPI_PER_SECOND = get_setting("SNAPPO_SERPAPI_RATE", 2.0)
+	SERPAPI_BURST = get_setting("SNAPPO_SERPAPI_BURST", 5)
+	# Calls that would wait longer than this for their turn are rejected
+	MAX_WAIT_SECONDS = get_setting("SNAPPO_RATE_LIMIT_MAX_WAIT_SECONDS", 10.0)
+
+	RATE_LIMIT_EXCEEDED_MESSAGE = "Rate limit exceeded for"
+
+class SerpCache:
+	MAX_ENTRIES = get_setting("SNAPPO_SERP_CACHE_ENTRIES", 2048)
+	TTL_SECONDS = get_setting("SNAPPO_SERP_CACHE_TTL_SECONDS", 6 * 60 * 60.0)
+	# Searches that failed or found nothing are retried sooner
+	NEGATIVE_TTL_SECONDS = get_setting("SNAPPO_SERP_CACHE_NEGATIVE_TTL_SECONDS", 10 * 60.0)
+
 class LykdatAPI:
 	LYKDAT_GLOBAL_SEARCH_URL = "https://cloudapi.lykdat.com/v1/global/search"
 	GLOBAL_SEARCH_MOCK_RESPONSE_PATH = "tests/mock_data/lykdat_global_search_response_mock.json"
 
 	API_REQUEST_ERROR_MESSAGE = "API request error:"
 
+class LykdatCache:
+	ENABLED = get_setting("SNAPPO_LYKDAT_CACHE", True)
+	MAX_ENTRIES = get_setting("SNAPPO_LYKDAT_CACHE_ENTRIES", 512)
+	MAX_MEGABYTES = get_setting("SNAPPO_LYKDAT_CACHE_MB", 64)
+	DISK_MAX_ENTRIES = get_setting("SNAPPO_LYKDAT_CACHE_DISK_ENTRIES", 20000)
+	TTL_SECONDS = get_setting("SNAPPO_LYKDAT_CACHE_TTL_SECONDS", 24 * 60 * 60.0)
+	# An empty path keeps the cache in memory only
+	DATABASE_PATH = get_setting("SNAPPO_LYKDAT_CACHE_PATH", str(CONFIG_DIR / "lykdat_cache.sqlite3"))
+	# Crop fingerprints are 16x16 difference hashes; ones at most this many bits apart are candidates
+	HASH_SIZE = 16
+	MAX_HASH_DISTANCE = get_setting("SNAPPO_LYKDAT_CACHE_MAX_DISTANCE", 8)
+	# Candidates must also have the same size and grayscale thumbnails this close, in levels out of 255
+	THUMBNAIL_SIZE = 32
+	MAX_PIXEL_DIFFERENCE = get_setting("SNAPPO_LYKDAT_CACHE_MAX_PIXEL_DIFFERENCE", 3.0)
+
+	DATABASE_ERROR_MESSAGE = "Lykdat cache database error, continuing without it:"
+
+class SearchEngine:
+	FALLBACK_WORKERS = get_setting("SNAPPO_SERP_FALLBACK_WORKERS", 8)
+	# Time budget for all SerpAPI fallback lookups of one search
+	FALLBACK_DEADLINE_SECONDS = get_setting("SNAPPO_SERP_FALLBACK_DEADLINE_SECONDS", 12.0)
+	# Only the first SerpAPI result replaces a Lykdat product, so only that one is fetched
+	FALLBACK_LIMIT = 1
+	# Products tried per tap before giving up, each may cost an image fetch and a SerpAPI fallback
+	MAX_PRODUCTS_PER_REQUEST = get_setting("SNAPPO_MAX_PRODUCTS_PER_REQUEST", 3)
+
+class SpeculativeSearch:
+	# Start product searches for the largest detected items before the user picks one
+	ENABLED = get_setting("SNAPPO_SPECULATIVE_SEARCH", False)
+	MAX_ITEMS_PER_PHOTO = get_setting("SNAPPO_SPECULATIVE_MAX_ITEMS", 2)
+	# Speculative searches running at once across all chats, to cap API spend
+	MAX_CONCURRENT = get_setting("SNAPPO_SPECULATIVE_MAX_CONCURRENT", 4)
+
+class HttpClient:
+	# Distinct hosts with a kept-alive pool, and connections kept per host
+	POOL_HOSTS = get_setting("SNAPPO_HTTP_POOL_HOSTS", 32)
+	POOL_MAXSIZE = get_setting("SNAPPO_HTTP_POOL_MAXSIZE", 16)
+	MAX_RETRIES = get_setting("SNAPPO_HTTP_MAX_RETRIES", 3)
+	BACKOFF_FACTOR = get_setting("SNAPPO_HTTP_BACKOFF_FACTOR", 0.5)
+	RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+	# Statuses a POST is retried on: the server did not process it
+	POST_RETRY_STATUS_CODES = (429, 503)
+	CONNECT_TIMEOUT_SECONDS = get_setting("SNAPPO_HTTP_CONNECT_TIMEOUT_SECONDS", 3.05)
+	READ_TIMEOUT_SECONDS = get_setting("SNAPPO_HTTP_READ_TIMEOUT_SECONDS", 30.0)
+	# Experimental: negotiate HTTP/2 where the server supports it (urllib3 2.3+ with h2)
+	HTTP2_ENABLED = get_setting("SNAPPO_HTTP2", False)
+
+	HTTP2_UNAVAILABLE_MESSAGE = "HTTP/2 is not available, using HTTP/1.1:"
+
+class ProductImages:
+	FETCH_WORKERS = get_setting("SNAPPO_IMAGE_FETCH_WORKERS", 16)
+	# Time budget for downloading all images of one result set
+	FETCH_DEADLINE_SECONDS = get_setting("SNAPPO_IMAGE_FETCH_DEADLINE_SECONDS", 8.0)
+	REQUEST_TIMEOUT_SECONDS = get_setting("SNAPPO_IMAGE_REQUEST_TIMEOUT_SECONDS", 8.0)
+
+	# Shared on-disk store of verified product images
+	STORE_DIR = get_setting("SNAPPO_IMAGE_STORE_DIR", str(CONFIG_DIR / "product_images"))
+	STORE_MAX_MEGABYTES = get_setting("SNAPPO_IMAGE_STORE_MB", 512)
+	# Stored images are served without a request for this long, then revalidated with ETag / Last-Modified
+	STORE_FRESH_SECONDS = get_setting("SNAPPO_IMAGE_STORE_FRESH_SECONDS", 24 * 60 * 60.0)
+
+	STORE_UNAVAILABLE_ERROR_MESSAGE = "Product image store is unavailable, keeping images for this run only:"
+
 class ClothesSegformer:
 	B2_CLOTHES_MODEL_NAME = "mattmdjaga/segformer_b2_clothes"
+
+	# Concurrent requests are batched into one forward pass, capped at the inference workers of a process;
+	# a max batch size of 1 disables batching
+	BATCH_MAX_SIZE = get_setting("SNAPPO_SEGMENTATION_BATCH_SIZE", 4)
+	BATCH_MAX_WAIT_MS = get_setting("SNAPPO_SEGMENTATION_BATCH_WAIT_MS", 20.0)
+
+	# Resolution of the label argmax: "full" (original photo), "model" (logits) or "capped" (WORKING_MAX_SIDE)
+	SEGMENTATION_MAP_MODE = get_setting("SNAPPO_SEGMENTATION_MAP_MODE", "full")
+	WORKING_MAX_SIDE = get_setting("SNAPPO_SEGMENTATION_WORKING_MAX_SIDE", 1024)
+
+	# Cut item crops from the full-resolution photo instead of the capped working image
+	CROP_FROM_ORIGINAL = get_setting("SNAPPO_CROP_FROM_ORIGINAL", False)
+
+	# "eager", "torchscript", "compile", "quantized" or "onnx"
+	INFERENCE_BACKEND = get_setting("SNAPPO_SEGMENTATION_BACKEND", "eager")
+	ONNX_MODEL_PATH = get_setting("SNAPPO_SEGMENTATION_ONNX_PATH", str(CONFIG_DIR / "segformer_b2_clothes.onnx"))
+
+	MODEL_LOADED_MESSAGE = "Loaded segmentation model"
+	ONNX_RUNTIME_MISSING_ERROR_MESSAGE = "The onnx backend requires onnxruntime: pip install onnxruntime"
 	COLOR_MAP = {
 		0: [0, 0, 0],        # Background
 		1: [255, 0, 0],      # Hat
@@ -48,10 +152,78 @@ class ClothesSegformer:
 		17: "Scarf"
 	}
 
+class SegmentationCache:
+	ENABLED = get_setting("SNAPPO_SEGMENTATION_CACHE", True)
+	MAX_ENTRIES = get_setting("SNAPPO_SEGMENTATION_CACHE_ENTRIES", 256)
+	MAX_MEGABYTES = get_setting("SNAPPO_SEGMENTATION_CACHE_MB", 256)
+	TTL_SECONDS = get_setting("SNAPPO_SEGMENTATION_CACHE_TTL_SECONDS", 6 * 60 * 60.0)
+	# Perceptual hashes at most this many bits apart are candidates for the same photo
+	MAX_HASH_DISTANCE = get_setting("SNAPPO_SEGMENTATION_CACHE_MAX_DISTANCE", 4)
+	# Candidates must also have the same size and grayscale thumbnails this close, in levels out of 255
+	THUMBNAIL_SIZE = 32
+	MAX_PIXEL_DIFFERENCE = get_setting("SNAPPO_SEGMENTATION_CACHE_MAX_PIXEL_DIFFERENCE", 3.0)
+
+class ImageIngest:
+	# Longest side of the working image incoming photos are decoded to before segmentation
+	MAX_SIDE = get_setting("SNAPPO_INGEST_MAX_SIDE", 1024)
+
+class InferenceExecutor:
+	# "thread" or "process"
+	EXECUTOR_TYPE = get_setting("SNAPPO_INFERENCE_EXECUTOR", "thread")
+	# Workers x intra-op threads per worker, e.g. "2x2" runs two inferences at once with two threads each
+	WORKER_LAYOUT = get_setting("SNAPPO_INFERENCE_LAYOUT", "2x2")
+	PIN_CPU_AFFINITY = get_setting("SNAPPO_INFERENCE_PIN_CPUS", False)
+	MAX_QUEUE_SIZE = get_setting("SNAPPO_INFERENCE_QUEUE_SIZE", 8)
+	REQUEST_TIMEOUT_SECONDS = get_setting("SNAPPO_INFERENCE_TIMEOUT_SECONDS", 60.0)
+
+	QUEUE_FULL_ERROR_MESSAGE = "Inference queue is full:"
+	TIMEOUT_ERROR_MESSAGE = "Inference request timed out after"
+
+class SessionBackends:
+	# "none" keeps sessions in process memory only; "memory", "sqlite" or "redis" share serialized state
+	BACKEND = get_setting("SNAPPO_SESSION_BACKEND", "none")
+	SQLITE_PATH = get_setting("SNAPPO_SESSION_SQLITE_PATH", str(CONFIG_DIR / "sessions.sqlite3"))
+	REDIS_URL = get_setting("SNAPPO_SESSION_REDIS_URL", "redis://localhost:6379/0")
+	# Item crops of shared sessions, referenced by path; must be shared storage when workers run on several machines
+	CROPS_DIR = get_setting("SNAPPO_SESSION_CROPS_DIR", str(CONFIG_DIR / "session_crops"))
+	# How often crops no longer referenced by any stored session are removed
+	CROPS_PRUNE_INTERVAL_SECONDS = get_setting("SNAPPO_SESSION_CROPS_PRUNE_INTERVAL_SECONDS", 10 * 60.0)
+
+	REDIS_MISSING_ERROR_MESSAGE = "The redis session backend requires the redis package: pip install redis"
+
 class TelegramBot:
 	LOGGING_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
 	PHOTO_PROCESSING_ERROR_MESSAGE = "Error processing photo:"
+	SESSION_MEMORY_LOG_MESSAGE = "Active sessions:"
+	STALE_FILE_ID_LOG_MESSAGE = "Cached photo id was rejected, uploading again:"
+	METRICS_LOG_MESSAGE = "Metrics:"
+	PRODUCT_REJECTED_LOG_MESSAGE = "Product photo was rejected, skipping the product:"
+
+	# Chat sessions idle for longer are dropped; beyond the budgets the least recently used ones are trimmed
+	SESSION_IDLE_TTL_SECONDS = get_setting("SNAPPO_SESSION_IDLE_TTL_SECONDS", 30 * 60.0)
+	MAX_SESSIONS = get_setting("SNAPPO_MAX_SESSIONS", 1000)
+	SESSIONS_MAX_MEGABYTES = get_setting("SNAPPO_SESSIONS_MB", 256)
+	# How often all metrics are logged, 0 to never log them
+	METRICS_LOG_INTERVAL_SECONDS = get_setting("SNAPPO_METRICS_LOG_INTERVAL_SECONDS", 300.0)
+
+	# "polling" or "webhook"; the webhook is served by python-telegram-bot's built-in server
+	INGRESS_MODE = get_setting("SNAPPO_INGRESS_MODE", "polling")
+	WEBHOOK_LISTEN = get_setting("SNAPPO_WEBHOOK_LISTEN", "0.0.0.0")
+	WEBHOOK_PORT = get_setting("SNAPPO_WEBHOOK_PORT", 8443)
+	WEBHOOK_PATH = get_setting("SNAPPO_WEBHOOK_PATH", "telegram")
+	# Public URL registered with Telegram, e.g. https://bot.example.com/telegram; required in webhook mode
+	WEBHOOK_URL = get_setting("SNAPPO_WEBHOOK_URL", "")
+	WEBHOOK_SECRET_TOKEN = get_setting("SNAPPO_WEBHOOK_SECRET_TOKEN", "")
+
+	WEBHOOK_URL_MISSING_ERROR_MESSAGE = "Error: SNAPPO_WEBHOOK_URL must be set to the bot's public URL in webhook mode."
+
+	# Updates handled at once across chats, and accepted while waiting; each chat's updates still run in order
+	MAX_CONCURRENT_UPDATES = get_setting("SNAPPO_MAX_CONCURRENT_UPDATES", 16)
+	MAX_PENDING_UPDATES = get_setting("SNAPPO_MAX_PENDING_UPDATES", 256)
+
+	# Telegram file ids of uploaded product photos, reused instead of uploading the same bytes again
+	FILE_ID_CACHE_ENTRIES = get_setting("SNAPPO_TELEGRAM_FILE_ID_CACHE_ENTRIES", 10000)
 
 	class UserSessionDict:
 		SEARCH_ENGINE = "search_engine"
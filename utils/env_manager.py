@@ -69,3 +69,18 @@ def load_keys_from_config():
 		return True
 	except (json.JSONDecodeError, IOError):
 		return False
+
+
+def get_setting(key_name, default):
+	"""Get a runtime setting from environment variables, cast to the type of its default."""
+	value = os.environ.get(key_name)
+	if value is None:
+		return default
+
+	if isinstance(default, bool):
+		return value.strip().lower() in ("1", "true", "yes", "on")
+
+	try:
+		return type(default)(value)
+	except (TypeError, ValueError):
+		return default
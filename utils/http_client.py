@@ -0,0 +1,280 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.constants import HttpClient as Constants
+from utils.metrics import metrics
+
+
+def enable_http2():
+    """
+    Lets urllib3 negotiate HTTP/2 with servers that support it, through ALPN.
+    Needs urllib3 2.3+ and the h2 package. HTTP/2 support in urllib3 is experimental and
+    applies to every urllib3 pool in the process. Returns whether it was enabled.
+    """
+    try:
+        import urllib3.http2
+        urllib3.http2.inject_into_urllib3()
+        return True
+    except (ImportError, AttributeError) as e:
+        print(f"{Constants.HTTP2_UNAVAILABLE_MESSAGE} {e}")
+        return False
+
+
+def is_retryable_status(method: str, status_code: int) -> bool:
+    """
+    POSTs are paid searches, so they are only retried on statuses where the server did not process
+    them. Other requests are also retried on server errors.
+    """
+    if method.upper() == "POST":
+        return status_code in Constants.POST_RETRY_STATUS_CODES
+    return status_code in Constants.RETRY_STATUS_CODES
+
+
+def is_retryable_error(method: str, error: httpx.TransportError) -> bool:
+    """
+    A POST is retried only when it never reached the server, others after any transport error.
+    """
+    if method.upper() == "POST":
+        return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+    return True
+
+
+class SearchRetry(Retry):
+    """
+    urllib3 retries that also retry POSTs, but only on the statuses of is_retryable_status.
+    POSTs are not in allowed_methods, so urllib3 retries them after connect errors only.
+    """
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() == "POST":
+            return is_retryable_status(method, status_code)
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class HttpClient:
+    """
+    A shared HTTP client with a keep-alive connection pool per host and retries with
+    exponential backoff on 429 and 5xx responses (honouring Retry-After). POSTs are retried
+    only after connect errors, 429 and 503, so a paid search is never sent twice.
+
+    Per-host request latency is recorded in utils.metrics as "http.<host>.seconds", and
+    `connection_stats()` reports how often requests reused an open connection.
+
+    Attributes:
+        session (requests.Session): The underlying session, shared by all callers.
+        timeout (tuple): Default (connect, read) timeout in seconds.
+    """
+    def __init__(self,
+                 pool_hosts: int = Constants.POOL_HOSTS,
+                 pool_maxsize: int = Constants.POOL_MAXSIZE,
+                 max_retries: int = Constants.MAX_RETRIES,
+                 backoff_factor: float = Constants.BACKOFF_FACTOR,
+                 timeout: tuple = (Constants.CONNECT_TIMEOUT_SECONDS, Constants.READ_TIMEOUT_SECONDS)):
+        self.timeout = timeout
+
+        retry = SearchRetry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=Constants.RETRY_STATUS_CODES,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a request through the shared pool.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL to request.
+            **kwargs: Passed to requests.Session.request. `timeout` defaults to the client's timeout.
+
+        Returns:
+            requests.Response: The response, after any retries.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).hostname or "unknown"
+
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            metrics.increment(f"http.{host}.errors")
+            raise
+        finally:
+            metrics.observe(f"http.{host}.seconds", time.perf_counter() - start)
+
+        metrics.increment(f"http.{host}.requests")
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def connection_stats(self) -> dict:
+        """
+        Returns, per host, the number of requests sent, connections opened and the share of
+        requests that reused a kept-alive connection. Also publishes the reuse rates as gauges.
+
+        Returns:
+            dict: host -> {"requests", "connections", "reuse_rate"}
+        """
+        stats = {}
+        pools = self.adapter.poolmanager.pools
+
+        for key in pools.keys():
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue  # Evicted meanwhile
+
+            host_stats = stats.setdefault(pool.host, {"requests": 0, "connections": 0})
+            host_stats["requests"] += pool.num_requests
+            host_stats["connections"] += pool.num_connections
+
+        for host, host_stats in stats.items():
+            requests_sent = host_stats["requests"]
+            host_stats["reuse_rate"] = 1 - host_stats["connections"] / requests_sent if requests_sent else 0.0
+            metrics.set_gauge(f"http.{host}.connection_reuse_rate", host_stats["reuse_rate"])
+
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncHttpClient:
+    """
+    The asyncio counterpart of HttpClient, built on httpx. Keeps a kept-alive connection pool,
+    retries 429 and 5xx responses with exponential backoff (honouring Retry-After), with the
+    same restrictions for POSTs, and
+    negotiates HTTP/2 when SNAPPO_HTTP2 is set and the h2 package is installed.
+
+    An httpx client belongs to the event loop it was first used on, see get_async_http_client.
+    """
+    def __init__(self,
+                 pool_maxsize: int = Constants.POOL_MAXSIZE,
+                 max_retries: int = Constants.MAX_RETRIES,
+                 backoff_factor: float = Constants.BACKOFF_FACTOR,
+                 timeout: tuple = (Constants.CONNECT_TIMEOUT_SECONDS, Constants.READ_TIMEOUT_SECONDS)):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        connect_timeout, read_timeout = timeout
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=pool_maxsize * 4),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            http2=Constants.HTTP2_ENABLED and self.is_http2_available(),
+            follow_redirects=True,
+        )
+
+    @staticmethod
+    def is_http2_available() -> bool:
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            print(f"{Constants.HTTP2_UNAVAILABLE_MESSAGE} the h2 package is not installed")
+            return False
+
+    def get_retry_delay(self, response: httpx.Response, attempt: int) -> float:
+        """
+        Returns how long to wait before retrying, from Retry-After if the server sent one.
+        """
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff_factor * (2 ** attempt)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Sends a request through the shared pool, retrying transient failures.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL to request.
+            **kwargs: Passed to httpx.AsyncClient.request.
+
+        Returns:
+            httpx.Response: The response, after any retries.
+        """
+        host = urlsplit(url).hostname or "unknown"
+        start = time.perf_counter()
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                is_last_attempt = attempt == self.max_retries
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    if is_last_attempt or not is_retryable_error(method, e):
+                        metrics.increment(f"http.{host}.errors")
+                        raise
+                    await asyncio.sleep(self.get_retry_delay(None, attempt))
+                    continue
+
+                if not is_retryable_status(method, response.status_code) or is_last_attempt:
+                    metrics.increment(f"http.{host}.requests")
+                    return response
+
+                metrics.increment(f"http.{host}.retries")
+                await asyncio.sleep(self.get_retry_delay(response, attempt))
+        finally:
+            metrics.observe(f"http.{host}.seconds", time.perf_counter() - start)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_async_http_client = None
+_async_http_client_loop = None
+
+
+def get_async_http_client() -> AsyncHttpClient:
+    """
+    Returns the shared async HTTP client of the running event loop, creating it on first use.
+    """
+    global _async_http_client, _async_http_client_loop
+
+    loop = asyncio.get_running_loop()
+    if _async_http_client is None or _async_http_client_loop is not loop:
+        _async_http_client = AsyncHttpClient()
+        _async_http_client_loop = loop
+    return _async_http_client
+
+
+async def close_async_http_client():
+    """
+    Closes the shared async HTTP client, if one was created.
+    """
+    global _async_http_client, _async_http_client_loop
+
+    if _async_http_client is not None:
+        await _async_http_client.close()
+        _async_http_client, _async_http_client_loop = None, None
+
+
+if Constants.HTTP2_ENABLED:
+    enable_http2()
+
+# Process-wide HTTP client, shared by the Lykdat, SerpAPI and product image calls
+http_client = HttpClient()
@@ -0,0 +1,93 @@
+import hashlib
+
+import numpy as np
+from PIL import Image
+
+
+def content_hash(data) -> str:
+    """
+    Returns the SHA-256 hex digest of the given bytes.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def image_content_hash(image: Image.Image) -> str:
+    """
+    Returns a hash of the decoded pixels of an image, independent of how it was encoded.
+    """
+    digest = hashlib.sha256(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    Computes the difference hash of an image: one bit per pixel pair of a tiny grayscale copy,
+    set when the left pixel is brighter than its right neighbour. Re-encoded or slightly
+    resized copies of the same photo get identical or very close hashes.
+
+    Args:
+        image (Image): The image to hash.
+        hash_size (int): The hash is hash_size * hash_size bits.
+
+    Returns:
+        int: The perceptual hash.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = small.tobytes()
+
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """
+    Returns the number of differing bits between two hashes.
+    """
+    return bin(first ^ second).count("1")
+
+
+class PhotoSignature:
+    """
+    What a near-identical lookup compares photos by.
+
+    Attributes:
+        perceptual_hash (int): The difference hash of the photo, to find candidates quickly.
+        size (tuple): The (width, height) of the photo.
+        thumbnail (np.ndarray): A small grayscale copy of the photo, to confirm a candidate.
+    """
+    __slots__ = ("perceptual_hash", "size", "thumbnail")
+
+    def __init__(self, image: Image.Image, hash_size: int = 8, thumbnail_size: int = 32):
+        self.perceptual_hash = dhash(image, hash_size)
+        self.size = image.size
+        thumbnail = image.convert("L").resize((thumbnail_size, thumbnail_size), Image.BILINEAR)
+        self.thumbnail = np.asarray(thumbnail, dtype=np.int16)
+
+    @classmethod
+    def from_record(cls, perceptual_hash: int, size: tuple, thumbnail: bytes):
+        """
+        Rebuilds a signature from its hash, its size and the bytes of its thumbnail, as stored by a cache.
+        """
+        signature = cls.__new__(cls)
+        signature.perceptual_hash = perceptual_hash
+        signature.size = tuple(size)
+        side = int(len(thumbnail) ** 0.5)
+        signature.thumbnail = np.frombuffer(thumbnail, dtype=np.uint8).reshape(side, side).astype(np.int16)
+        return signature
+
+    def thumbnail_bytes(self) -> bytes:
+        return self.thumbnail.astype(np.uint8).tobytes()
+
+    def matches(self, other, max_distance: int, max_pixel_difference: float) -> bool:
+        """
+        Returns whether two photos are the same up to re-encoding. The hashes only look at the
+        overall layout, so photos sharing a background are told apart by their thumbnails.
+        """
+        return (self.size == other.size
+                and hamming_distance(self.perceptual_hash, other.perceptual_hash) <= max_distance
+                and float(np.abs(self.thumbnail - other.thumbnail).mean()) <= max_pixel_difference)
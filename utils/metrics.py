@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    A minimal in-process metrics registry for counters, gauges and latency samples.
+    Values are kept in memory and can be inspected at any time through `snapshot()`, which the bot
+    logs every SNAPPO_METRICS_LOG_INTERVAL_SECONDS.
+    """
+    max_samples = 1024
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._timings = defaultdict(lambda: deque(maxlen=self.max_samples))
+
+    def increment(self, name: str, value: int = 1):
+        """
+        Increments a counter by the given value.
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        """
+        Sets a gauge to the given value.
+        """
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        """
+        Records a single latency sample, in seconds.
+        """
+        with self._lock:
+            self._timings[name].append(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Context manager that records the duration of its block as a latency sample.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def get_counter(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def get_gauge(self, name: str, default=None):
+        with self._lock:
+            return self._gauges.get(name, default)
+
+    @staticmethod
+    def summarize_samples(samples) -> dict:
+        """
+        Summarizes a list of latency samples into count, average, p50, p95 and max.
+
+        Args:
+            samples (list[float]): Latency samples in seconds.
+
+        Returns:
+            dict: The summary statistics, all in seconds.
+        """
+        ordered = sorted(samples)
+        if not ordered:
+            return {"count": 0, "avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+
+        def percentile(fraction):
+            return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+        return {
+            "count": len(ordered),
+            "avg": sum(ordered) / len(ordered),
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "max": ordered[-1],
+        }
+
+    def snapshot(self) -> dict:
+        """
+        Returns a point-in-time copy of all counters, gauges and latency summaries.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timings = {name: list(samples) for name, samples in self._timings.items()}
+
+        return {
+            "counters": counters,
+            "gauges": gauges,
+            "timings": {name: self.summarize_samples(samples) for name, samples in timings.items()},
+        }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+
+
+def get_resident_memory_mb() -> float:
+    """
+    Returns the current resident set size of this process in megabytes.
+    Falls back to the peak resident size on platforms without /proc.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    import sys
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# Process-wide metrics registry
+metrics = Metrics()
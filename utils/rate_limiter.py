@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+
+from utils.constants import RateLimits as Constants
+from utils.metrics import metrics
+
+
+class RateLimitExceededError(Exception):
+    """
+    Raised when a call would have to wait longer than allowed for its rate limit.
+    """
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: `rate_per_second` calls on average, with bursts of up to `burst` calls.
+
+    Callers reserve a token and then wait for it, so waiting callers are served in order and
+    never wake up to find their token taken. A caller that would wait longer than `max_wait_seconds`
+    gets RateLimitExceededError instead, without using a token, and a caller cancelled while waiting
+    gives its token back.
+
+    Throttled calls are counted in utils.metrics as "rate_limit.<name>.throttled", and waits are
+    recorded as "rate_limit.<name>.wait_seconds".
+    """
+    def __init__(self, name: str, rate_per_second: float, burst: int,
+                 max_wait_seconds: float = Constants.MAX_WAIT_SECONDS):
+        self.name = name
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_wait_seconds = max_wait_seconds
+
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, max_wait_seconds: float):
+        """
+        Takes a token, possibly one that is yet to be refilled, and returns how long to wait for it,
+        or None without taking it if that would be longer than max_wait_seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate_per_second)
+            self._updated_at = now
+
+            wait_seconds = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate_per_second
+            if wait_seconds > max_wait_seconds:
+                return None
+
+            # Goes negative while callers are waiting for tokens not refilled yet
+            self._tokens -= 1
+            return wait_seconds
+
+    def _refund(self):
+        """
+        Returns a reserved token that was not used, e.g. because its caller was cancelled while waiting.
+        """
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def _reserve_or_raise(self, max_wait_seconds: float) -> float:
+        max_wait_seconds = self.max_wait_seconds if max_wait_seconds is None else max_wait_seconds
+        wait_seconds = self._reserve(max_wait_seconds)
+        if wait_seconds is None:
+            metrics.increment(f"rate_limit.{self.name}.throttled")
+            raise RateLimitExceededError(f"{Constants.RATE_LIMIT_EXCEEDED_MESSAGE} {self.name}")
+
+        metrics.observe(f"rate_limit.{self.name}.wait_seconds", wait_seconds)
+        return wait_seconds
+
+    async def acquire(self, max_wait_seconds: float = None):
+        """
+        Waits on the event loop until the call may proceed.
+
+        Args:
+            max_wait_seconds (float, optional): Longest acceptable wait. Defaults to the bucket's.
+
+        Raises:
+            RateLimitExceededError: If the wait would be longer.
+        """
+        wait_seconds = self._reserve_or_raise(max_wait_seconds)
+        if wait_seconds > 0:
+            try:
+                await asyncio.sleep(wait_seconds)
+            except asyncio.CancelledError:
+                self._refund()
+                raise
+
+    def acquire_blocking(self, max_wait_seconds: float = None):
+        """
+        The blocking counterpart of acquire, for threads.
+        """
+        wait_seconds = self._reserve_or_raise(max_wait_seconds)
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+
+# Process-wide limits on the expensive pipeline stages, shared by all chats
+segmentation_rate_limiter = TokenBucket("segmentation", Constants.SEGMENTATION_PER_SECOND, Constants.SEGMENTATION_BURST)
+lykdat_rate_limiter = TokenBucket("lykdat", Constants.LYKDAT_PER_SECOND, Constants.LYKDAT_BURST)
+serpapi_rate_limiter = TokenBucket("serpapi", Constants.SERPAPI_PER_SECOND, Constants.SERPAPI_BURST)